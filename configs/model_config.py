@@ -11,6 +11,12 @@ logging.basicConfig(format=LOG_FORMAT)
 # 在以下字典中修改属性值，以指定本地embedding模型存储位置
 # 如将 "text2vec": "GanymedeNil/text2vec-large-chinese" 修改为 "text2vec": "User/Downloads/text2vec-large-chinese"
 # 此处请写绝对路径
+# 属性值也可以是字典，通过 backend 选择计算后端："torch"（默认，sentence_transformers）或 "onnx"。
+# onnx 后端的模型需先导出到 EMBEDDING_CACHE_PATH/onnx 下：放入 EMBEDDING_PRELOAD 在服务启动时导出，
+# 或运行 python init_database.py --export-onnx，未导出时请求会直接报错。quantize 为 True 时做 int8 动态量化，
+# num_threads 为 ONNX Runtime 线程数（0 为 CPU 核数）。导出后的向量与原模型兼容，可直接用于已有的向量库，
+# 样例句子上余弦相似度 fp32 不低于 0.9999、int8 不低于 0.99，否则自动退回 torch 后端。
+# 如 "m3e-base": {"model_path": "/path/to/m3e-base", "backend": "onnx", "quantize": True, "num_threads": 0}
 embedding_model_dict = {
     "ernie-tiny": "nghuyong/ernie-3.0-nano-zh",
     "ernie-base": "nghuyong/ernie-3.0-base-zh",
@@ -33,6 +39,75 @@ EMBEDDING_MODEL = "m3e-base"
 # Embedding 模型运行设备
 EMBEDDING_DEVICE = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
 
+# 嵌入模型与重排模型缓存可占用的内存（MB），使用不同嵌入模型的知识库交替访问时多个模型可同时驻留，超出时淘汰最近最少使用的模型
+CACHED_EMBEDDING_MEMORY = 4096
+
+# 服务启动时预先加载的嵌入模型，onnx 后端的模型尚未导出时先导出
+EMBEDDING_PRELOAD = [EMBEDDING_MODEL]
+
+# 嵌入模型动态批处理：并发请求的查询与入库文本段由后台线程合并为一批计算。
+# EMBEDDING_BATCH_SIZE 为每批最多文本数，EMBEDDING_BATCH_MAX_WAIT 为最早的请求最多等待的秒数
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_BATCH_MAX_WAIT = 0.005
+
+# 批量入库（folder2db / recreate_all_vs）的并行度：INGEST_WORKERS 为读取、切分文件的进程数（0 表示 CPU 核数），
+# INGEST_EMBED_THREADS 为同时提交给嵌入模型的文件数，INGEST_QUEUE_SIZE 为各阶段之间最多积压的文件数
+INGEST_WORKERS = 0
+INGEST_EMBED_THREADS = 4
+INGEST_QUEUE_SIZE = 16
+
+# upload_doc 指定 background 时及分块上传完成后，入库任务保存在数据库的任务队列中由工作进程在后台处理，同一知识库的任务依次执行。
+# 默认 0：API 服务不处理任务，需另行运行 python job_worker.py --workers N 启动工作进程（可部署在其他机器上，共用数据库和知识库目录）；
+# 大于 0 时 API 服务启动 JOB_WORKERS 个工作进程，每个进程各自加载嵌入模型；设为 -1 时在 API 服务进程的后台线程中处理，共用已加载的嵌入模型。
+# JOB_POLL_INTERVAL 为空闲时查询新任务的间隔（秒）
+JOB_WORKERS = 0
+JOB_POLL_INTERVAL = 1.0
+# 工作进程每 JOB_HEARTBEAT_INTERVAL 秒刷新一次所处理任务的心跳，超过 JOB_HEARTBEAT_EXPIRE 秒没有心跳的任务
+# 视为其工作进程已退出，由其他工作进程重新放回队列
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_HEARTBEAT_EXPIRE = 60
+
+# 上传文件时每次读取、写入的分块大小（字节），上传的文件不会整个读入内存
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 分块上传（upload_init / upload_part / upload_complete）超过该时间（秒）未更新时清理其临时文件
+UPLOAD_SESSION_EXPIRE = 24 * 3600
+
+# upload_docs 上传的压缩包中最多的条目数和解压后的最大总大小（字节），防止解压炸弹占满磁盘
+UPLOAD_ARCHIVE_MAX_FILES = 10000
+UPLOAD_ARCHIVE_MAX_SIZE = 4 * 1024 ** 3
+
+# 交叉编码器重排模型，知识库问答时对召回的文本段重新排序，可同 embedding_model_dict 一样改为本地路径
+reranker_model_dict = {
+    "bge-reranker-base": "BAAI/bge-reranker-base",
+    "bge-reranker-large": "BAAI/bge-reranker-large",
+}
+
+# 知识库问答是否默认启用重排，可在请求中通过 rerank 参数覆盖
+USE_RERANKER = False
+
+# 选用的重排模型名称
+RERANKER_MODEL = "bge-reranker-base"
+
+# 重排模型运行设备
+RERANKER_DEVICE = "cpu"
+
+# 启用重排时先召回 top_k * RERANK_CANDIDATE_FACTOR 个候选，重排后取 top_k 个
+RERANK_CANDIDATE_FACTOR = 4
+
+# 问题与文本段拼接后的最大 token 数
+RERANK_MAX_LENGTH = 512
+
+# 重排预计耗时（含排队等待）超过该秒数时跳过重排，直接使用检索顺序，设为 None 不限制
+RERANK_LATENCY_BUDGET = 0.5
+
+# 因超出预算跳过重排后，距上次重排超过该秒数且没有排队的请求时放行一次，重新测量耗时，
+# 避免一次偶发的慢批次（冷启动、GC 停顿）使重排一直处于关闭状态
+RERANK_PROBE_INTERVAL = 10
+
+# 缓存的 (问题, 文本段) 重排分数条数
+RERANK_CACHE_SIZE = 10000
+
 
 llm_model_dict = {
     "chatglm-6b": {
@@ -97,6 +172,18 @@ if not os.path.exists(LOG_PATH):
 # 知识库默认存储路径
 KB_ROOT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "knowledge_base")
 
+# 向量缓存存储路径
+EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "embedding_cache")
+
+# 查询向量缓存可占用的内存（MB），按 (嵌入模型, 规范化后的查询) 缓存 embed_query 的结果
+QUERY_EMBEDDING_CACHE_MEMORY = 64
+
+# 是否将查询向量缓存持久化到 EMBEDDING_CACHE_PATH 下，服务重启后仍然有效
+QUERY_EMBEDDING_CACHE_PERSIST = False
+
+# 是否在 EMBEDDING_CACHE_PATH 下按 (嵌入模型, 文本 sha256) 缓存文本段向量，文件更新、重建向量库时内容未变的文本段不再重新计算向量
+CHUNK_EMBEDDING_CACHE = True
+
 # 数据库默认存储路径。
 # 如果使用sqlite，可以直接修改DB_ROOT_PATH；如果使用其它数据库，请直接修改SQLALCHEMY_DATABASE_URI。
 DB_ROOT_PATH = os.path.join(KB_ROOT_PATH, "info.db")
@@ -121,8 +208,47 @@ kbs_config = {
 # 默认向量库类型。可选：faiss, milvus, pg.
 DEFAULT_VS_TYPE = "faiss"
 
-# 缓存向量库数量
-CACHED_VS_NUM = 1
+# 缓存向量库占用内存上限(MB)，超出后淘汰最近最少使用的向量库
+CACHED_VS_MEMORY = 1024
+
+# FAISS 知识库新增文件时只追加写入增量段，增量段数量达到该值后在后台合并进基础段
+FAISS_MERGE_DELTAS = 10
+
+# 删除的文本段只记为墓碑，检索时每个段需多取其中被删除的向量数个结果再过滤，墓碑数量达到该值后在后台合并，物理删除这些向量
+FAISS_MERGE_TOMBSTONES = 2000
+
+# 是否以只读内存映射方式加载 FAISS 索引文件。开启后同一主机上的多个 API 进程共享操作系统页缓存中的向量，
+# 加载时间不再随索引大小增长，适合多 worker 部署的检索服务
+FAISS_MMAP_LOAD = False
+
+# FAISS 知识库默认的向量索引类型，可在创建知识库时为每个知识库单独指定:
+# flat: 精确检索；hnsw: 图索引，召回高、无需训练；ivf_flat / ivf_pq: 倒排索引，需要训练，适合大规模知识库（ivf_pq 额外压缩向量）
+# ivf 类索引在向量数达到 min_train_size 前保持 flat，达到后在合并增量段时自动训练；nlist 为 0 时按 4*sqrt(向量数) 自动选择
+# nprobe / ef_search 为默认检索参数，可在 search_docs 接口中按请求覆盖
+FAISS_INDEX_TYPE = "flat"
+FAISS_INDEX_TYPES = {
+    "flat": {},
+    "hnsw": {"M": 32, "ef_construction": 40, "ef_search": 64},
+    "ivf_flat": {"nlist": 0, "nprobe": 16, "min_train_size": 10000},
+    "ivf_pq": {"nlist": 0, "nprobe": 16, "min_train_size": 10000, "m": 16, "nbits": 8},
+}
+
+# FAISS 知识库默认的向量压缩方式，可在创建知识库时为每个知识库单独指定，压缩后同一主机可容纳更多知识库:
+# none: 不压缩(float32)；fp16: 半精度，内存减半；sq8: 8bit 标量量化，内存为 1/4；pq: 乘积量化，压缩率最高
+# pq 需要训练，向量数达到 min_train_size 前使用 sq8；m 需能整除向量维度，不能整除时自动调整
+FAISS_VECTOR_CODEC = "none"
+FAISS_VECTOR_CODECS = {
+    "none": {},
+    "fp16": {},
+    "sq8": {},
+    "pq": {"m": 64, "nbits": 8, "min_train_size": 10000},
+}
+
+# 使用有损压缩时，先按压缩向量取 top_k * FAISS_RERANK_FACTOR 个候选，再用磁盘上的原始向量精确重排，设为 0 不重排
+FAISS_RERANK_FACTOR = 4
+
+# 按文件过滤检索时，hnsw 索引中满足过滤条件的向量不超过该数量时直接精确计算距离（过滤条件严格时图检索召回不足）
+FAISS_FILTER_EXACT_MAX = 10000
 
 # 知识库中单段文本长度
 CHUNK_SIZE = 250
@@ -130,12 +256,39 @@ CHUNK_SIZE = 250
 # 知识库中相邻文本重合长度
 OVERLAP_SIZE = 50
 
+# 服务启动及入库子进程启动时预先构建的文本分词器，分词器实例在进程内缓存复用，SpacyTextSplitter 只加载一次 spaCy 模型
+TEXT_SPLITTER_PRELOAD = ["SpacyTextSplitter"]
+# 文本分词器构建失败（如 spaCy 模型未安装）后，该时间（秒）内直接报错不再重试，之后再次尝试构建
+TEXT_SPLITTER_RETRY_INTERVAL = 60
+
 # 知识库匹配向量数量
 VECTOR_SEARCH_TOP_K = 5
 
 # 知识库匹配相关度阈值，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右
 SCORE_THRESHOLD = 1
 
+# 多知识库联合检索时并发检索的线程数
+MULTI_KB_SEARCH_WORKERS = 8
+
+# 知识库问答的检索（问题向量化、加载索引、检索、重排）在独立的线程池中执行，不阻塞事件循环，
+# 该值为同时进行检索的最大请求数，超出的请求排队等待
+RETRIEVAL_WORKERS = 4
+
+# 知识库检索方式：vector 仅向量检索，bm25 仅关键词检索，hybrid 向量与 BM25 结果按 RRF 融合。
+# BM25 倒排索引（jieba 分词）在添加文件时建立，保存在知识库目录下的 bm25.db 中。
+# bm25 / hybrid 返回的是按排名计算的分数，与向量检索的距离含义不同，score_threshold 需要相应调整；
+# 在此之前创建的知识库没有倒排索引，使用前需先运行 python init_database.py --build-bm25
+SEARCH_MODE = "vector"
+
+# 混合检索时向量检索与 BM25 检索各召回 top_k * HYBRID_CANDIDATE_FACTOR 个候选参与融合
+HYBRID_CANDIDATE_FACTOR = 3
+
+# RRF 融合常数 k，文本段得分为各路 1/(k + 排名) 之和
+HYBRID_RRF_K = 60
+
+# BM25 检索时忽略文档频率占比超过该值的查询词（类似停用词），大知识库上可显著降低检索耗时
+BM25_MAX_DF_RATIO = 0.1
+
 # 搜索引擎匹配结题数量
 SEARCH_ENGINE_TOP_K = 5
 
@@ -1,4 +1,5 @@
-from server.knowledge_base.migrate import create_tables, folder2db, recreate_all_vs, list_kbs_from_folder
+from server.knowledge_base.migrate import (create_tables, folder2db, recreate_all_vs, list_kbs_from_folder,
+                                          build_all_bm25_indexes)
 from configs.model_config import NLTK_DATA_PATH, KB_ROOT_PATH
 import nltk
 import os
@@ -20,14 +21,46 @@ if __name__ == "__main__":
             '''
         )
     )
+    parser.add_argument(
+        "--build-bm25",
+        action="store_true",
+        help=('''
+            build the BM25 index of knowledge bases that do not have one yet, without touching vector stores.
+            not needed with --recreate-vs, which builds it along with the vector stores.
+            run it once before setting SEARCH_MODE to bm25/hybrid if your knowledge bases were created by an older version.
+            '''
+        )
+    )
+    parser.add_argument(
+        "--export-onnx",
+        nargs="*",
+        metavar="MODEL",
+        help=('''
+            export embedding models with backend "onnx" in embedding_model_dict (all of them if no model is given).
+            models that are not exported fail at request time unless they are in EMBEDDING_PRELOAD.
+            '''
+        )
+    )
     args = parser.parse_args()
 
+    if args.export_onnx is not None:
+        from configs.model_config import embedding_model_dict
+        from server.knowledge_base.utils import export_onnx_embeddings
+        for model in args.export_onnx or list(embedding_model_dict):
+            info = export_onnx_embeddings(model)
+            if info is not None:
+                print(f"exported {model} ({info['precision']}), min cosine {info['min_cosine']:.5f}")
+        exit(0)
+
     create_tables()
     print("database talbes created")
 
     if args.recreate_vs:
         print("recreating all vector stores")
         recreate_all_vs()
+    elif args.build_bm25:
+        print("building bm25 indexes")
+        build_all_bm25_indexes()
     else:
         print("filling kb infos to database")
         for f in os.listdir(KB_ROOT_PATH):
@@ -0,0 +1,37 @@
+from server.knowledge_base.migrate import create_tables
+from server.knowledge_base.job_queue import run_job_worker, start_job_workers, stop_job_workers
+import os
+import socket
+import time
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.formatter_class = argparse.RawTextHelpFormatter
+
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help=('''
+            number of worker processes that process the background upload jobs (upload_doc with background=True
+            and chunked uploads). every worker loads its own embedding model.
+            run this alongside the api server when JOB_WORKERS = 0, on the same machine or on another one sharing
+            the database and KB_ROOT_PATH.
+            '''
+        )
+    )
+    args = parser.parse_args()
+
+    create_tables()
+    if args.workers <= 1:
+        # 只有一个工作进程时直接在当前进程中处理，Ctrl+C 退出后未完成的任务在心跳超时后重新处理
+        run_job_worker(f"{socket.gethostname()}-{os.getpid()}")
+    else:
+        start_job_workers(args.workers)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stop_job_workers()
@@ -17,12 +17,17 @@ from server.information.information_api import (login_for_access_token, register
                                                 create_message)
 from server.chat import (chat, knowledge_base_chat, openai_chat,
                          search_engine_chat)
-from server.knowledge_base.kb_api import list_kbs, create_kb, delete_kb
+from server.knowledge_base.kb_api import list_kbs, create_kb, delete_kb, cache_stats
 from server.knowledge_base.kb_doc_api import (list_docs, upload_doc, delete_doc,
-                                              update_doc, download_doc, recreate_vector_store,
-                                              search_docs, DocumentWithScore)
-from server.utils import BaseResponse, ListResponse, FastAPI, MakeFastAPIOffline, ConversationResponse, MessageResponse
-from typing import List
+                                              update_doc, download_doc, recreate_vector_store, job_status,
+                                              upload_docs, upload_init, upload_status, upload_part, upload_complete,
+                                              search_docs, search_docs_batch, search_docs_multi,
+                                              DocumentWithScore)
+from server.knowledge_base.migrate import create_tables
+from server.knowledge_base.utils import preload_embeddings, preload_text_splitters
+from server.knowledge_base.job_queue import start_job_workers, stop_job_workers
+from server.utils import BaseResponse, ListResponse, StatsResponse, JobResponse, FastAPI, MakeFastAPIOffline, ConversationResponse, MessageResponse
+from typing import List, Union
 
 nltk.data.path = [NLTK_DATA_PATH] + nltk.data.path
 
@@ -49,6 +54,14 @@ def create_app():
             allow_headers=["*"],
         )
 
+    # 启动时创建数据库表，并为旧版本数据库补充新增的字段
+    app.on_event("startup")(create_tables)
+    app.on_event("startup")(preload_embeddings)
+    app.on_event("startup")(preload_text_splitters)
+    # JOB_WORKERS 不为 0 时在 API 服务中处理后台入库任务，否则需另行运行 python job_worker.py
+    app.on_event("startup")(start_job_workers)
+    app.on_event("shutdown")(stop_job_workers)
+
     # 创建中间件，对除登录和注册的所有请求进行token验证
     # Create middleware to verify token for all requests except login and register
     from server.information.information_api import get_current_user
@@ -156,12 +169,60 @@ def create_app():
              summary="搜索知识库"
              )(search_docs)
 
+    app.post("/knowledge_base/search_docs_batch",
+             tags=["Knowledge Base Management"],
+             response_model=List[List[DocumentWithScore]],
+             summary="批量搜索知识库"
+             )(search_docs_batch)
+
+    app.post("/knowledge_base/search_docs_multi",
+             tags=["Knowledge Base Management"],
+             response_model=List[DocumentWithScore],
+             summary="联合检索多个知识库"
+             )(search_docs_multi)
+
     app.post("/knowledge_base/upload_doc",
              tags=["Knowledge Base Management"],
-             response_model=BaseResponse,
-             summary="上传文件到知识库"
+             response_model=Union[JobResponse, BaseResponse],
+             summary="上传文件到知识库，background 为 True 时返回后台入库任务"
              )(upload_doc)
 
+    app.post("/knowledge_base/upload_docs",
+             tags=["Knowledge Base Management"],
+             response_model=BaseResponse,
+             summary="批量上传文件（支持 zip、tar 压缩包）并作为一批入库，流式逐行返回文件状态，知识库不存在时返回 BaseResponse"
+             )(upload_docs)
+
+    app.post("/knowledge_base/upload_init",
+             tags=["Knowledge Base Management"],
+             response_model=JobResponse,
+             summary="开始分块上传大文件，支持断点续传"
+             )(upload_init)
+
+    app.get("/knowledge_base/upload_status",
+            tags=["Knowledge Base Management"],
+            response_model=JobResponse,
+            summary="查询分块上传已接收的字节数"
+            )(upload_status)
+
+    app.post("/knowledge_base/upload_part",
+             tags=["Knowledge Base Management"],
+             response_model=JobResponse,
+             summary="上传一个文件分块"
+             )(upload_part)
+
+    app.post("/knowledge_base/upload_complete",
+             tags=["Knowledge Base Management"],
+             response_model=JobResponse,
+             summary="完成分块上传，校验文件并提交后台入库任务"
+             )(upload_complete)
+
+    app.get("/knowledge_base/job_status",
+            tags=["Knowledge Base Management"],
+            response_model=JobResponse,
+            summary="查询上传文件入库任务的状态和进度"
+            )(job_status)
+
     app.post("/knowledge_base/delete_doc",
              tags=["Knowledge Base Management"],
              response_model=BaseResponse,
@@ -183,6 +244,12 @@ def create_app():
              summary="根据content中文档重建向量库，流式输出处理进度。"
              )(recreate_vector_store)
 
+    app.get("/knowledge_base/cache_stats",
+            tags=["Knowledge Base Management"],
+            response_model=StatsResponse,
+            summary="获取向量缓存、嵌入模型、向量库缓存与文本分词器的统计"
+            )(cache_stats)
+
     return app
 
 
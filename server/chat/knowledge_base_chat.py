@@ -1,7 +1,7 @@
 from fastapi import Body, Request
 from fastapi.responses import StreamingResponse
 from configs.model_config import (llm_model_dict, LLM_MODEL, PROMPT_TEMPLATE,
-                                  VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD)
+                                  VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD, USE_RERANKER, RERANK_CANDIDATE_FACTOR)
 from server.chat.utils import wrap_done
 from server.utils import BaseResponse
 from langchain.chat_models import ChatOpenAI
@@ -11,18 +11,21 @@ from typing import AsyncIterable, List, Optional
 import asyncio
 from langchain.prompts.chat import ChatPromptTemplate
 from server.chat.utils import History
-from server.knowledge_base.kb_service.base import KBService, KBServiceFactory
+from server.knowledge_base.kb_service.base import KBService, KBServiceFactory, run_in_retrieval_executor
 import json
 import os
 from urllib.parse import urlencode
-from server.knowledge_base.kb_doc_api import search_docs_inner
+from server.knowledge_base.kb_doc_api import DocFilter
+from server.knowledge_base.multi_kb_search import search_multi_kbs
+from server.knowledge_base.reranker import rerank_docs
 
 from server.information.User import User
 from server.information.information_api import get_current_user
 from fastapi import Depends
 
 def knowledge_base_chat(query: str = Body(..., description="用户输入", examples=["你好"]),
-                        knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
+                        knowledge_base_name: str = Body(None, description="知识库名称，与 knowledge_base_names 二选一", examples=["samples"]),
+                        knowledge_base_names: List[str] = Body(None, description="联合检索的知识库名称列表，与 knowledge_base_name 二选一，填写空列表时检索全部知识库"),
                         top_k: int = Body(VECTOR_SEARCH_TOP_K, description="匹配向量数"),
                         score_threshold: float = Body(SCORE_THRESHOLD, description="知识库匹配相关度阈值，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右", ge=0, le=1),
                         history: List[History] = Body([],
@@ -35,15 +38,23 @@ def knowledge_base_chat(query: str = Body(..., description="用户输入", examp
                                                       ),
                         stream: bool = Body(False, description="流式输出"),
                         local_doc_url: bool = Body(False, description="知识文件返回本地路径(true)或URL(false)"),
+                        filters: DocFilter = Body(None, description="文件过滤条件，只检索满足条件的文件"),
+                        search_mode: str = Body(None, description="检索方式：vector 向量检索，bm25 关键词检索，hybrid 两者融合，不填使用默认配置", regex="^(vector|bm25|hybrid)$"),
+                        rerank: bool = Body(None, description="是否用交叉编码器对召回的文本段重排，不填使用默认配置"),
                         request: Request = None,
                          current_user: User = Depends(get_current_user)
                         ):
+    if (knowledge_base_name is None) == (knowledge_base_names is None):
+        return BaseResponse(code=400, msg="knowledge_base_name 与 knowledge_base_names 需且只需填写一个")
     user_id = current_user.user_id
-    kb = KBServiceFactory.get_service_by_name(knowledge_base_name, user_id)
-    if kb is None:
-        return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
+    kb = None
+    if knowledge_base_names is None:
+        kb = KBServiceFactory.get_service_by_name(knowledge_base_name, user_id)
+        if kb is None:
+            return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
 
     history = [History(**h) if isinstance(h, dict) else h for h in history]
+    filters = filters.dict() if filters else None
 
     async def knowledge_base_chat_iterator(query: str,
                                            kb: KBService,
@@ -59,7 +70,18 @@ def knowledge_base_chat(query: str = Body(..., description="用户输入", examp
             openai_api_base=llm_model_dict[LLM_MODEL]["api_base_url"],
             model_name=LLM_MODEL
         )
-        docs = search_docs_inner(query, knowledge_base_name, top_k, score_threshold, user_id)
+        use_rerank = USE_RERANKER if rerank is None else rerank
+        fetch_k = top_k * RERANK_CANDIDATE_FACTOR if use_rerank else top_k
+        # 检索与重排在检索线程池中执行，不阻塞其他请求的流式输出
+        if knowledge_base_names is None:
+            docs = [doc for doc, _ in await kb.asearch_docs(query, fetch_k, score_threshold,
+                                                            {"search_mode": search_mode}, filters)]
+        else:
+            docs = [doc for doc, _ in await run_in_retrieval_executor(
+                search_multi_kbs, user_id, query, knowledge_base_names, fetch_k, score_threshold,
+                {"search_mode": search_mode}, filters)]
+        if use_rerank:
+            docs = await run_in_retrieval_executor(rerank_docs, query, docs, top_k)
         context = "\n".join([doc.page_content for doc in docs])
 
         chat_prompt = ChatPromptTemplate.from_messages(
@@ -79,7 +101,8 @@ def knowledge_base_chat(query: str = Body(..., description="用户输入", examp
             if local_doc_url:
                 url = "file://" + doc.metadata["source"]
             else:
-                parameters = urlencode({"knowledge_base_name": knowledge_base_name, "file_name":filename})
+                parameters = urlencode({"knowledge_base_name": doc.metadata.get("kb_name", knowledge_base_name),
+                                        "file_name":filename})
                 url = f"{request.base_url}knowledge_base/download_doc?" + parameters
             text = f"""出处 [{inum + 1}] [{filename}]({url}) \n\n{doc.page_content}\n\n"""
             source_documents.append(text)
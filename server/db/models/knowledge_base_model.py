@@ -13,8 +13,10 @@ class KnowledgeBaseModel(Base):
     kb_name = Column(String, comment='知识库名称')
     vs_type = Column(String, comment='嵌入模型类型')
     embed_model = Column(String, comment='嵌入模型名称')
+    index_type = Column(String, comment='向量索引类型')
+    vector_codec = Column(String, comment='向量压缩方式')
     file_count = Column(Integer, default=0, comment='文件数量')
     create_time = Column(DateTime, default=func.now(), comment='创建时间')
 
     def __repr__(self):
-        return f"<KnowledgeBase(id='{self.id}', kb_name='{self.kb_name}', vs_type='{self.vs_type}', embed_model='{self.embed_model}', file_count='{self.file_count}', create_time='{self.create_time}')>"
+        return f"<KnowledgeBase(id='{self.id}', kb_name='{self.kb_name}', vs_type='{self.vs_type}', embed_model='{self.embed_model}', index_type='{self.index_type}', vector_codec='{self.vector_codec}', file_count='{self.file_count}', create_time='{self.create_time}')>"
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, func
+
+from server.db.base import Base
+
+
+class KnowledgeJobModel(Base):
+    """
+    知识库入库任务模型
+    """
+    __tablename__ = 'knowledge_job'
+    id = Column(Integer, primary_key=True, autoincrement=True, comment='任务ID')
+    user_id = Column(Integer, comment='用户ID')
+    kb_name = Column(String, comment='所属知识库名称')
+    file_name = Column(String, comment='文件名')
+    category = Column(String, comment='文件分类')
+    status = Column(String, default="pending", comment='任务状态：pending、running、success、failed')
+    progress = Column(Float, default=0.0, comment='任务进度，取值范围在0-1之间')
+    message = Column(String, default="", comment='当前阶段或失败原因')
+    worker = Column(String, comment='处理该任务的工作进程')
+    create_time = Column(DateTime, default=func.now(), comment='创建时间')
+    start_time = Column(DateTime, comment='开始处理时间')
+    heartbeat_time = Column(DateTime, comment='工作进程最近一次心跳时间，超时的任务重新放回队列')
+    end_time = Column(DateTime, comment='结束时间')
+
+    def __repr__(self):
+        return f"<KnowledgeJob(id='{self.id}', kb_name='{self.kb_name}', file_name='{self.file_name}', status='{self.status}', progress='{self.progress}', message='{self.message}', create_time='{self.create_time}')>"
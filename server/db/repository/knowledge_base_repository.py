@@ -3,15 +3,18 @@ from server.db.session import with_session
 from sqlalchemy import and_
 
 @with_session
-def add_kb_to_db(session, user_id, kb_name, vs_type, embed_model):
+def add_kb_to_db(session, user_id, kb_name, vs_type, embed_model, index_type=None, vector_codec=None):
     # 创建知识库实例
     kb = session.query(KnowledgeBaseModel).filter_by(user_id=user_id, kb_name=kb_name).first()
     if not kb:
-        kb = KnowledgeBaseModel(user_id=user_id, kb_name=kb_name, vs_type=vs_type, embed_model=embed_model)
+        kb = KnowledgeBaseModel(user_id=user_id, kb_name=kb_name, vs_type=vs_type, embed_model=embed_model,
+                                index_type=index_type, vector_codec=vector_codec)
         session.add(kb)
     else: # update kb with new vs_type and embed_model
         kb.vs_type = vs_type
         kb.embed_model = embed_model
+        kb.index_type = index_type
+        kb.vector_codec = vector_codec
     return True
 
 
@@ -35,9 +38,10 @@ def load_kb_from_db(session, user_id, kb_name):
     kb = session.query(KnowledgeBaseModel).filter_by(user_id=user_id, kb_name=kb_name).first()
     if kb:
         kb_name, vs_type, embed_model = kb.kb_name, kb.vs_type, kb.embed_model
+        index_type, vector_codec = kb.index_type, kb.vector_codec
     else:
-        kb_name, vs_type, embed_model = None, None, None
-    return kb_name, vs_type, embed_model
+        kb_name, vs_type, embed_model, index_type, vector_codec = None, None, None, None, None
+    return kb_name, vs_type, embed_model, index_type, vector_codec
 
 
 @with_session
@@ -57,6 +61,8 @@ def get_kb_detail(session, user_id, kb_name: str) -> dict:
             "kb_name": kb.kb_name,
             "vs_type": kb.vs_type,
             "embed_model": kb.embed_model,
+            "index_type": kb.index_type,
+            "vector_codec": kb.vector_codec,
             "file_count": kb.file_count,
             "create_time": kb.create_time,
         }
@@ -2,6 +2,8 @@ from server.db.models.knowledge_base_model import KnowledgeBaseModel
 from server.db.models.knowledge_file_model import KnowledgeFileModel
 from server.db.session import with_session
 from server.knowledge_base.utils import KnowledgeFile
+from datetime import datetime
+from typing import List
 
 
 @with_session
@@ -11,30 +13,87 @@ def list_docs_from_db(session, user_id, kb_name):
     return docs
 
 
+@with_session
+def count_docs_from_db(session, user_id, kb_name) -> int:
+    return session.query(KnowledgeFileModel).filter_by(user_id=user_id, kb_name=kb_name).count()
+
+
+def _add_doc(session, kb: KnowledgeBaseModel, kb_file: KnowledgeFile):
+    # 如果已经存在该文件，则更新文件版本号
+    existing_file = session.query(KnowledgeFileModel).filter_by(user_id=kb_file.user_id, file_name=kb_file.filename,
+                                                                kb_name=kb_file.kb_name).first()
+    if existing_file:
+        existing_file.file_version += 1
+        if kb_file.category is not None:
+            existing_file.category = kb_file.category
+    # 否则，添加新文件
+    else:
+        new_file = KnowledgeFileModel(
+            file_name=kb_file.filename,
+            file_ext=kb_file.ext,
+            category=kb_file.category or "",
+            kb_name=kb_file.kb_name,
+            user_id=kb_file.user_id,
+            document_loader_name=kb_file.document_loader_name,
+            text_splitter_name=kb_file.text_splitter_name or "SpacyTextSplitter",
+        )
+        kb.file_count += 1
+        session.add(new_file)
+        # 同一批次中后面的同名文件需要能查到这条记录
+        session.flush()
+
+
 @with_session
 def add_doc_to_db(session, kb_file: KnowledgeFile):
     kb = session.query(KnowledgeBaseModel).filter_by(user_id=kb_file.user_id, kb_name=kb_file.kb_name).first()
     if kb:
-        # 如果已经存在该文件，则更新文件版本号
-        existing_file = session.query(KnowledgeFileModel).filter_by(user_id=kb_file.user_id, file_name=kb_file.filename,
-                                                                    kb_name=kb_file.kb_name).first()
-        if existing_file:
-            existing_file.file_version += 1
-        # 否则，添加新文件
-        else:
-            new_file = KnowledgeFileModel(
-                file_name=kb_file.filename,
-                file_ext=kb_file.ext,
-                kb_name=kb_file.kb_name,
-                user_id=kb_file.user_id,
-                document_loader_name=kb_file.document_loader_name,
-                text_splitter_name=kb_file.text_splitter_name or "SpacyTextSplitter",
-            )
-            kb.file_count += 1
-            session.add(new_file)
+        _add_doc(session, kb, kb_file)
     return True
 
 
+@with_session
+def add_docs_to_db(session, kb_files: List[KnowledgeFile]):
+    """
+    在一个事务中添加同一知识库的多个文件
+    """
+    if not kb_files:
+        return True
+    kb = session.query(KnowledgeBaseModel).filter_by(user_id=kb_files[0].user_id,
+                                                     kb_name=kb_files[0].kb_name).first()
+    if kb:
+        for kb_file in kb_files:
+            _add_doc(session, kb, kb_file)
+    return True
+
+
+@with_session
+def list_docs_by_filter(session,
+                        user_id: int,
+                        kb_name: str,
+                        file_names: List[str] = None,
+                        file_exts: List[str] = None,
+                        categories: List[str] = None,
+                        create_time_start: datetime = None,
+                        create_time_end: datetime = None,
+                        ) -> List[str]:
+    """
+    返回满足过滤条件的文件名，未指定的条件不过滤
+    """
+    query = session.query(KnowledgeFileModel.file_name).filter_by(user_id=user_id, kb_name=kb_name)
+    if file_names:
+        query = query.filter(KnowledgeFileModel.file_name.in_(file_names))
+    if file_exts:
+        exts = [ext.lower() if ext.startswith(".") else f".{ext.lower()}" for ext in file_exts]
+        query = query.filter(KnowledgeFileModel.file_ext.in_(exts))
+    if categories:
+        query = query.filter(KnowledgeFileModel.category.in_(categories))
+    if create_time_start:
+        query = query.filter(KnowledgeFileModel.create_time >= create_time_start)
+    if create_time_end:
+        query = query.filter(KnowledgeFileModel.create_time <= create_time_end)
+    return [f[0] for f in query.all()]
+
+
 @with_session
 def delete_file_from_db(session, kb_file: KnowledgeFile):
     existing_file = session.query(KnowledgeFileModel).filter_by(user_id=kb_file.user_id, file_name=kb_file.filename,
@@ -82,6 +141,7 @@ def get_file_detail(session, user_id: int, kb_name: str, filename: str) -> dict:
             "user_id": file.user_id,
             "file_name": file.file_name,
             "file_ext": file.file_ext,
+            "category": file.category,
             "file_version": file.file_version,
             "document_loader": file.document_loader_name,
             "text_splitter": file.text_splitter_name,
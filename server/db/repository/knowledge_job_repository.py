@@ -0,0 +1,120 @@
+from server.db.models.knowledge_job_model import KnowledgeJobModel
+from server.db.session import with_session
+from sqlalchemy.orm import aliased
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+
+def _job_detail(job: KnowledgeJobModel) -> dict:
+    return {
+        "job_id": job.id,
+        "user_id": job.user_id,
+        "kb_name": job.kb_name,
+        "file_name": job.file_name,
+        "category": job.category,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "worker": job.worker,
+        "create_time": job.create_time,
+        "start_time": job.start_time,
+        "end_time": job.end_time,
+    }
+
+
+@with_session
+def add_job_to_db(session, user_id: int, kb_name: str, file_name: str, category: str = None) -> int:
+    job = KnowledgeJobModel(user_id=user_id, kb_name=kb_name, file_name=file_name, category=category,
+                            status="pending", progress=0.0, message="")
+    session.add(job)
+    session.flush()
+    return job.id
+
+
+@with_session
+def claim_job(session, worker: str) -> Optional[dict]:
+    """
+    领取最早的待处理任务，所属知识库已有任务在处理时跳过，同一知识库的写入依次进行。
+    筛选与更新在同一条 UPDATE 语句中完成，多个工作进程不会领取到同一个任务。
+    返回的 worker 为本次领取的标识，之后更新进度、心跳和结束任务时用于确认任务仍归该进程处理
+    """
+    job = aliased(KnowledgeJobModel)
+    running = aliased(KnowledgeJobModel)
+    busy = (session.query(running.id)
+            .filter(running.status == "running",
+                    running.user_id == job.user_id,
+                    running.kb_name == job.kb_name)
+            .exists())
+    candidate = (session.query(job.id)
+                 .filter(job.status == "pending", ~busy)
+                 .order_by(job.id)
+                 .limit(1)
+                 .scalar_subquery())
+    token = f"{worker}:{datetime.now().timestamp()}"
+    now = datetime.now()
+    count = (session.query(KnowledgeJobModel)
+             .filter(KnowledgeJobModel.id == candidate, KnowledgeJobModel.status == "pending")
+             .update({"status": "running", "worker": token, "start_time": now, "heartbeat_time": now,
+                      "message": "开始处理"},
+                     synchronize_session=False))
+    if not count:
+        return None
+    session.commit()
+    claimed = session.query(KnowledgeJobModel).filter_by(worker=token, status="running").first()
+    return _job_detail(claimed) if claimed else None
+
+
+def _owned_job(session, job_id: int, worker: str = None):
+    query = session.query(KnowledgeJobModel).filter_by(id=job_id)
+    if worker is not None:
+        query = query.filter_by(worker=worker, status="running")
+    return query
+
+
+@with_session
+def update_job_progress(session, job_id: int, progress: float, message: str = "", worker: str = None) -> bool:
+    """
+    更新进度并刷新心跳。指定 worker 时只更新仍由该工作进程处理的任务，任务已被重新放回队列时返回 False
+    """
+    return _owned_job(session, job_id, worker).update(
+        {"progress": progress, "message": message, "heartbeat_time": datetime.now()}) > 0
+
+
+@with_session
+def heartbeat_job(session, job_id: int, worker: str) -> bool:
+    return _owned_job(session, job_id, worker).update({"heartbeat_time": datetime.now()}) > 0
+
+
+@with_session
+def finish_job(session, job_id: int, success: bool, message: str = "", worker: str = None) -> bool:
+    values = {"status": "success" if success else "failed", "message": message, "end_time": datetime.now()}
+    if success:
+        values["progress"] = 1.0
+    return _owned_job(session, job_id, worker).update(values) > 0
+
+
+@with_session
+def requeue_stale_jobs(session, expire: float) -> int:
+    """
+    将超过 expire 秒没有心跳的任务（其工作进程已退出）重新放回队列，仍在处理中的任务不受影响
+    """
+    deadline = datetime.now() - timedelta(seconds=expire)
+    return (session.query(KnowledgeJobModel)
+            .filter(KnowledgeJobModel.status == "running",
+                    (KnowledgeJobModel.heartbeat_time == None) | (KnowledgeJobModel.heartbeat_time < deadline))
+            .update({"status": "pending", "progress": 0.0, "message": "", "worker": None, "heartbeat_time": None},
+                    synchronize_session=False))
+
+
+@with_session
+def get_job_detail(session, user_id: int, job_id: int) -> dict:
+    job = session.query(KnowledgeJobModel).filter_by(id=job_id, user_id=user_id).first()
+    return _job_detail(job) if job else {}
+
+
+@with_session
+def list_jobs_from_db(session, user_id: int, kb_name: str, status: str = None) -> List[dict]:
+    query = session.query(KnowledgeJobModel).filter_by(user_id=user_id, kb_name=kb_name)
+    if status:
+        query = query.filter_by(status=status)
+    return [_job_detail(job) for job in query.order_by(KnowledgeJobModel.id).all()]
@@ -0,0 +1,247 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from langchain.docstore.document import Document
+
+from configs.model_config import BM25_MAX_DF_RATIO
+from server.knowledge_base.utils import diff_chunks
+
+
+_WORD = re.compile(r"\w")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    jieba 搜索引擎模式分词，长词同时切出其中的短词，提高法规名称、条款等的召回；去掉标点和空白
+    """
+    import jieba
+    return [t for t in jieba.lcut_for_search(text) if _WORD.search(t)]
+
+
+def query_tokens(query: str) -> List[str]:
+    """
+    查询分词去重。单个汉字（的、是、在等）几乎出现在所有文本段中，对排序无帮助却要遍历大量倒排记录，
+    有其他词时丢弃
+    """
+    tokens = list(dict.fromkeys(t.lower() for t in tokenize(query)))
+    words = [t for t in tokens if len(t) > 1 or t.isascii()]
+    return words or tokens
+
+
+class BM25Index:
+    """
+    每个知识库一个的 sqlite 倒排索引文件（kb_path/bm25.db），与向量库类型无关。
+    docs 表保存文本段及其分词结果，来源文件上建有索引；docs_fts 为外部内容 FTS5 表，保存倒排记录，
+    按 bm25() 排序。添加、删除文件只写入/删除该文件的倒排记录，无需重建。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+        self._doc_count = None
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isfile(self.db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection):
+        conn.execute("CREATE TABLE IF NOT EXISTS docs ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "source TEXT NOT NULL, "
+                     "page_content TEXT NOT NULL, "
+                     "metadata TEXT NOT NULL, "
+                     "tokens TEXT NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_source ON docs (source)")
+        # 分词结果以空格分隔，unicode61 按空白切分并转小写
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs_fts USING fts5("
+                     "tokens, content='docs', content_rowid='id', tokenize='unicode61')")
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS docs_vocab USING fts5vocab(docs_fts, 'row')")
+        conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def add(self, docs: List[Document]):
+        rows = self._rows(docs)
+        with self._lock:
+            conn = self._connect()
+            self._insert(conn, rows)
+            conn.commit()
+            self._doc_count = None
+
+    @staticmethod
+    def _rows(docs: List[Document]) -> List[Tuple[str, str, str, str]]:
+        return [(doc.metadata.get("source", ""),
+                 doc.page_content,
+                 json.dumps(doc.metadata, ensure_ascii=False, default=str),
+                 " ".join(tokenize(doc.page_content)))
+                for doc in docs]
+
+    @staticmethod
+    def _insert(conn: sqlite3.Connection, rows: List[Tuple[str, str, str, str]]):
+        for row in rows:
+            cursor = conn.execute("INSERT INTO docs (source, page_content, metadata, tokens) VALUES (?, ?, ?, ?)",
+                                  row)
+            conn.execute("INSERT INTO docs_fts (rowid, tokens) VALUES (?, ?)", (cursor.lastrowid, row[3]))
+
+    def delete_source(self, source: str) -> int:
+        with self._lock:
+            if self._conn is None and not self.exists:
+                return 0
+            conn = self._connect()
+            rows = conn.execute("SELECT id, tokens FROM docs WHERE source = ?", (source,)).fetchall()
+            # 外部内容表删除倒排记录时需要提供原分词结果
+            conn.executemany("INSERT INTO docs_fts (docs_fts, rowid, tokens) VALUES ('delete', ?, ?)", rows)
+            conn.execute("DELETE FROM docs WHERE source = ?", (source,))
+            conn.commit()
+            self._doc_count = None
+        return len(rows)
+
+    def update_source(self, source: str, docs: List[Document]) -> Tuple[int, int]:
+        """
+        用新切分的文本段更新来源文件，只删除已不存在的文本段、只为新增的文本段分词，返回 (新增数, 删除数)。
+        读取、比较与写入在同一把锁内完成，并发更新同一文件时不会按过期的内容删除或重复添加
+        """
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT id, page_content, metadata, tokens FROM docs WHERE source = ?",
+                                (source,)).fetchall()
+            old = {r[0]: Document(page_content=r[1], metadata=json.loads(r[2])) for r in rows}
+            added, removed, _ = diff_chunks(old, docs)
+            if removed:
+                tokens = {r[0]: r[3] for r in rows}
+                conn.executemany("INSERT INTO docs_fts (docs_fts, rowid, tokens) VALUES ('delete', ?, ?)",
+                                 [(i, tokens[i]) for i in removed])
+                conn.executemany("DELETE FROM docs WHERE id = ?", [(i,) for i in removed])
+            if added:
+                self._insert(conn, self._rows(added))
+            conn.commit()
+            self._doc_count = None
+        return len(added), len(removed)
+
+    def clear(self):
+        with self._lock:
+            if self._conn is None and not self.exists:
+                return
+            conn = self._connect()
+            conn.execute("DELETE FROM docs")
+            conn.execute("INSERT INTO docs_fts (docs_fts) VALUES ('delete-all')")
+            conn.commit()
+            self._doc_count = None
+
+    def count(self) -> int:
+        with self._lock:
+            if self._conn is None and not self.exists:
+                return 0
+            return self._count(self._connect())
+
+    def _count(self, conn: sqlite3.Connection) -> int:
+        # 其他进程写入后计数可能略有偏差，只用于估算词的文档频率占比
+        if self._doc_count is None:
+            self._doc_count = conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+        return self._doc_count
+
+    def _prune(self, conn: sqlite3.Connection, tokens: List[str]) -> List[str]:
+        """
+        去掉文档频率占比超过 BM25_MAX_DF_RATIO 的词：这类词 idf 很低，对排序影响小，
+        却要为大量倒排记录计算分数，是大知识库上检索耗时的主要来源。索引中不存在的词一并去掉，
+        剩余的词全部为高频词时不做删减
+        """
+        df = dict(conn.execute(f"SELECT term, doc FROM docs_vocab WHERE term IN ({','.join('?' * len(tokens))})",
+                               tokens).fetchall())
+        limit = self._count(conn) * BM25_MAX_DF_RATIO
+        kept = [t for t in tokens if 0 < df.get(t, 0) <= limit]
+        return kept or tokens
+
+    def search(self, query: str, top_k: int, sources: Iterable[str] = None) -> List[Tuple[Document, float]]:
+        """
+        返回 (文档, bm25分数) 列表，分数为 sqlite bm25() 的值，越小越相关。
+        sources 不为 None 时只在这些来源文件中检索，为空列表时没有可检索的文件，返回空列表
+        """
+        tokens = query_tokens(query)
+        if sources is not None:
+            sources = list(sources)
+        if not tokens or sources == [] or (self._conn is None and not self.exists):
+            return []
+        with self._lock:
+            conn = self._connect()
+            tokens = self._prune(conn, tokens)
+            match = " OR ".join('"' + t.replace('"', '""') + '"' for t in tokens)
+            # 先只在倒排索引上打分取 top_k，再读取这些文本段的内容
+            if sources is None:
+                rows = conn.execute("SELECT rowid, bm25(docs_fts) AS score FROM docs_fts "
+                                    "WHERE docs_fts MATCH ? ORDER BY score LIMIT ?", (match, top_k)).fetchall()
+            else:
+                rows = conn.execute("SELECT docs_fts.rowid, bm25(docs_fts) AS score "
+                                    "FROM docs_fts JOIN docs d ON d.id = docs_fts.rowid "
+                                    f"WHERE docs_fts MATCH ? AND d.source IN ({','.join('?' * len(sources))}) "
+                                    "ORDER BY score LIMIT ?", [match, *sources, top_k]).fetchall()
+            if not rows:
+                return []
+            contents = dict((r[0], r[1:]) for r in conn.execute(
+                f"SELECT id, page_content, metadata FROM docs WHERE id IN ({','.join('?' * len(rows))})",
+                [r[0] for r in rows]))
+        return [(Document(page_content=contents[i][0], metadata=json.loads(contents[i][1])), score)
+                for i, score in rows if i in contents]
+
+_indexes: Dict[str, BM25Index] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_bm25_index(kb_path: str) -> BM25Index:
+    db_path = os.path.join(kb_path, "bm25.db")
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = BM25Index(db_path)
+        return _indexes[db_path]
+
+
+def drop_bm25_index(kb_path: str):
+    db_path = os.path.join(kb_path, "bm25.db")
+    with _indexes_lock:
+        index = _indexes.pop(db_path, None)
+    if index is not None:
+        index.close()
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def rrf_fuse(result_lists: List[List[Tuple[Document, float]]],
+             top_k: int,
+             rrf_k: int = 60,
+             ) -> List[Tuple[Document, float]]:
+    """
+    倒数排名融合(RRF)：各路结果按排名计分 1/(rrf_k + rank) 后相加，同一来源文件中内容相同的文本段视为同一个。
+    返回的分数换算为 1 - 融合分/满分，在 0-1 之间且越小越相关，与向量检索的分数方向一致。
+    空的结果列表（如尚未建立倒排索引的旧知识库）不参与计分
+    """
+    result_lists = [results for results in result_lists if results]
+    fused = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = (doc.metadata.get("source"), doc.page_content)
+            if key in fused:
+                fused[key][1] += 1.0 / (rrf_k + rank)
+            else:
+                fused[key] = [doc, 1.0 / (rrf_k + rank)]
+    best = len(result_lists) / (rrf_k + 1)
+    ranked = sorted(fused.values(), key=lambda x: x[1], reverse=True)[:top_k]
+    return [(doc, 1.0 - score / best) for doc, score in ranked]
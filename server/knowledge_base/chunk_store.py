@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List
+
+import numpy as np
+from langchain.docstore.document import Document
+
+
+class ChunkStore:
+    """
+    每个 FAISS 知识库一个的 sqlite 文件，保存全部文本段的内容与元数据。
+    主键即 FAISS 索引中的向量id，检索时只按需读取 top_k 个文本段；
+    来源文件上建有索引，删除、更新、统计单个文件只需访问该文件的文本段。
+    向量库使用有损压缩时，vector 列保存原始 float32 向量，用于精确重排和重建索引。
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.isfile(self.db_path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._create_tables(self._conn)
+        return self._conn
+
+    @staticmethod
+    def _create_tables(conn: sqlite3.Connection):
+        conn.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "source TEXT NOT NULL, "
+                     "page_content TEXT NOT NULL, "
+                     "metadata TEXT NOT NULL, "
+                     "vector BLOB)")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(chunks)")}
+        if "vector" not in columns:
+            conn.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+        conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def reset(self):
+        """
+        清空并按当前结构重建表，用于旧版本向量库的转换
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DROP TABLE IF EXISTS chunks")
+            self._create_tables(conn)
+
+    def add(self, docs: List[Document], vectors: np.ndarray = None) -> List[int]:
+        """
+        写入文本段，返回分配的id（即向量在 FAISS 中的id）。vectors 不为空时同时保存原始向量
+        """
+        with self._lock:
+            conn = self._connect()
+            ids = []
+            for i, doc in enumerate(docs):
+                vector = None if vectors is None else np.asarray(vectors[i], dtype=np.float32).tobytes()
+                cursor = conn.execute("INSERT INTO chunks (source, page_content, metadata, vector) VALUES (?, ?, ?, ?)",
+                                      (doc.metadata.get("source", ""),
+                                       doc.page_content,
+                                       json.dumps(doc.metadata, ensure_ascii=False, default=str),
+                                       vector))
+                ids.append(cursor.lastrowid)
+            conn.commit()
+        return ids
+
+    def get(self, ids: Iterable[int]) -> Dict[int, Document]:
+        result = {}
+        ids = [int(i) for i in ids]
+        # sqlite 单条语句的参数数量有限，分批查询
+        for start in range(0, len(ids), 900):
+            batch = ids[start:start + 900]
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT id, page_content, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+            result.update((r[0], Document(page_content=r[1], metadata=json.loads(r[2]))) for r in rows)
+        return result
+
+    def get_vectors(self, ids: Iterable[int]) -> Dict[int, np.ndarray]:
+        """
+        读取原始向量，未保存原始向量的文本段不在返回结果中
+        """
+        result = {}
+        ids = [int(i) for i in ids]
+        # sqlite 单条语句的参数数量有限，分批查询
+        for start in range(0, len(ids), 900):
+            batch = ids[start:start + 900]
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT id, vector FROM chunks WHERE vector IS NOT NULL AND id IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+            result.update((r[0], np.frombuffer(r[1], dtype=np.float32)) for r in rows)
+        return result
+
+    def ids_of_source(self, source: str) -> List[int]:
+        with self._lock:
+            rows = self._connect().execute("SELECT id FROM chunks WHERE source = ?", (source,)).fetchall()
+        return [r[0] for r in rows]
+
+    def ids_of_sources(self, sources: Iterable[str]) -> List[int]:
+        ids = []
+        sources = list(sources)
+        for start in range(0, len(sources), 900):
+            batch = sources[start:start + 900]
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT id FROM chunks WHERE source IN ({','.join('?' * len(batch))})", batch).fetchall()
+            ids.extend(r[0] for r in rows)
+        return ids
+
+    def docs_of_source(self, source: str) -> Dict[int, Document]:
+        with self._lock:
+            rows = self._connect().execute("SELECT id, page_content, metadata FROM chunks WHERE source = ?",
+                                           (source,)).fetchall()
+        return {r[0]: Document(page_content=r[1], metadata=json.loads(r[2])) for r in rows}
+
+    def delete(self, ids: Iterable[int]):
+        ids = [int(i) for i in ids]
+        with self._lock:
+            conn = self._connect()
+            for start in range(0, len(ids), 900):
+                batch = ids[start:start + 900]
+                conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            conn.commit()
+
+    def delete_source(self, source: str):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM chunks WHERE source = ?", (source,))
+            conn.commit()
+
+    def count_by_source(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._connect().execute("SELECT source, COUNT(*) FROM chunks GROUP BY source").fetchall()
+        return dict(rows)
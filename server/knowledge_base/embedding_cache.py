@@ -0,0 +1,253 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from configs.model_config import (EMBEDDING_CACHE_PATH, QUERY_EMBEDDING_CACHE_MEMORY,
+                                  QUERY_EMBEDDING_CACHE_PERSIST, CHUNK_EMBEDDING_CACHE, logger)
+from server.knowledge_base.kb_cache import CachePool
+
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """
+    全角转半角、合并连续空白并去掉首尾空白，仅空白或全半角不同的问题共用同一个缓存向量
+    """
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class QueryEmbeddingStore:
+    """
+    查询向量的磁盘缓存（sqlite），服务重启后内存缓存未命中时先在这里查找
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS query_embeddings ("
+                               "embed_model TEXT NOT NULL, "
+                               "query TEXT NOT NULL, "
+                               "vector BLOB NOT NULL, "
+                               "PRIMARY KEY (embed_model, query))")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, embed_model: str, query: str) -> Optional[np.ndarray]:
+        with self._lock:
+            row = self._connect().execute("SELECT vector FROM query_embeddings WHERE embed_model = ? AND query = ?",
+                                          (embed_model, query)).fetchone()
+        return None if row is None else np.frombuffer(row[0], dtype=np.float32)
+
+    def put(self, embed_model: str, query: str, vector: np.ndarray):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT OR REPLACE INTO query_embeddings (embed_model, query, vector) VALUES (?, ?, ?)",
+                         (embed_model, query, vector.astype(np.float32).tobytes()))
+            conn.commit()
+
+
+class ChunkEmbeddingStore:
+    """
+    文本段向量的磁盘缓存，每个嵌入模型一个 sqlite 文件，主键为文本 sha256 的 32 字节摘要，
+    值为 float32 原始字节，无行号表（WITHOUT ROWID）以减少存储。多个进程可同时读写
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings ("
+                               "digest BLOB PRIMARY KEY, "
+                               "vector BLOB NOT NULL) WITHOUT ROWID")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, digests: Iterable[bytes]) -> Dict[bytes, np.ndarray]:
+        result = {}
+        digests = list(digests)
+        # sqlite 单条语句的参数数量有限，分批查询
+        for start in range(0, len(digests), 900):
+            batch = digests[start:start + 900]
+            with self._lock:
+                rows = self._connect().execute(
+                    f"SELECT digest, vector FROM embeddings WHERE digest IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+            result.update((r[0], np.frombuffer(r[1], dtype=np.float32)) for r in rows)
+        with self._lock:
+            self.hits += len(result)
+            self.misses += len(digests) - len(result)
+        return result
+
+    def put(self, items: Dict[bytes, np.ndarray]):
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (digest, vector) VALUES (?, ?)",
+                             [(k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items.items()])
+            conn.commit()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+_chunk_stores: Dict[str, ChunkEmbeddingStore] = {}
+_chunk_stores_lock = threading.Lock()
+
+
+def get_chunk_embedding_store(embed_model: str) -> ChunkEmbeddingStore:
+    with _chunk_stores_lock:
+        if embed_model not in _chunk_stores:
+            _chunk_stores[embed_model] = ChunkEmbeddingStore(
+                os.path.join(EMBEDDING_CACHE_PATH, "chunks", f"{embed_model}.db"))
+        return _chunk_stores[embed_model]
+
+
+query_embedding_pool = CachePool(max_bytes=QUERY_EMBEDDING_CACHE_MEMORY * 1024 ** 2,
+                                 name="query_embedding",
+                                 verbose=False)
+query_embedding_store = (QueryEmbeddingStore(os.path.join(EMBEDDING_CACHE_PATH, "query_embeddings.db"))
+                         if QUERY_EMBEDDING_CACHE_PERSIST else None)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    在嵌入模型的 embed_query 之前加一层按 (嵌入模型, 规范化后的查询) 缓存的 LRU，
+    重复的问题不再经过模型前向计算；embed_documents 先按 (嵌入模型, 文本 sha256) 查找磁盘上的文本段向量缓存，
+    只对未缓存的文本调用模型，内容未变的文件重新入库、重建向量库时无需重新计算向量。
+    本身不持有模型，每次计算时通过 loader 从模型缓存池中获取，被缓存的向量库等对象不会阻止模型被淘汰
+    """
+
+    def __init__(self, loader: Callable[[], Embeddings], embed_model: str):
+        self.loader = loader
+        self.embed_model = embed_model
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.loader()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not CHUNK_EMBEDDING_CACHE or not texts:
+            return self.embeddings.embed_documents(texts)
+        store = get_chunk_embedding_store(self.embed_model)
+        digests = [hashlib.sha256(text.encode("utf-8")).digest() for text in texts]
+        try:
+            vectors = store.get(set(digests))
+        except sqlite3.Error as e:
+            logger.error(f"read chunk embedding cache failed: {e}")
+            return self.embeddings.embed_documents(texts)
+        missing = {}
+        for digest, text in zip(digests, texts):
+            if digest not in vectors:
+                missing[digest] = text
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing, np.asarray(new_vectors, dtype=np.float32)))
+            try:
+                store.put(new_vectors)
+            except sqlite3.Error as e:
+                logger.error(f"write chunk embedding cache failed: {e}")
+            vectors.update(new_vectors)
+        return [vectors[digest].tolist() for digest in digests]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        批量向量化多个查询，与 embed_query 使用相同的查询向量缓存（内存与磁盘）和模型的查询接口，
+        未命中的查询在一次调用中完成
+        """
+        queries = [normalize_query(text) for text in texts]
+        vectors = {}
+        for query in queries:
+            vector = query_embedding_pool.peek((self.embed_model, query))
+            if vector is not None:
+                vectors[query] = vector
+        missing = [q for q in dict.fromkeys(queries) if q not in vectors]
+        if missing:
+            for query, vector in zip(missing, self._load_many(missing)):
+                query_embedding_pool.put((self.embed_model, query), vector, vector.nbytes)
+                vectors[query] = vector
+        return [vectors[query].tolist() for query in queries]
+
+    def embed_query(self, text: str) -> List[float]:
+        query = normalize_query(text)
+        vector = query_embedding_pool.get((self.embed_model, query),
+                                          lambda: self._load_many([query])[0],
+                                          sizeof=lambda v: v.nbytes)
+        return vector.tolist()
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        用模型的查询接口计算向量（如 bge 会在查询前加指令），不能用 embed_documents 代替
+        """
+        embeddings = self.embeddings
+        if hasattr(embeddings, "embed_queries"):
+            return embeddings.embed_queries(queries)
+        return [embeddings.embed_query(query) for query in queries]
+
+    def _load_many(self, queries: List[str]) -> List[np.ndarray]:
+        """
+        依次查找磁盘缓存，其余查询调用模型计算后写入磁盘缓存
+        """
+        vectors = {}
+        if query_embedding_store is not None:
+            for query in queries:
+                try:
+                    vector = query_embedding_store.get(self.embed_model, query)
+                except sqlite3.Error as e:
+                    logger.error(f"read query embedding cache failed: {e}")
+                    break
+                if vector is not None:
+                    vectors[query] = vector
+        missing = [query for query in queries if query not in vectors]
+        if missing:
+            for query, vector in zip(missing, self._embed_queries(missing)):
+                vector = np.asarray(vector, dtype=np.float32)
+                vectors[query] = vector
+                if query_embedding_store is not None:
+                    try:
+                        query_embedding_store.put(self.embed_model, query, vector)
+                    except sqlite3.Error as e:
+                        logger.error(f"write query embedding cache failed: {e}")
+        return [vectors[query] for query in queries]
+
+
+def query_cache_stats() -> Dict:
+    stats = query_embedding_pool.stats()
+    stats["persist"] = query_embedding_store is not None
+    return stats
+
+
+def chunk_cache_stats() -> Dict:
+    with _chunk_stores_lock:
+        stores = dict(_chunk_stores)
+    stats = {}
+    for embed_model, store in stores.items():
+        lookups = store.hits + store.misses
+        stats[embed_model] = {
+            "hits": store.hits,
+            "misses": store.misses,
+            "hit_rate": store.hits / lookups if lookups else 0.0,
+        }
+    return stats
@@ -0,0 +1,161 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Tuple
+
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+
+from configs.model_config import EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_WAIT, logger
+
+
+class _Request:
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future = Future()
+        self.vectors = []
+        self.offset = 0
+        self.enqueue_time = time.perf_counter()
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    嵌入模型的动态批处理：各线程提交的查询与文本段进入队列，由一个后台线程合并为一批调用模型，
+    调用方拿到 Future。批大小达到 max_batch_size，或最早的请求已等待 max_wait 秒时立即计算；
+    查询优先于入库的文本段，文本段较多的入库请求会被拆分到多个批次中，不会长时间阻塞查询。
+    查询与文本段分别组批，查询批次用模型的查询接口计算（如 bge 会在查询前加指令），见 _embed_queries
+    """
+
+    def __init__(self,
+                 embeddings: Embeddings,
+                 max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                 max_wait: float = EMBEDDING_BATCH_MAX_WAIT,
+                 ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queries: Deque[_Request] = deque()
+        self._documents: Deque[_Request] = deque()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._batches = 0
+        self._texts = 0
+        self._busy_time = 0.0
+
+    def submit(self, texts: List[str], is_query: bool = False) -> Future:
+        request = _Request(list(texts))
+        if not request.texts:
+            request.future.set_result([])
+            return request.future
+        with self._cond:
+            self._closed = False
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding_worker", daemon=True)
+                self._thread.start()
+            (self._queries if is_query else self._documents).append(request)
+            self._pending += len(request.texts)
+            self._cond.notify()
+        return request.future
+
+    def close(self):
+        """
+        队列中的请求处理完后结束后台线程，释放对模型的引用；之后再提交请求会重新启动线程
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.submit([text], is_query=True).result()[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        return self.submit(texts, is_query=True).result()
+
+    def _take_batch(self) -> Tuple[List[tuple], bool]:
+        """
+        取出最多 max_batch_size 个文本，有查询时只取查询，否则只取文本段。
+        返回 ([(请求, 起始位置, 文本数)], 是否为查询批次)
+        """
+        is_query = bool(self._queries)
+        queue = self._queries if is_query else self._documents
+        batch = []
+        room = self.max_batch_size
+        while queue and room > 0:
+            request = queue[0]
+            n = min(room, len(request.texts) - request.offset)
+            batch.append((request, request.offset, n))
+            request.offset += n
+            room -= n
+            if request.offset == len(request.texts):
+                queue.popleft()
+        self._pending -= self.max_batch_size - room
+        return batch, is_query
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if self._closed:
+                        self._thread = None
+                        return
+                    self._cond.wait()
+                oldest = min(q[0].enqueue_time for q in (self._queries, self._documents) if q)
+                deadline = oldest + self.max_wait
+                while self._pending < self.max_batch_size:
+                    timeout = deadline - time.perf_counter()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                batch, is_query = self._take_batch()
+
+            texts = [text for request, start, n in batch for text in request.texts[start:start + n]]
+            self._compute(batch, texts, is_query)
+
+    def _embed_queries(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.embeddings
+        if hasattr(embeddings, "embed_queries"):
+            return embeddings.embed_queries(texts)
+        if type(embeddings) is HuggingFaceEmbeddings:
+            # 查询与文本段的计算方式相同，可以一次批量计算
+            return embeddings.embed_documents(texts)
+        return [embeddings.embed_query(text) for text in texts]
+
+    def _compute(self, batch: List[tuple], texts: List[str], is_query: bool = False):
+        start = time.perf_counter()
+        try:
+            vectors = self._embed_queries(texts) if is_query else self.embeddings.embed_documents(texts)
+        except Exception as e:
+            logger.error(f"embedding batch of {len(texts)} texts failed: {e}")
+            for request, _, _ in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+        with self._cond:
+            self._batches += 1
+            self._texts += len(texts)
+            self._busy_time += elapsed
+        i = 0
+        for request, _, n in batch:
+            # 同一请求的各批次按顺序计算，之前的批次失败时 future 已设置异常
+            if not request.future.done():
+                request.vectors.extend(vectors[i:i + n])
+                if len(request.vectors) == len(request.texts):
+                    request.future.set_result(request.vectors)
+            i += n
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "pending_texts": self._pending,
+                "batches": self._batches,
+                "texts": self._texts,
+                "avg_batch_size": self._texts / self._batches if self._batches else 0.0,
+                "busy_time": self._busy_time,
+            }
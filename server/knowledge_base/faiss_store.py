@@ -0,0 +1,686 @@
+import json
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from configs.model_config import (FAISS_MERGE_DELTAS, FAISS_MERGE_TOMBSTONES, FAISS_MMAP_LOAD, FAISS_INDEX_TYPE,
+                                  FAISS_INDEX_TYPES, FAISS_VECTOR_CODEC, FAISS_VECTOR_CODECS,
+                                  FAISS_RERANK_FACTOR, FAISS_FILTER_EXACT_MAX, logger)
+from server.knowledge_base.chunk_store import ChunkStore
+
+try:
+    import fcntl
+except ImportError:  # Windows 上只做进程内互斥
+    fcntl = None
+
+
+MANIFEST_FILE = "segments.json"
+TOMBSTONE_FILE = "tombstones.txt"
+CHUNK_DB_FILE = "chunks.db"
+LOCK_FILE = ".lock"
+LEGACY_BASE = "index"  # 旧版本 save_local 生成的 index.faiss / index.pkl
+
+_write_locks: Dict[str, threading.Lock] = {}
+_write_locks_guard = threading.Lock()
+_merging: Set[str] = set()
+
+
+@contextmanager
+def _get_write_lock(vs_path: str):
+    """
+    向量库的写锁：进程内的线程锁 + vs_path/.lock 上的文件锁。
+    API 服务进程与入库工作进程可能同时写同一个向量库，清单(next_seq)和段文件的读-改-写需要跨进程互斥
+    """
+    with _write_locks_guard:
+        lock = _write_locks.setdefault(os.path.abspath(vs_path), threading.Lock())
+    with lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(vs_path, exist_ok=True)
+        with open(os.path.join(vs_path, LOCK_FILE), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write(path: str, content: str):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(vs_path: str) -> Dict:
+    manifest_path = os.path.join(vs_path, MANIFEST_FILE)
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+    base = LEGACY_BASE if os.path.isfile(os.path.join(vs_path, f"{LEGACY_BASE}.faiss")) else None
+    return {"base": base, "deltas": [], "next_seq": 1}
+
+
+def read_tombstones(vs_path: str) -> Set[str]:
+    tombstone_path = os.path.join(vs_path, TOMBSTONE_FILE)
+    if not os.path.isfile(tombstone_path):
+        return set()
+    with open(tombstone_path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def read_version(vs_path: str) -> Tuple[int, int]:
+    """
+    以清单和墓碑文件的修改时间作为向量库版本，用于发现其他进程的写入
+    """
+    version = []
+    for name in (MANIFEST_FILE, TOMBSTONE_FILE):
+        path = os.path.join(vs_path, name)
+        version.append(os.stat(path).st_mtime_ns if os.path.isfile(path) else 0)
+    return tuple(version)
+
+
+def read_index(path: str, mmap: bool = FAISS_MMAP_LOAD):
+    """
+    mmap 为 True 时以只读内存映射方式打开索引文件，多个进程共享操作系统页缓存，
+    加载时间不再随索引大小增长。不支持内存映射的 faiss 版本或索引类型回退为普通读取。
+    """
+    import faiss
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.warning(f"memory-map {path} failed, fall back to normal loading: {e}")
+    return faiss.read_index(path)
+
+
+def _remove_segment_files(vs_path: str, name: str):
+    for ext in (".faiss", ".pkl"):
+        path = os.path.join(vs_path, name + ext)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def _normalize(vectors) -> np.ndarray:
+    import faiss
+    vectors = np.array(vectors, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _codec_of(index) -> str:
+    import faiss
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "fp16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "none"
+
+
+def index_layout(index) -> Tuple[str, str]:
+    """
+    返回段的 (索引类型, 压缩方式)，索引类型为 flat / hnsw / ivf_flat / ivf_pq
+    """
+    import faiss
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        return "hnsw", _codec_of(faiss.downcast_index(inner.storage))
+    if isinstance(inner, faiss.IndexIVFPQ):
+        return "ivf_pq", "pq"
+    if isinstance(inner, faiss.IndexIVF):
+        return "ivf_flat", _codec_of(inner)
+    return "flat", _codec_of(inner)
+
+
+def index_kind(index) -> str:
+    return index_layout(index)[0]
+
+
+def target_kind(index_type: str, ntotal: int) -> str:
+    """
+    ivf 类索引在向量数不足以训练时仍使用 flat
+    """
+    params = FAISS_INDEX_TYPES.get(index_type)
+    if params is None:
+        return "flat"
+    if index_type.startswith("ivf") and ntotal < params.get("min_train_size", 0):
+        return "flat"
+    return index_type
+
+
+def target_layout(index_type: str, codec: str, ntotal: int) -> Tuple[str, str]:
+    """
+    按向量数确定实际使用的 (索引类型, 压缩方式)：pq 压缩在向量数不足以训练时使用 sq8，
+    ivf_flat 与 pq 压缩组合即为 ivf_pq
+    """
+    kind = target_kind(index_type, ntotal)
+    codec = codec if codec in FAISS_VECTOR_CODECS else "none"
+    if kind == "ivf_pq":
+        return kind, "pq"
+    if codec == "pq" and ntotal < FAISS_VECTOR_CODECS["pq"].get("min_train_size", 0):
+        codec = "sq8"
+    if kind == "ivf_flat" and codec == "pq":
+        return "ivf_pq", "pq"
+    return kind, codec
+
+
+def _pq_subquantizers(d: int, m: int) -> int:
+    # PQ 子空间数必须能整除向量维度
+    m = max(1, min(m, d))
+    while d % m:
+        m -= 1
+    return m
+
+
+def _nlist(index_type: str, ntotal: int) -> int:
+    # 每个聚类中心至少需要 39 个训练样本
+    nlist = FAISS_INDEX_TYPES.get(index_type, {}).get("nlist") or int(4 * np.sqrt(ntotal))
+    return max(1, min(nlist, ntotal // 39))
+
+
+def _needs_retrain(index, ntotal: int) -> bool:
+    """
+    自动选择 nlist 时，向量数增长到训练时的 4 倍以上（聚类中心数应翻倍）需要重新训练
+    """
+    import faiss
+    inner = faiss.downcast_index(index.index)
+    kind = index_kind(index)
+    if FAISS_INDEX_TYPES.get(kind, {}).get("nlist"):
+        return False
+    return _nlist(kind, ntotal) >= 2 * inner.nlist
+
+
+def _codec_factory(codec: str, d: int, params: Dict) -> str:
+    if codec == "fp16":
+        return "SQfp16"
+    if codec == "sq8":
+        return "SQ8"
+    if codec == "pq":
+        return f"PQ{_pq_subquantizers(d, params.get('m', 16))}x{params.get('nbits', 8)}"
+    return "Flat"
+
+
+def build_index(index_type: str, vectors: np.ndarray, ids: np.ndarray, codec: str = "none"):
+    """
+    按索引类型和压缩方式构建以文本段id为向量id的 IndexIDMap2，需要训练的索引在此完成训练
+    """
+    import faiss
+    n, d = vectors.shape
+    kind, codec = target_layout(index_type, codec, n)
+    params = FAISS_INDEX_TYPES.get(kind, {})
+    codec_params = params if kind == "ivf_pq" else FAISS_VECTOR_CODECS.get(codec, {})
+    storage = _codec_factory(codec, d, codec_params)
+    nlist = 0
+    if kind == "hnsw":
+        inner = faiss.index_factory(d, f"HNSW{params.get('M', 32)},{storage}")
+        inner.hnsw.efConstruction = params.get("ef_construction", 40)
+        inner.hnsw.efSearch = params.get("ef_search", 16)
+    elif kind in ("ivf_flat", "ivf_pq"):
+        nlist = _nlist(kind, n)
+        inner = faiss.index_factory(d, f"IVF{nlist},{storage}")
+        inner.nprobe = params.get("nprobe", 1)
+    else:
+        inner = faiss.index_factory(d, storage)
+    if not inner.is_trained:
+        sample_size = min(n, max(nlist, 256) * 256)
+        sample = vectors if sample_size == n else \
+            vectors[np.random.default_rng(0).choice(n, sample_size, replace=False)]
+        inner.train(sample)
+    index = faiss.IndexIDMap2(inner)
+    if n:
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+def extract_vectors(index) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    取出段中的全部向量与向量id，用于按新的索引类型重建
+    """
+    import faiss
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.make_direct_map()
+    ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    return inner.reconstruct_n(0, inner.ntotal), ids
+
+
+def search_parameters(index, search_params: Dict = None, selector=None):
+    """
+    将按请求指定的 nprobe / ef_search 和 id 过滤器转换为该段索引类型对应的 faiss 检索参数
+    """
+    import faiss
+    search_params = search_params or {}
+    kwargs = {"sel": selector} if selector is not None else {}
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexIVF) and (search_params.get("nprobe") or kwargs):
+        kwargs["nprobe"] = int(search_params.get("nprobe") or inner.nprobe)
+        return faiss.SearchParametersIVF(**kwargs)
+    if isinstance(inner, faiss.IndexHNSW) and (search_params.get("ef_search") or kwargs):
+        kwargs["efSearch"] = int(search_params.get("ef_search") or inner.hnsw.efSearch)
+        return faiss.SearchParametersHNSW(**kwargs)
+    return faiss.SearchParameters(**kwargs) if kwargs else None
+
+
+class FaissSegmentStore:
+    """
+    分段存储的 FAISS 向量库：
+    一个只读的基础段 + 若干只追加的增量段 + 墓碑文件（已删除的向量id）+ 文本段库(chunks.db)。
+    每个段是以文本段id为向量id的 IndexIDMap2，内存中只保存向量，文本内容在检索后按id从 chunks.db 读取。
+    新增文档只写一个新的增量段，删除文档只追加墓碑，增量段达到 FAISS_MERGE_DELTAS 个或墓碑达到
+    FAISS_MERGE_TOMBSTONES 个后在后台合并进基础段。
+    合并完成前，检索同时查询基础段和所有增量段。
+    增量段总是 flat 索引，基础段使用知识库的索引类型(index_type)，在合并时构建或训练。
+    所有段都按知识库的压缩方式(codec)保存向量；有损压缩时原始向量保存在 chunks.db 中，
+    用于检索结果的精确重排和合并时无损地重建索引。
+    """
+
+    def __init__(self,
+                 vs_path: str,
+                 embeddings: Embeddings,
+                 index_type: str = FAISS_INDEX_TYPE,
+                 codec: str = FAISS_VECTOR_CODEC,
+                 ):
+        self.vs_path = vs_path
+        self.embeddings = embeddings
+        self.index_type = index_type
+        self.codec = codec
+        self.base_name: Optional[str] = None
+        self.segments: List[Tuple[str, object]] = []  # 第一个为基础段(如果存在)，其后为增量段
+        self.tombstones: Set[int] = set()
+        self._segment_tombstones: Dict[str, int] = {}  # 每个段中被墓碑删除的向量数，墓碑变化后重新统计
+        self.next_seq = 1
+        self.version = (0, 0)
+        self.mmap = FAISS_MMAP_LOAD
+        self.chunks = ChunkStore(os.path.join(vs_path, CHUNK_DB_FILE))
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls,
+             vs_path: str,
+             embeddings: Embeddings,
+             index_type: str = FAISS_INDEX_TYPE,
+             codec: str = FAISS_VECTOR_CODEC,
+             ) -> "FaissSegmentStore":
+        store = cls(vs_path, embeddings, index_type, codec)
+        manifest = read_manifest(vs_path)
+        names = ([manifest["base"]] if manifest["base"] else []) + manifest["deltas"]
+        if any(os.path.isfile(os.path.join(vs_path, f"{name}.pkl")) for name in names):
+            with _get_write_lock(vs_path):
+                store._convert_pickled_segments(manifest)
+            manifest = read_manifest(vs_path)
+            names = ([manifest["base"]] if manifest["base"] else []) + manifest["deltas"]
+
+        store.version = read_version(vs_path)
+        store.base_name = manifest["base"]
+        store.next_seq = manifest["next_seq"]
+        store.segments = [(name, store._load_segment(name)) for name in names]
+        store.tombstones = {int(i) for i in read_tombstones(vs_path)}
+        return store
+
+    def _convert_pickled_segments(self, manifest: Dict):
+        """
+        将旧版本 (index.faiss + 保存了 InMemoryDocstore 的 index.pkl) 的向量库一次性转换为：
+        文本段写入 chunks.db，向量以文本段id写入新的基础段。转换中途失败时下次加载会重新转换。
+        """
+        import faiss
+        names = ([manifest["base"]] if manifest["base"] else []) + manifest["deltas"]
+        tombstones = read_tombstones(self.vs_path)
+        self.chunks.reset()
+        merged = None
+        for name in names:
+            index = faiss.read_index(os.path.join(self.vs_path, f"{name}.faiss"))
+            with open(os.path.join(self.vs_path, f"{name}.pkl"), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            rows = [i for i in range(index.ntotal) if index_to_docstore_id[i] not in tombstones]
+            if not rows:
+                continue
+            ids = self.chunks.add([docstore.search(index_to_docstore_id[i]) for i in rows])
+            if merged is None:
+                merged = faiss.IndexIDMap2(faiss.IndexFlatL2(index.d))
+            merged.add_with_ids(index.reconstruct_n(0, index.ntotal)[rows], np.array(ids, dtype=np.int64))
+
+        base_name = None
+        if merged is not None:
+            base_name = f"base_{manifest['next_seq']:06d}"
+            faiss.write_index(merged, os.path.join(self.vs_path, f"{base_name}.faiss"))
+        self._write_manifest(base_name, [], manifest["next_seq"] + 1)
+        _atomic_write(os.path.join(self.vs_path, TOMBSTONE_FILE), "")
+        for name in names:
+            _remove_segment_files(self.vs_path, name)
+        logger.info(f"converted {len(names)} pickled segments in {self.vs_path} to chunk store")
+
+    def _load_segment(self, name: str, mmap: bool = None):
+        mmap = self.mmap if mmap is None else mmap
+        return read_index(os.path.join(self.vs_path, f"{name}.faiss"), mmap=mmap)
+
+    def is_stale(self) -> bool:
+        return read_version(self.vs_path) != self.version
+
+    def _write_manifest(self, base: Optional[str], deltas: List[str], next_seq: int):
+        _atomic_write(os.path.join(self.vs_path, MANIFEST_FILE),
+                      json.dumps({"base": base, "deltas": deltas, "next_seq": next_seq}))
+
+    @property
+    def lossy(self) -> bool:
+        return self.codec not in (None, "none")
+
+    @property
+    def delta_names(self) -> List[str]:
+        return [name for name, _ in self.segments if name != self.base_name]
+
+    def nbytes(self) -> int:
+        """
+        以磁盘文件大小估算常驻内存，内存映射的索引文件由页缓存共享，不计入
+        """
+        if self.mmap:
+            return 0
+        size = 0
+        for name, _ in self.segments:
+            path = os.path.join(self.vs_path, f"{name}.faiss")
+            if os.path.isfile(path):
+                size += os.path.getsize(path)
+        return size
+
+    def add_documents(self, docs: List[Document], embeddings: Embeddings = None) -> List[int]:
+        """
+        将文档向量化后按压缩方式写入一个新的增量段，不读写已有的段
+        """
+        import faiss
+        embeddings = embeddings or self.embeddings
+        vectors = _normalize(embeddings.embed_documents([doc.page_content for doc in docs]))
+        with _get_write_lock(self.vs_path):
+            # 先写文本段：即使随后写段失败，多出的文本段也不会被检索到
+            ids = self.chunks.add(docs, vectors if self.lossy else None)
+            segment = build_index("flat", vectors, np.array(ids, dtype=np.int64), self.codec)
+            manifest = read_manifest(self.vs_path)
+            name = f"delta_{manifest['next_seq']:06d}"
+            faiss.write_index(segment, os.path.join(self.vs_path, f"{name}.faiss"))
+            self._write_manifest(manifest["base"], manifest["deltas"] + [name], manifest["next_seq"] + 1)
+            with self._lock:
+                self.segments.append((name, segment))
+                self.next_seq = manifest["next_seq"] + 1
+                self.version = read_version(self.vs_path)
+        if len(self.delta_names) >= FAISS_MERGE_DELTAS:
+            self.merge_in_background()
+        return ids
+
+    def delete(self, ids: List[int]):
+        """
+        删除向量只追加墓碑，合并时才真正从索引中移除
+        """
+        ids = [i for i in ids if i not in self.tombstones]
+        if not ids:
+            return
+        with _get_write_lock(self.vs_path):
+            with open(os.path.join(self.vs_path, TOMBSTONE_FILE), "a", encoding="utf-8") as f:
+                f.write("".join(f"{i}\n" for i in ids))
+            with self._lock:
+                self.tombstones.update(ids)
+                self._segment_tombstones.clear()
+                self.version = read_version(self.vs_path)
+        if len(self.tombstones) >= FAISS_MERGE_TOMBSTONES:
+            self.merge_in_background()
+
+    def delete_source(self, source: str) -> int:
+        """
+        删除来源文件的全部文本段，只访问该文件的文本段，返回删除数量
+        """
+        ids = self.chunks.ids_of_source(source)
+        if ids:
+            # 先写墓碑再删文本段，中途失败时重新删除即可恢复一致
+            self.delete(ids)
+            self.chunks.delete_source(source)
+        return len(ids)
+
+    def delete_chunks(self, ids: List[int]):
+        """
+        删除指定的文本段，用于更新文件时只删除已不存在的文本段
+        """
+        if ids:
+            self.delete(ids)
+            self.chunks.delete(ids)
+
+    def similarity_search_with_score(self,
+                                     query: str,
+                                     k: int,
+                                     score_threshold: float = None,
+                                     search_params: Dict = None,
+                                     ) -> List[Tuple[Document, float]]:
+        """
+        search_params 可覆盖默认检索参数: nprobe (ivf 类索引)、ef_search (hnsw 索引)
+        """
+        vector = _normalize([self.embeddings.embed_query(query)])
+        return self.search_by_vectors(vector, k, score_threshold, search_params)[0]
+
+    def similarity_search_with_score_by_vector(self,
+                                               embedding: List[float],
+                                               k: int,
+                                               score_threshold: float = None,
+                                               search_params: Dict = None,
+                                               ) -> List[Tuple[Document, float]]:
+        return self.search_by_vectors(_normalize([embedding]), k, score_threshold, search_params)[0]
+
+    def similarity_search_with_score_batch(self,
+                                           queries: List[str],
+                                           k: int,
+                                           score_threshold: float = None,
+                                           search_params: Dict = None,
+                                           ) -> List[List[Tuple[Document, float]]]:
+        """
+        批量检索：一次前向计算得到全部查询向量，每个段只做一次矩阵检索。
+        嵌入模型带查询向量缓存时（embed_queries）只计算未缓存的查询
+        """
+        if not queries:
+            return []
+        if hasattr(self.embeddings, "embed_queries"):
+            vectors = self.embeddings.embed_queries(queries)
+        else:
+            vectors = [self.embeddings.embed_query(query) for query in queries]
+        vectors = _normalize(vectors)
+        return self.search_by_vectors(vectors, k, score_threshold, search_params)
+
+    def search_by_vectors(self,
+                          vectors: np.ndarray,
+                          k: int,
+                          score_threshold: float = None,
+                          search_params: Dict = None,
+                          ) -> List[List[Tuple[Document, float]]]:
+        """
+        search_params 中的 sources 为来源文件列表时，只检索这些文件的文本段，过滤在索引检索过程中完成
+        """
+        selector_ids = None
+        if search_params and search_params.get("sources") is not None:
+            selector_ids = np.array(self.chunks.ids_of_sources(search_params["sources"]), dtype=np.int64)
+            if len(selector_ids) == 0:
+                return [[] for _ in range(len(vectors))]
+
+        with self._lock:
+            segments = [(seg, self._tombstones_in(name, seg)) for name, seg in self.segments]
+            tombstones = set(self.tombstones)
+
+        # 有损压缩时多取候选，再用原始向量重排
+        rerank = self.lossy and FAISS_RERANK_FACTOR > 0
+        candidate_k = k * FAISS_RERANK_FACTOR if rerank else k
+        candidates = [[] for _ in range(len(vectors))]
+        for seg, dead in segments:
+            if seg.ntotal == 0:
+                continue
+            # 每个段最多有该段中被删除的向量数个结果被过滤，多取这些即可保证 top k 正确
+            fetch_k = min(seg.ntotal, candidate_k + dead)
+            scores, ids = self._search_segment(seg, vectors, fetch_k, search_params, selector_ids)
+            for row in range(len(vectors)):
+                candidates[row].extend((score, _id) for score, _id in zip(scores[row], ids[row])
+                                       if _id != -1 and _id not in tombstones)
+
+        for row in range(len(vectors)):
+            candidates[row].sort(key=lambda x: x[0])
+            candidates[row] = candidates[row][:candidate_k]
+        if rerank:
+            raw = self.chunks.get_vectors({_id for row in candidates for _, _id in row})
+            candidates = [self._rerank(vectors[i], row, raw) for i, row in enumerate(candidates)]
+        candidates = [[(score, _id) for score, _id in row[:k]
+                       if score_threshold is None or score <= score_threshold]
+                      for row in candidates]
+        # 所有查询的文本段一次读取
+        docs = self.chunks.get(list({_id for row in candidates for _, _id in row}))
+        return [[(docs[_id], score) for score, _id in row if _id in docs] for row in candidates]
+
+    def _tombstones_in(self, name: str, seg) -> int:
+        """
+        段中已被墓碑删除的向量数，按段缓存，调用方需持有 self._lock
+        """
+        if not self.tombstones:
+            return 0
+        if name not in self._segment_tombstones:
+            import faiss
+            seg_ids = faiss.vector_to_array(seg.id_map)
+            removed = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            self._segment_tombstones[name] = int(np.isin(seg_ids, removed).sum())
+        return self._segment_tombstones[name]
+
+    def _search_segment(self, seg, vectors: np.ndarray, k: int, search_params: Dict = None, selector_ids=None):
+        """
+        检索单个段，selector_ids 不为空时只检索这些id。
+        hnsw 在过滤条件严格时图遍历会提前结束、召回不足，IndexPQ 不支持按id过滤，
+        这两种情况下对满足条件的向量直接精确计算距离。
+        """
+        import faiss
+        if selector_ids is None:
+            return seg.search(vectors, min(k, seg.ntotal), params=search_parameters(seg, search_params))
+        inner = faiss.downcast_index(seg.index)
+        if isinstance(inner, (faiss.IndexHNSW, faiss.IndexPQ)):
+            seg_ids = faiss.vector_to_array(seg.id_map)
+            positions = np.nonzero(np.isin(seg_ids, selector_ids))[0]
+            if isinstance(inner, faiss.IndexPQ) or len(positions) <= FAISS_FILTER_EXACT_MAX:
+                return self._exact_search(inner, seg_ids[positions], positions, vectors, k)
+        selector = faiss.IDSelectorBatch(selector_ids)
+        return seg.search(vectors, min(k, seg.ntotal), params=search_parameters(seg, search_params, selector))
+
+    def _exact_search(self, inner, ids: np.ndarray, positions: np.ndarray, vectors: np.ndarray, k: int):
+        import faiss
+        if len(ids) == 0:
+            return np.zeros((len(vectors), 0), dtype=np.float32), np.zeros((len(vectors), 0), dtype=np.int64)
+        raw = self.chunks.get_vectors(ids.tolist()) if self.lossy else {}
+        data = np.array([raw[_id] if _id in raw else inner.reconstruct(int(pos)) for _id, pos in zip(ids, positions)],
+                        dtype=np.float32)
+        scores, rows = faiss.knn(vectors, data, min(k, len(ids)))
+        return scores, np.where(rows >= 0, ids[rows], -1)
+
+    @staticmethod
+    def _rerank(vector: np.ndarray,
+                candidates: List[Tuple[float, int]],
+                raw: Dict[int, np.ndarray],
+                ) -> List[Tuple[float, int]]:
+        """
+        用原始向量重新计算候选的精确距离，没有原始向量的候选保留近似距离
+        """
+        reranked = []
+        for score, _id in candidates:
+            if _id in raw:
+                score = float(np.sum((raw[_id] - vector) ** 2))
+            reranked.append((score, _id))
+        reranked.sort(key=lambda x: x[0])
+        return reranked
+
+    def _segment_vectors(self, index) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        取出段中的向量，有损压缩时优先使用 chunks.db 中的原始向量，避免重复量化损失精度
+        """
+        vectors, ids = extract_vectors(index)
+        if self.lossy and len(ids):
+            raw = self.chunks.get_vectors(ids.tolist())
+            for row, _id in enumerate(ids):
+                if _id in raw:
+                    vectors[row] = raw[_id]
+        return vectors, ids
+
+    def merge_in_background(self):
+        abs_path = os.path.abspath(self.vs_path)
+        with _write_locks_guard:
+            if abs_path in _merging:
+                return
+            _merging.add(abs_path)
+        threading.Thread(target=self._merge_and_release, daemon=True).start()
+
+    def _merge_and_release(self):
+        try:
+            self.merge()
+        except Exception as e:
+            logger.error(f"merge vector store segments in {self.vs_path} failed: {e}")
+        finally:
+            with _write_locks_guard:
+                _merging.discard(os.path.abspath(self.vs_path))
+
+    def merge(self):
+        """
+        将当前所有增量段合并进基础段，并物理删除墓碑中的向量。
+        基础段的索引类型与知识库的 index_type 不一致时（如 ivf 索引的向量数刚达到训练条件）重建基础段，
+        否则将增量段的向量直接追加进基础段。
+        合并过程不持有写锁，期间新增的段和墓碑会在合并完成后保留。
+        """
+        import faiss
+        with _get_write_lock(self.vs_path):
+            manifest = read_manifest(self.vs_path)
+            tombstones = read_tombstones(self.vs_path)
+        names = ([manifest["base"]] if manifest["base"] else []) + manifest["deltas"]
+        if not names:
+            return
+
+        # 合并需要修改索引，不能使用只读的内存映射
+        segments = [self._load_segment(name, mmap=False) for name in names]
+        removed_ids = np.array([int(i) for i in tombstones], dtype=np.int64)
+        ntotal = sum(seg.ntotal for seg in segments) - len(tombstones)
+        layout = target_layout(self.index_type, self.codec, ntotal)
+        kind = layout[0]
+        base_layout = index_layout(segments[0]) if manifest["base"] else None
+        # hnsw 不支持删除向量，有墓碑时只能重建
+        rebuild = base_layout != layout or (kind == "hnsw" and len(tombstones) > 0) \
+            or (kind.startswith("ivf") and _needs_retrain(segments[0], ntotal))
+        if not rebuild and len(names) == 1 and not tombstones:
+            return
+
+        if rebuild:
+            vectors, ids = zip(*[self._segment_vectors(seg) for seg in segments])
+            vectors, ids = np.concatenate(vectors), np.concatenate(ids)
+            keep = ~np.isin(ids, removed_ids)
+            merged = build_index(self.index_type, vectors[keep], ids[keep], self.codec)
+            removed = int((~keep).sum())
+        else:
+            merged = segments[0]
+            for seg in segments[1:]:
+                merged.add_with_ids(*self._segment_vectors(seg))
+            removed = merged.remove_ids(removed_ids) if tombstones else 0
+
+        with _get_write_lock(self.vs_path):
+            current = read_manifest(self.vs_path)
+            if current["base"] != manifest["base"] or current["deltas"][:len(manifest["deltas"])] != manifest["deltas"]:
+                logger.warning(f"vector store {self.vs_path} changed during merge, discard merged segment")
+                return
+            base_name = f"base_{current['next_seq']:06d}"
+            faiss.write_index(merged, os.path.join(self.vs_path, f"{base_name}.faiss"))
+            remaining = current["deltas"][len(manifest["deltas"]):]
+            self._write_manifest(base_name, remaining, current["next_seq"] + 1)
+            remaining_tombstones = read_tombstones(self.vs_path) - tombstones
+            _atomic_write(os.path.join(self.vs_path, TOMBSTONE_FILE),
+                          "".join(f"{i}\n" for i in remaining_tombstones))
+            if self.mmap:
+                merged = self._load_segment(base_name)
+            with self._lock:
+                self.base_name = base_name
+                self.segments = [(base_name, merged)] + [(n, s) for n, s in self.segments if n in remaining]
+                self.tombstones -= {int(i) for i in tombstones}
+                self._segment_tombstones.clear()
+                self.next_seq = current["next_seq"] + 1
+                self.version = read_version(self.vs_path)
+            for name in names:
+                _remove_segment_files(self.vs_path, name)
+        logger.info(f"merged {len(names)} segments in {self.vs_path} into {index_layout(merged)} index, "
+                    f"{removed} vectors removed")
@@ -0,0 +1,266 @@
+import inspect
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from configs.model_config import INGEST_WORKERS, INGEST_EMBED_THREADS, INGEST_QUEUE_SIZE, logger
+from server.knowledge_base.kb_service.base import KBService
+from server.knowledge_base.utils import KnowledgeFile, preload_text_splitters
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    写入阶段使用的嵌入模型：已在向量化阶段计算过的文本直接返回结果，其余文本交给原模型
+    """
+
+    def __init__(self, texts: List[str], vectors: List[List[float]], embeddings: Embeddings):
+        self.vectors = dict(zip(texts, vectors))
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if all(text in self.vectors for text in texts):
+            return [self.vectors[text] for text in texts]
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+def _load_file(filename: str, kb_name: str, user_id: int) -> Tuple[List[Document], str, float]:
+    """
+    在子进程中读取并切分文件，返回文本段、使用的分词器名称和耗时
+    """
+    start = time.perf_counter()
+    kb_file = KnowledgeFile(filename, kb_name, user_id)
+    docs = kb_file.file2text()
+    return docs, kb_file.text_splitter_name, time.perf_counter() - start
+
+
+def _embed(embeddings: Embeddings, docs: List[Document]) -> Tuple[List[List[float]], float]:
+    start = time.perf_counter()
+    vectors = embeddings.embed_documents([doc.page_content for doc in docs]) if docs else []
+    return vectors, time.perf_counter() - start
+
+
+def _stage_stats(files: int, chunks: int, busy: float, elapsed: float) -> Dict:
+    return {
+        "files": files,
+        "chunks": chunks,
+        "busy_seconds": busy,
+        "files_per_second": files / elapsed if elapsed else 0.0,
+        "chunks_per_second": chunks / elapsed if elapsed else 0.0,
+    }
+
+
+def _new_counters() -> Dict:
+    return {stage: {"files": 0, "chunks": 0, "busy": 0.0} for stage in ("load", "embed", "write")}
+
+
+def _stats(counters: Dict, start: float) -> Dict:
+    elapsed = time.perf_counter() - start
+    result = {stage: _stage_stats(c["files"], c["chunks"], c["busy"], elapsed) for stage, c in counters.items()}
+    result["elapsed"] = elapsed
+    return result
+
+
+def notify(callback: Optional[Callable], kb_file: KnowledgeFile, i: int, filenames: List[str], extra):
+    """
+    调用入库回调 callback(kb_file, i, filenames, extra)；只接受 (kb_file, i, filenames) 三个参数的回调不传 extra
+    """
+    if not callable(callback):
+        return
+    try:
+        inspect.signature(callback).bind(kb_file, i, filenames, extra)
+    except (TypeError, ValueError):
+        callback(kb_file, i, filenames)
+    else:
+        callback(kb_file, i, filenames, extra)
+
+
+def _load_and_embed(kb: KBService,
+                    filenames: List[str],
+                    embeddings: Embeddings,
+                    counters: Dict,
+                    workers: int,
+                    ) -> Iterator[Tuple[int, str, List[Document], str, List[List[float]], Optional[Exception]]]:
+    """
+    进程池读取、切分文件 -> 线程池调用嵌入模型（并发请求由动态批处理合并为大批次），
+    按文件顺序依次产出 (序号, 文件名, 文本段, 分词器名称, 向量, 异常)，读取或向量化失败时文本段为 None。
+    各阶段之间最多积压 INGEST_QUEUE_SIZE 个文件，内存占用不随知识库大小增长
+    """
+    workers = workers or os.cpu_count()
+    # 文件很少时不值得启动子进程
+    if workers > 1 and len(filenames) > 1:
+        # 子进程启动时即构建文本分词器，spaCy 模型在每个子进程中只加载一次
+        load_pool = ProcessPoolExecutor(max_workers=min(workers, len(filenames)),
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=preload_text_splitters)
+    else:
+        load_pool = ThreadPoolExecutor(max_workers=1)
+    embed_pool = ThreadPoolExecutor(max_workers=INGEST_EMBED_THREADS, thread_name_prefix="ingest_embed")
+    loading, embedding = deque(), deque()
+    pending = iter(enumerate(filenames))
+
+    def fill_loading():
+        while len(loading) < INGEST_QUEUE_SIZE:
+            item = next(pending, None)
+            if item is None:
+                return
+            i, filename = item
+            loading.append((i, filename, load_pool.submit(_load_file, filename, kb.kb_name, kb.user_id)))
+
+    try:
+        fill_loading()
+        while loading or embedding:
+            # 已读取完的文件进入向量化阶段；向量化阶段为空时等待最早提交的文件
+            while loading and len(embedding) < INGEST_QUEUE_SIZE and (loading[0][2].done() or not embedding):
+                i, filename, future = loading.popleft()
+                error = None
+                try:
+                    docs, splitter_name, busy = future.result()
+                except Exception as e:
+                    logger.error(f"load file {filename} failed: {e}")
+                    docs, splitter_name, busy, error = None, None, 0.0, e
+                counters["load"]["files"] += 1
+                counters["load"]["chunks"] += len(docs or [])
+                counters["load"]["busy"] += busy
+                embedding.append((i, filename, docs, splitter_name, error,
+                                  embed_pool.submit(_embed, embeddings, docs or [])))
+                fill_loading()
+            if not embedding:
+                continue
+
+            i, filename, docs, splitter_name, error, future = embedding.popleft()
+            if error is not None:
+                yield i, filename, None, splitter_name, [], error
+                continue
+            try:
+                vectors, busy = future.result()
+            except Exception as e:
+                logger.error(f"embed file {filename} failed: {e}")
+                yield i, filename, None, splitter_name, [], e
+                continue
+            counters["embed"]["files"] += 1
+            counters["embed"]["chunks"] += len(vectors)
+            counters["embed"]["busy"] += busy
+            yield i, filename, docs, splitter_name, vectors, None
+    finally:
+        load_pool.shutdown(wait=False, cancel_futures=True)
+        embed_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def ingest_files(kb: KBService,
+                 filenames: List[str],
+                 replace: bool = False,
+                 callback_before: Callable = None,
+                 callback_after: Callable = None,
+                 workers: int = INGEST_WORKERS,
+                 callback_error: Callable = None,
+                 ) -> Dict:
+    """
+    多核并行入库：读取、切分和向量化见 _load_and_embed，当前线程作为唯一的写入者依次写入向量库和数据库。
+    replace 为 True 时按文本段更新文件（见 KBService.update_doc）。
+    callback_before / callback_after 在写入每个文件前后调用，参数为 (kb_file, i, filenames, stats)，
+    stats 为截至当前各阶段的文件数、文本段数、累计耗时和吞吐量；只接受前三个参数的回调不传 stats。
+    读取、向量化或写入失败的文件跳过，调用 callback_error(kb_file, i, filenames, 异常)。
+    返回最终的 stats，其中 failed 为失败的文件名列表
+    """
+    embeddings = kb._load_embeddings()
+    start = time.perf_counter()
+    counters = _new_counters()
+    failed = []
+
+    for i, filename, docs, splitter_name, vectors, error in _load_and_embed(kb, filenames, embeddings, counters,
+                                                                             workers):
+        kb_file = KnowledgeFile(filename, kb.kb_name, kb.user_id)
+        kb_file.text_splitter_name = splitter_name
+        if error is not None:
+            failed.append(filename)
+            notify(callback_error, kb_file, i, filenames, error)
+            continue
+        notify(callback_before, kb_file, i, filenames, _stats(counters, start))
+        write_start = time.perf_counter()
+        try:
+            precomputed = PrecomputedEmbeddings([doc.page_content for doc in docs], vectors, embeddings)
+            if replace:
+                kb.update_doc(kb_file, docs, precomputed)
+            else:
+                kb.add_doc(kb_file, docs, precomputed)
+        except Exception as e:
+            logger.error(f"write file {filename} failed: {e}")
+            failed.append(filename)
+            notify(callback_error, kb_file, i, filenames, e)
+            continue
+        counters["write"]["files"] += 1
+        counters["write"]["chunks"] += len(docs)
+        counters["write"]["busy"] += time.perf_counter() - write_start
+        notify(callback_after, kb_file, i, filenames, _stats(counters, start))
+
+    result = _stats(counters, start)
+    result["failed"] = failed
+    logger.info(f"ingested {result['write']['files']}/{len(filenames)} files of {kb.kb_name} "
+                f"in {result['elapsed']:.1f}s, {result['write']['chunks_per_second']:.1f} chunks/s")
+    if failed:
+        logger.warning(f"{len(failed)} files of {kb.kb_name} failed: {failed}")
+    return result
+
+
+def ingest_files_batch(kb: KBService,
+                       filenames: List[str],
+                       replace: bool = False,
+                       category: str = None,
+                       workers: int = INGEST_WORKERS,
+                       ) -> Iterator[Dict]:
+    """
+    批量入库：与 ingest_files 一样并行读取和向量化，但所有文件的文本段在最后一次写入向量库（FAISS 只生成一个增量段），
+    文件信息在一个数据库事务中写入。replace 为 True 时先删除已在知识库中的同名文件，category 为所有文件的分类。
+    依次产出每个文件的状态 {"total", "finished", "doc", "status": "embedded" | "failed", "chunks"}，失败时带有 msg，
+    最后产出写入结果 {"total", "finished", "status": "committed" | "failed", "files", "chunks", "stats"}
+    """
+    embeddings = kb._load_embeddings()
+    start = time.perf_counter()
+    counters = _new_counters()
+    files, texts, vectors_all = [], [], []
+    finished = 0
+
+    for i, filename, docs, splitter_name, vectors, error in _load_and_embed(kb, filenames, embeddings, counters,
+                                                                             workers):
+        finished += 1
+        status = {"total": len(filenames), "finished": finished, "doc": filename,
+                  "status": "failed" if docs is None else "embedded", "chunks": len(docs or [])}
+        if error is not None:
+            status["msg"] = str(error)
+        if docs:
+            kb_file = KnowledgeFile(filename, kb.kb_name, kb.user_id, category=category)
+            kb_file.text_splitter_name = splitter_name
+            files.append((kb_file, docs))
+            texts.extend(doc.page_content for doc in docs)
+            vectors_all.extend(vectors)
+        yield status
+
+    result = {"total": len(filenames), "finished": finished, "files": len(files), "chunks": len(texts)}
+    write_start = time.perf_counter()
+    try:
+        if replace:
+            existing = set(kb.list_docs())
+            for kb_file, _ in files:
+                if kb_file.filename in existing:
+                    kb.delete_doc(kb_file)
+        kb.add_docs(files, PrecomputedEmbeddings(texts, vectors_all, embeddings))
+    except Exception as e:
+        logger.error(f"write {len(files)} files to {kb.kb_name} failed: {e}")
+        yield {**result, "status": "failed", "msg": str(e), "stats": _stats(counters, start)}
+        return
+    counters["write"]["files"] += len(files)
+    counters["write"]["chunks"] += len(texts)
+    counters["write"]["busy"] += time.perf_counter() - write_start
+    stats = _stats(counters, start)
+    logger.info(f"ingested {len(files)}/{len(filenames)} files of {kb.kb_name} in one batch "
+                f"in {stats['elapsed']:.1f}s, {stats['write']['chunks_per_second']:.1f} chunks/s")
+    yield {**result, "status": "committed", "stats": stats}
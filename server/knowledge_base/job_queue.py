@@ -0,0 +1,152 @@
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from typing import List
+
+from configs.model_config import (JOB_WORKERS, JOB_POLL_INTERVAL, JOB_HEARTBEAT_INTERVAL, JOB_HEARTBEAT_EXPIRE,
+                                  EMBEDDING_BATCH_SIZE, NLTK_DATA_PATH, logger)
+from server.db.repository.knowledge_file_repository import doc_exists
+from server.db.repository.knowledge_job_repository import (claim_job, update_job_progress, heartbeat_job, finish_job,
+                                                           requeue_stale_jobs)
+from server.knowledge_base.ingest import PrecomputedEmbeddings
+from server.knowledge_base.kb_service.base import KBServiceFactory
+from server.knowledge_base.utils import KnowledgeFile, preload_text_splitters
+
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCESS = "success"
+    FAILED = "failed"
+
+
+def process_job(job: dict):
+    """
+    处理一个上传文件的入库任务：读取切分、分批向量化、写入向量库和数据库，并记录各阶段的进度
+    """
+    job_id, worker = job["job_id"], job["worker"]
+
+    def progress(value: float, message: str):
+        # 心跳超时后任务可能已被重新放回队列，此时不再继续写入，避免同一文件入库两次
+        if not update_job_progress(job_id, value, message, worker=worker):
+            raise RuntimeError(f"任务 {job_id} 已被重新分配")
+
+    kb = KBServiceFactory.get_service_by_name(job["kb_name"], job["user_id"])
+    if kb is None:
+        raise ValueError(f"未找到知识库 {job['kb_name']}")
+    kb_file = KnowledgeFile(job["file_name"], job["kb_name"], job["user_id"], category=job["category"])
+
+    progress(0.05, "读取并切分文件")
+    docs = kb_file.file2text()
+    if not docs:
+        return "文件中没有可入库的内容"
+
+    # 向量化占进度的大部分，按批计算并更新进度，算好的向量写入时直接使用
+    embeddings = kb._load_embeddings()
+    texts = [doc.page_content for doc in docs]
+    vectors = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(embeddings.embed_documents(texts[start:start + EMBEDDING_BATCH_SIZE]))
+        progress(0.1 + 0.8 * len(vectors) / len(texts), f"向量化 {len(vectors)}/{len(texts)} 个文本段")
+
+    progress(0.9, "写入向量库")
+    precomputed = PrecomputedEmbeddings(texts, vectors, embeddings)
+    # 覆盖上传已入库的文件时按文本段更新，不保留旧文件的文本段
+    if doc_exists(kb_file):
+        result = kb.update_doc(kb_file, docs, precomputed)
+        return (f"成功更新文件 {kb_file.filename}，共 {len(docs)} 个文本段，"
+                f"复用 {result['reused']} 个，新增 {result['added']} 个")
+    kb.add_doc(kb_file, docs, precomputed)
+    return f"成功上传文件 {kb_file.filename}，共 {len(docs)} 个文本段"
+
+
+def _keep_alive(job: dict, done: threading.Event):
+    """
+    处理任务期间定时刷新心跳，读取大文件等没有进度更新的阶段也不会被误判为已退出
+    """
+    while not done.wait(JOB_HEARTBEAT_INTERVAL):
+        try:
+            if not heartbeat_job(job["job_id"], job["worker"]):
+                return
+        except Exception as e:
+            logger.error(f"job {job['job_id']} heartbeat failed: {e}")
+
+
+def run_job_worker(worker: str, stop_event=None):
+    """
+    工作进程主循环：将心跳超时的任务放回队列，领取任务并处理，没有可领取的任务时等待 JOB_POLL_INTERVAL 秒
+    """
+    import nltk
+    nltk.data.path = [NLTK_DATA_PATH] + nltk.data.path
+
+    preload_text_splitters()
+    logger.info(f"job worker {worker} started")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            requeue_stale_jobs(JOB_HEARTBEAT_EXPIRE)
+            job = claim_job(worker)
+        except Exception as e:
+            logger.error(f"job worker {worker} claim failed: {e}")
+            job = None
+        if job is None:
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        done = threading.Event()
+        threading.Thread(target=_keep_alive, args=(job, done), daemon=True).start()
+        try:
+            message = process_job(job)
+            finish_job(job["job_id"], True, message, worker=job["worker"])
+        except Exception as e:
+            logger.error(f"job {job['job_id']} ({job['kb_name']}/{job['file_name']}) failed: {e}")
+            finish_job(job["job_id"], False, f"{type(e).__name__}: {e}", worker=job["worker"])
+        finally:
+            done.set()
+
+
+_workers: List = []
+_stop_event = None
+
+
+def start_job_workers(num_workers: int = JOB_WORKERS):
+    """
+    服务启动时调用：将心跳超时（上次中断）的任务重新放回队列，并启动 num_workers 个工作进程，每个进程各自加载嵌入模型。
+    其他 API 进程或工作进程仍在处理的任务有心跳，不会被重新放回队列。
+    num_workers 为 0 时不处理任务（由单独运行的 job_worker.py 处理），为 -1 时在 API 服务进程的后台线程中处理，共用已加载的嵌入模型
+    """
+    global _stop_event
+    if _workers:
+        return
+    requeue_stale_jobs(JOB_HEARTBEAT_EXPIRE)
+    if num_workers == 0:
+        logger.info("job workers are not started in this process, run job_worker.py to process upload jobs")
+        return
+    prefix = f"{socket.gethostname()}-{os.getpid()}"
+    if num_workers > 0:
+        ctx = multiprocessing.get_context("spawn")
+        _stop_event = ctx.Event()
+        for i in range(num_workers):
+            process = ctx.Process(target=run_job_worker, args=(f"{prefix}-{i}", _stop_event),
+                                  name=f"job_worker_{i}", daemon=True)
+            process.start()
+            _workers.append(process)
+    else:
+        _stop_event = threading.Event()
+        thread = threading.Thread(target=run_job_worker, args=(f"{prefix}-thread", _stop_event),
+                                  name="job_worker", daemon=True)
+        thread.start()
+        _workers.append(thread)
+
+
+def stop_job_workers(timeout: float = 5.0):
+    """
+    服务关闭时调用：等待正在处理的任务结束，超时后终止工作进程，未完成的任务在心跳超时后重新处理
+    """
+    if _stop_event is not None:
+        _stop_event.set()
+    for worker in _workers:
+        worker.join(timeout)
+        if isinstance(worker, multiprocessing.process.BaseProcess) and worker.is_alive():
+            worker.terminate()
+    _workers.clear()
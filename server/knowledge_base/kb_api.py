@@ -1,9 +1,12 @@
 import urllib
-from server.utils import BaseResponse, ListResponse
-from server.knowledge_base.utils import validate_kb_name
+from server.utils import BaseResponse, ListResponse, StatsResponse
+from server.knowledge_base.utils import validate_kb_name, embedding_stats, text_splitter_stats
 from server.knowledge_base.kb_service.base import KBServiceFactory
 from server.db.repository.knowledge_base_repository import list_kbs_from_db
-from configs.model_config import EMBEDDING_MODEL
+from server.knowledge_base.embedding_cache import query_cache_stats, chunk_cache_stats
+from server.knowledge_base.kb_service.faiss_kb_service import kb_vs_pool
+from configs.model_config import (EMBEDDING_MODEL, FAISS_INDEX_TYPE, FAISS_INDEX_TYPES,
+                                  FAISS_VECTOR_CODEC, FAISS_VECTOR_CODECS)
 from fastapi import Body
 from fastapi import Depends
 
@@ -19,6 +22,10 @@ async def list_kbs(current_user: User = Depends(get_current_user)):
 async def create_kb(knowledge_base_name: str = Body(..., examples=["samples"]),
                     vector_store_type: str = Body("faiss"),
                     embed_model: str = Body(EMBEDDING_MODEL),
+                    index_type: str = Body(FAISS_INDEX_TYPE, description="向量索引类型，仅对 faiss 知识库有效",
+                                           examples=list(FAISS_INDEX_TYPES)),
+                    vector_codec: str = Body(FAISS_VECTOR_CODEC, description="向量压缩方式，仅对 faiss 知识库有效",
+                                             examples=list(FAISS_VECTOR_CODECS)),
                     current_user: User = Depends(get_current_user)
                     ):
     user_id = current_user.user_id
@@ -27,12 +34,17 @@ async def create_kb(knowledge_base_name: str = Body(..., examples=["samples"]),
         return BaseResponse(code=403, msg="Don't attack me")
     if knowledge_base_name is None or knowledge_base_name.strip() == "":
         return BaseResponse(code=404, msg="知识库名称不能为空，请重新填写知识库名称")
+    if index_type not in FAISS_INDEX_TYPES:
+        return BaseResponse(code=400, msg=f"不支持的向量索引类型 {index_type}，可选 {list(FAISS_INDEX_TYPES)}")
+    if vector_codec not in FAISS_VECTOR_CODECS:
+        return BaseResponse(code=400, msg=f"不支持的向量压缩方式 {vector_codec}，可选 {list(FAISS_VECTOR_CODECS)}")
 
     kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
     if kb is not None:
         return BaseResponse(code=404, msg=f"已存在同名知识库 {knowledge_base_name}")
 
-    kb = KBServiceFactory.get_service(user_id, knowledge_base_name, vector_store_type, embed_model)
+    kb = KBServiceFactory.get_service(user_id, knowledge_base_name, vector_store_type, embed_model,
+                                      index_type, vector_codec)
     kb.create_kb()
     return BaseResponse(code=200, msg=f"已新增知识库 {knowledge_base_name}")
 
@@ -61,3 +73,16 @@ async def delete_kb(
         print(e)
 
     return BaseResponse(code=500, msg=f"删除知识库失败 {knowledge_base_name}")
+
+
+async def cache_stats(current_user: User = Depends(get_current_user)):
+    """
+    查询向量缓存、文本段向量缓存、嵌入模型、FAISS 向量库缓存及文本分词器的命中及使用统计
+    """
+    return StatsResponse(data={
+        "embeddings": embedding_stats(),
+        "query_embedding": query_cache_stats(),
+        "chunk_embedding": chunk_cache_stats(),
+        "vector_store": kb_vs_pool.stats(),
+        "text_splitters": text_splitter_stats(),
+    })
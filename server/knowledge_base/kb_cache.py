@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+from configs.model_config import logger
+
+
+class CachePool:
+    """
+    按常驻内存字节数淘汰的 LRU 缓存池，线程安全。
+    同一个 key 并发加载时只会加载一次，其余调用者等待加载结果。
+    缓存项数量多、单项很小时（如查询向量）可设置 verbose=False，不逐条记录加载和淘汰日志；
+    on_evict 在缓存项被淘汰或失效时调用，用于释放其占用的线程、显存等资源。
+    """
+
+    def __init__(self,
+                 max_bytes: int,
+                 name: str = "cache",
+                 verbose: bool = True,
+                 on_evict: Callable[[Any], None] = None,
+                 ):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.on_evict = on_evict
+        self._items: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._resident_bytes = 0
+        self._lock = threading.RLock()
+        self._loading_locks: Dict[Hashable, threading.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._load_time = 0.0
+
+    def get(self,
+            key: Hashable,
+            loader: Callable[[], Any],
+            sizeof: Callable[[Any], int],
+            validate: Callable[[Any], bool] = None,
+            ) -> Any:
+        """
+        返回缓存对象，不存在时调用 loader 加载，并用 sizeof 估算其常驻字节数。
+        validate 返回 False 时（如磁盘上的数据已被其他进程修改）丢弃缓存并重新加载。
+        """
+        with self._lock:
+            if key in self._items:
+                if validate is None or validate(self._items[key][0]):
+                    self._items.move_to_end(key)
+                    self._hits += 1
+                    return self._items[key][0]
+                self._drop(key)
+            load_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._items:  # 等待期间已由其他线程加载完成
+                    self._items.move_to_end(key)
+                    self._hits += 1
+                    return self._items[key][0]
+                self._misses += 1
+
+            start = time.perf_counter()
+            try:
+                obj = loader()
+            finally:
+                with self._lock:
+                    self._loading_locks.pop(key, None)
+            elapsed = time.perf_counter() - start
+            size = sizeof(obj)
+
+            with self._lock:
+                self._load_time += elapsed
+                self._put(key, obj, size)
+            if self.verbose:
+                logger.info(f"{self.name} cache loaded {key} in {elapsed:.2f}s, {size / 1024 ** 2:.1f}MB")
+            return obj
+
+    def peek(self, key: Hashable) -> Any:
+        """
+        返回已缓存的对象并计为一次命中，不存在时返回None且不计为未命中（由调用者随后 put）
+        """
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return self._items[key][0]
+
+    def put(self, key: Hashable, obj: Any, size: int):
+        with self._lock:
+            self._put(key, obj, size)
+
+    def _put(self, key: Hashable, obj: Any, size: int):
+        if key in self._items and self._items[key][0] is not obj:
+            self._drop(key)
+        elif key in self._items:
+            self._resident_bytes -= self._items.pop(key)[1]
+        self._items[key] = (obj, size)
+        self._resident_bytes += size
+        # 至少保留刚放入的对象，即使它本身已超出预算
+        while self._resident_bytes > self.max_bytes and len(self._items) > 1:
+            old_key = next(iter(self._items))
+            old_size = self._drop(old_key)
+            self._evictions += 1
+            if self.verbose:
+                logger.info(f"{self.name} cache evicted {old_key}, {old_size / 1024 ** 2:.1f}MB")
+
+    def _drop(self, key: Hashable) -> int:
+        obj, size = self._items.pop(key)
+        self._resident_bytes -= size
+        if self.on_evict is not None:
+            try:
+                self.on_evict(obj)
+            except Exception as e:
+                logger.error(f"{self.name} cache failed to release {key}: {e}")
+        return size
+
+    def invalidate(self, *key_prefix: Any) -> int:
+        """
+        删除所有以 key_prefix 开头的缓存项，返回删除数量
+        """
+        with self._lock:
+            keys = [k for k in self._items
+                    if (k[:len(key_prefix)] if isinstance(k, tuple) else (k,)) == key_prefix]
+            for k in keys:
+                self._drop(k)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for k in list(self._items):
+                self._drop(k)
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        当前缓存项的快照，不计入命中统计
+        """
+        with self._lock:
+            return [(k, v[0]) for k, v in self._items.items()]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "name": self.name,
+                "entries": len(self._items),
+                "resident_bytes": self._resident_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "avg_load_time": self._load_time / self._misses if self._misses else 0.0,
+            }
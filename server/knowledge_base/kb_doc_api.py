@@ -1,15 +1,26 @@
 import os
 import urllib
 from fastapi import File, Form, Body, Query, UploadFile
-from configs.model_config import (DEFAULT_VS_TYPE, EMBEDDING_MODEL, VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD)
-from server.utils import BaseResponse, ListResponse
+from configs.model_config import (DEFAULT_VS_TYPE, EMBEDDING_MODEL, VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD,
+                                  FAISS_INDEX_TYPES, FAISS_VECTOR_CODECS)
+from server.utils import BaseResponse, ListResponse, JobResponse
 from server.knowledge_base.utils import validate_kb_name, list_docs_from_folder, KnowledgeFile
 from fastapi.responses import StreamingResponse, FileResponse
 import json
-from server.knowledge_base.kb_service.base import KBServiceFactory
-from typing import List, Dict
+from server.knowledge_base.kb_service.base import KBServiceFactory, KBService
+from server.knowledge_base.multi_kb_search import search_multi_kbs
+from server.db.repository.knowledge_job_repository import add_job_to_db, get_job_detail
+from server.db.repository.knowledge_file_repository import doc_exists
+from server.knowledge_base.upload import (receive_upload, file_sha256, commit_upload, create_upload_session,
+                                          load_upload_session, append_upload_part, finish_upload_session,
+                                          drop_upload_session, is_archive, extract_archive, get_upload_path)
+from server.knowledge_base.ingest import ingest_files_batch
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
+from typing import AsyncIterator, List, Dict, Optional
 from langchain.docstore.document import Document
 from fastapi import Depends
+from pydantic import BaseModel, Field
+from datetime import datetime
 
 from server.information.User import User
 from server.information.information_api import get_current_user
@@ -19,17 +30,75 @@ class DocumentWithScore(Document):
     score: float = None
 
 
+class DocFilter(BaseModel):
+    file_names: List[str] = Field(None, description="文件名")
+    file_exts: List[str] = Field(None, description="文件扩展名，如 .pdf")
+    categories: List[str] = Field(None, description="文件分类")
+    create_time_start: datetime = Field(None, description="文件入库时间不早于")
+    create_time_end: datetime = Field(None, description="文件入库时间不晚于")
+
+
 def search_docs(query: str = Body(..., description="用户输入", examples=["你好"]),
                 knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
                 top_k: int = Body(VECTOR_SEARCH_TOP_K, description="匹配向量数"),
                 score_threshold: float = Body(SCORE_THRESHOLD, description="知识库匹配相关度阈值，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右", ge=0, le=1),
+                nprobe: int = Body(None, description="IVF 类索引检索的聚类数，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                ef_search: int = Body(None, description="HNSW 索引检索的候选集大小，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                filters: DocFilter = Body(None, description="文件过滤条件，在向量检索过程中过滤，只返回满足条件的文件中的文本段"),
+                search_mode: str = Body(None, description="检索方式：vector 向量检索，bm25 关键词检索，hybrid 两者融合，不填使用默认配置", regex="^(vector|bm25|hybrid)$"),
                 current_user: User = Depends(get_current_user)
                 ) -> List[DocumentWithScore]:
     user_id = current_user.user_id
     kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
     if kb is None:
         return {"code": 404, "msg": f"未找到知识库 {knowledge_base_name}", "docs": []}
-    docs = kb.search_docs(query, top_k, score_threshold)
+    docs = kb.search_docs(query, top_k, score_threshold, {"nprobe": nprobe, "ef_search": ef_search, "search_mode": search_mode},
+                          filters.dict() if filters else None)
+    data = [DocumentWithScore(**x[0].dict(), score=x[1]) for x in docs]
+
+    return data
+
+
+def search_docs_batch(queries: List[str] = Body(..., description="用户输入列表", examples=[["你好", "介绍一下知识库"]]),
+                      knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
+                      top_k: int = Body(VECTOR_SEARCH_TOP_K, description="每个查询的匹配向量数"),
+                      score_threshold: float = Body(SCORE_THRESHOLD, description="知识库匹配相关度阈值，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右", ge=0, le=1),
+                      nprobe: int = Body(None, description="IVF 类索引检索的聚类数，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                      ef_search: int = Body(None, description="HNSW 索引检索的候选集大小，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                      filters: DocFilter = Body(None, description="文件过滤条件，在向量检索过程中过滤，只返回满足条件的文件中的文本段"),
+                      search_mode: str = Body(None, description="检索方式：vector 向量检索，bm25 关键词检索，hybrid 两者融合，不填使用默认配置", regex="^(vector|bm25|hybrid)$"),
+                      current_user: User = Depends(get_current_user)
+                      ) -> List[List[DocumentWithScore]]:
+    """
+    批量搜索知识库：所有查询一次向量化、一次矩阵检索，按 queries 的顺序返回每个查询的结果
+    """
+    user_id = current_user.user_id
+    kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
+    if kb is None:
+        return {"code": 404, "msg": f"未找到知识库 {knowledge_base_name}", "docs": []}
+    results = kb.search_docs_batch(queries, top_k, score_threshold, {"nprobe": nprobe, "ef_search": ef_search, "search_mode": search_mode},
+                                   filters.dict() if filters else None)
+    data = [[DocumentWithScore(**x[0].dict(), score=x[1]) for x in docs] for docs in results]
+
+    return data
+
+
+def search_docs_multi(query: str = Body(..., description="用户输入", examples=["你好"]),
+                      knowledge_base_names: List[str] = Body([], description="知识库名称列表，为空时检索全部知识库", examples=[["samples"]]),
+                      top_k: int = Body(VECTOR_SEARCH_TOP_K, description="匹配向量数"),
+                      score_threshold: float = Body(SCORE_THRESHOLD, description="知识库匹配相关度阈值，向量检索时作用于各知识库归一化后的分数，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右", ge=0, le=1),
+                      nprobe: int = Body(None, description="IVF 类索引检索的聚类数，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                      ef_search: int = Body(None, description="HNSW 索引检索的候选集大小，越大召回越高、速度越慢，不填使用知识库默认值", ge=1),
+                      filters: DocFilter = Body(None, description="文件过滤条件，在向量检索过程中过滤，只返回满足条件的文件中的文本段"),
+                      search_mode: str = Body(None, description="检索方式：vector 向量检索，bm25 关键词检索，hybrid 两者融合，不填使用默认配置", regex="^(vector|bm25|hybrid)$"),
+                      current_user: User = Depends(get_current_user)
+                      ) -> List[DocumentWithScore]:
+    """
+    并发检索多个知识库，按归一化分数过滤并合并为全局 top_k，文档 metadata 中的 kb_name 为其所在知识库
+    """
+    user_id = current_user.user_id
+    docs = search_multi_kbs(user_id, query, knowledge_base_names, top_k, score_threshold,
+                            {"nprobe": nprobe, "ef_search": ef_search, "search_mode": search_mode}, filters.dict() if filters else None)
     data = [DocumentWithScore(**x[0].dict(), score=x[1]) for x in docs]
 
     return data
@@ -39,12 +108,16 @@ def search_docs_inner(query: str = Body(..., description="用户输入", example
                 knowledge_base_name: str = Body(..., description="知识库名称", examples=["samples"]),
                 top_k: int = Body(VECTOR_SEARCH_TOP_K, description="匹配向量数"),
                 score_threshold: float = Body(SCORE_THRESHOLD, description="知识库匹配相关度阈值，取值范围在0-1之间，SCORE越小，相关度越高，取到1相当于不筛选，建议设置在0.5左右", ge=0, le=1),
-                user_id: int = 0
+                user_id: int = 0,
+                nprobe: int = None,
+                ef_search: int = None,
+                filters: Dict = None,
+                search_mode: str = None,
                 ) -> List[DocumentWithScore]:
     kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
     if kb is None:
         return {"code": 404, "msg": f"未找到知识库 {knowledge_base_name}", "docs": []}
-    docs = kb.search_docs(query, top_k, score_threshold)
+    docs = kb.search_docs(query, top_k, score_threshold, {"nprobe": nprobe, "ef_search": ef_search, "search_mode": search_mode}, filters)
     data = [DocumentWithScore(**x[0].dict(), score=x[1]) for x in docs]
 
     return data
@@ -68,11 +141,62 @@ async def list_docs(
     return ListResponse(data=all_doc_names)
 
 
+async def _save_upload(kb_file: KnowledgeFile, tmp_path: str, sha256: str, override: bool) -> Optional[BaseResponse]:
+    """
+    将接收完的临时文件移动到知识库 content 目录，文件已存在或移动失败时返回错误响应
+    """
+    if (os.path.exists(kb_file.filepath)
+            and not override
+            and await run_in_threadpool(file_sha256, kb_file.filepath) == sha256
+    ):
+        os.remove(tmp_path)
+        file_status = f"文件 {kb_file.filename} 已存在。"
+        return BaseResponse(code=404, msg=file_status)
+
+    try:
+        commit_upload(tmp_path, kb_file.filepath)
+    except Exception as e:
+        os.remove(tmp_path)
+        return BaseResponse(code=500, msg=f"{kb_file.filename} 文件上传失败，报错信息为: {e}")
+    return None
+
+
+def _ingest_upload(kb: KBService, kb_file: KnowledgeFile) -> str:
+    """
+    在请求中直接入库已保存的文件，覆盖上传已入库的文件时按文本段更新
+    """
+    if doc_exists(kb_file):
+        kb.update_doc(kb_file)
+    else:
+        kb.add_doc(kb_file)
+    return f"成功上传文件 {kb_file.filename}"
+
+
+async def _enqueue_upload(kb_file: KnowledgeFile, tmp_path: str, sha256: str, override: bool) -> BaseResponse:
+    """
+    将接收完的临时文件移动到知识库 content 目录，并提交后台入库任务
+    """
+    response = await _save_upload(kb_file, tmp_path, sha256, override)
+    if response is not None:
+        return response
+
+    # 读取、向量化和写入索引由后台工作进程完成，通过 job_status 查询进度
+    job_id = add_job_to_db(kb_file.user_id, kb_file.kb_name, kb_file.filename, kb_file.category)
+    job = get_job_detail(kb_file.user_id, job_id)
+    job["sha256"] = sha256
+    return JobResponse(code=200, msg=f"文件 {kb_file.filename} 上传成功，正在后台入库", data=job)
+
+
 async def upload_doc(file: UploadFile = File(..., description="上传文件"),
                      knowledge_base_name: str = Form(..., description="知识库名称", examples=["kb1"]),
                      override: bool = Form(False, description="覆盖已有文件"),
+                     category: str = Form(None, description="文件分类，可用于检索时按分类过滤"),
+                     background: bool = Form(False, description="在后台入库：立即返回入库任务，通过 job_status 查询进度。需运行入库任务工作进程，见 JOB_WORKERS"),
                      current_user: User = Depends(get_current_user)
                      ):
+    '''
+    上传文件到知识库。默认在请求中完成入库后返回；background 为 True 时保存文件后立即返回入库任务（JobResponse）
+    '''
     user_id = current_user.user_id
     if not validate_kb_name(knowledge_base_name):
         return BaseResponse(code=403, msg="Don't attack me")
@@ -81,28 +205,212 @@ async def upload_doc(file: UploadFile = File(..., description="上传文件"),
     if kb is None:
         return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
 
-    file_content = await file.read()  # 读取上传文件的内容
-
     kb_file = KnowledgeFile(user_id=user_id,
                             filename=file.filename,
-                            knowledge_base_name=knowledge_base_name)
+                            knowledge_base_name=knowledge_base_name,
+                            category=category)
 
+    # 分块写入临时文件，不把整个文件读入内存
+    try:
+        tmp_path, _, sha256 = await receive_upload(file, user_id, knowledge_base_name)
+    except Exception as e:
+        return BaseResponse(code=500, msg=f"{kb_file.filename} 文件上传失败，报错信息为: {e}")
+    if background:
+        return await _enqueue_upload(kb_file, tmp_path, sha256, override)
+
+    response = await _save_upload(kb_file, tmp_path, sha256, override)
+    if response is not None:
+        return response
+    try:
+        msg = await run_in_threadpool(_ingest_upload, kb, kb_file)
+    except Exception as e:
+        return BaseResponse(code=500, msg=f"{kb_file.filename} 文件入库失败，报错信息为: {e}")
+    return BaseResponse(code=200, msg=msg)
+
+
+async def _commit_batch_file(name: str, tmp_path: str, knowledge_base_name: str, user_id: int, override: bool,
+                             saved: List[str]) -> Dict:
+    """
+    将批量上传的一个文件移动到知识库 content 目录并返回其状态，保存的文件名追加到 saved
+    """
+    try:
+        kb_file = KnowledgeFile(name, knowledge_base_name, user_id)
+    except ValueError as e:
+        os.remove(tmp_path)
+        return {"doc": name, "status": "failed", "msg": str(e)}
     if (os.path.exists(kb_file.filepath)
             and not override
-            and os.path.getsize(kb_file.filepath) == len(file_content)
+            and await run_in_threadpool(file_sha256, kb_file.filepath) == await run_in_threadpool(file_sha256, tmp_path)
     ):
-        # TODO: filesize 不同后的处理
-        file_status = f"文件 {kb_file.filename} 已存在。"
-        return BaseResponse(code=404, msg=file_status)
+        os.remove(tmp_path)
+        return {"doc": name, "status": "skipped", "msg": f"文件 {name} 已存在。"}
+    commit_upload(tmp_path, kb_file.filepath)
+    if kb_file.filename not in saved:
+        saved.append(kb_file.filename)
+    return {"doc": name, "status": "uploaded"}
+
+
+async def _save_batch_upload(file: UploadFile, knowledge_base_name: str, user_id: int, override: bool,
+                             saved: List[str]) -> AsyncIterator[Dict]:
+    """
+    保存批量上传的一个文件，压缩包逐个解压其中的文件，每保存一个文件产出其状态
+    """
+    try:
+        tmp_path, _, _ = await receive_upload(file, user_id, knowledge_base_name)
+    except Exception as e:
+        yield {"doc": file.filename, "status": "failed", "msg": f"文件上传失败，报错信息为: {e}"}
+        return
+    if not is_archive(file.filename):
+        yield await _commit_batch_file(file.filename, tmp_path, knowledge_base_name, user_id, override, saved)
+        return
 
+    upload_path = get_upload_path(user_id, knowledge_base_name)
     try:
-        with open(kb_file.filepath, "wb") as f:
-            f.write(file_content)
+        async for name, path in iterate_in_threadpool(extract_archive(tmp_path, file.filename, upload_path)):
+            yield await _commit_batch_file(name, path, knowledge_base_name, user_id, override, saved)
     except Exception as e:
-        return BaseResponse(code=500, msg=f"{kb_file.filename} 文件上传失败，报错信息为: {e}")
+        # 已解压的文件照常入库
+        yield {"doc": file.filename, "status": "failed", "msg": f"压缩包解压失败，报错信息为: {e}"}
+    finally:
+        os.remove(tmp_path)
+
+
+async def upload_docs(files: List[UploadFile] = File(..., description="上传文件，支持多个文件及 zip、tar 压缩包"),
+                      knowledge_base_name: str = Form(..., description="知识库名称", examples=["kb1"]),
+                      override: bool = Form(False, description="覆盖已有文件"),
+                      category: str = Form(None, description="文件分类，可用于检索时按分类过滤"),
+                      current_user: User = Depends(get_current_user)
+                      ):
+    '''
+    批量上传文件并作为一批入库：大批量向量化，所有文本段一次写入向量库，文件信息在一个数据库事务中写入。
+    以流的形式逐行返回状态：每个文件保存后立即返回其上传状态，之后返回各文件的入库状态，最后一行为写入结果
+    '''
+    user_id = current_user.user_id
+    if not validate_kb_name(knowledge_base_name):
+        return BaseResponse(code=403, msg="Don't attack me")
 
-    kb.add_doc(kb_file)
-    return BaseResponse(code=200, msg=f"成功上传文件 {kb_file.filename}")
+    kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
+    if kb is None:
+        return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
+
+    # 表单中的文件在响应发送完之后才关闭，可以边保存边返回状态
+    async def output():
+        saved = []
+        for file in files:
+            async for status in _save_batch_upload(file, knowledge_base_name, user_id, override, saved):
+                yield json.dumps(status, ensure_ascii=False)
+        if saved:
+            # 内容有变化的同名文件已被覆盖，先删除其原有的文本段；入库过程在线程池中进行，不阻塞事件循环
+            async for status in iterate_in_threadpool(ingest_files_batch(kb, saved, replace=True, category=category)):
+                yield json.dumps(status, ensure_ascii=False)
+
+    return StreamingResponse(output(), media_type="text/event-stream")
+
+
+def upload_init(knowledge_base_name: str = Body(..., examples=["samples"]),
+                file_name: str = Body(..., examples=["test.pdf"]),
+                file_size: int = Body(..., description="文件大小（字节）", ge=0),
+                sha256: str = Body(None, description="文件的 sha256，填写后上传完成时校验"),
+                override: bool = Body(False, description="覆盖已有文件"),
+                category: str = Body(None, description="文件分类，可用于检索时按分类过滤"),
+                current_user: User = Depends(get_current_user)
+                ):
+    '''
+    开始分块上传大文件，返回 upload_id，之后通过 upload_part 依次上传各分块，中断后可从 received 处续传
+    '''
+    user_id = current_user.user_id
+    if not validate_kb_name(knowledge_base_name):
+        return BaseResponse(code=403, msg="Don't attack me")
+
+    kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
+    if kb is None:
+        return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
+    try:
+        KnowledgeFile(os.path.basename(file_name), knowledge_base_name, user_id)
+    except ValueError as e:
+        return BaseResponse(code=404, msg=str(e))
+
+    session = create_upload_session(user_id, knowledge_base_name, os.path.basename(file_name), file_size,
+                                    sha256, category, override)
+    return JobResponse(data=session)
+
+
+def upload_status(knowledge_base_name: str = Query(..., examples=["samples"]),
+                  upload_id: str = Query(..., description="upload_init 返回的上传ID"),
+                  current_user: User = Depends(get_current_user)
+                  ):
+    '''
+    查询分块上传已接收的字节数，用于断点续传
+    '''
+    if not validate_kb_name(knowledge_base_name):
+        return BaseResponse(code=403, msg="Don't attack me")
+    try:
+        session = load_upload_session(current_user.user_id, knowledge_base_name, upload_id)
+    except ValueError as e:
+        return BaseResponse(code=404, msg=str(e))
+    if not session:
+        return BaseResponse(code=404, msg=f"未找到上传 {upload_id}")
+    return JobResponse(data=session)
+
+
+async def upload_part(file: UploadFile = File(..., description="文件分块"),
+                      knowledge_base_name: str = Form(..., examples=["samples"]),
+                      upload_id: str = Form(..., description="upload_init 返回的上传ID"),
+                      offset: int = Form(..., description="分块在文件中的起始位置", ge=0),
+                      current_user: User = Depends(get_current_user)
+                      ):
+    '''
+    上传一个文件分块
+    '''
+    if not validate_kb_name(knowledge_base_name):
+        return BaseResponse(code=403, msg="Don't attack me")
+    try:
+        session = load_upload_session(current_user.user_id, knowledge_base_name, upload_id)
+        if not session:
+            return BaseResponse(code=404, msg=f"未找到上传 {upload_id}")
+        session = await append_upload_part(session, offset, file)
+    except ValueError as e:
+        return BaseResponse(code=404, msg=str(e))
+    return JobResponse(data=session)
+
+
+async def upload_complete(knowledge_base_name: str = Body(..., examples=["samples"]),
+                          upload_id: str = Body(..., description="upload_init 返回的上传ID"),
+                          current_user: User = Depends(get_current_user)
+                          ):
+    '''
+    完成分块上传：校验文件后移动到知识库中，并提交后台入库任务
+    '''
+    user_id = current_user.user_id
+    if not validate_kb_name(knowledge_base_name):
+        return BaseResponse(code=403, msg="Don't attack me")
+    try:
+        session = load_upload_session(user_id, knowledge_base_name, upload_id)
+        if not session:
+            return BaseResponse(code=404, msg=f"未找到上传 {upload_id}")
+        data_file, sha256 = await run_in_threadpool(finish_upload_session, session)
+    except ValueError as e:
+        return BaseResponse(code=404, msg=str(e))
+
+    kb_file = KnowledgeFile(user_id=user_id,
+                            filename=session["file_name"],
+                            knowledge_base_name=knowledge_base_name,
+                            category=session["category"])
+    response = await _enqueue_upload(kb_file, data_file, sha256, session["override"])
+    drop_upload_session(session)
+    return response
+
+
+def job_status(job_id: int = Query(..., description="上传文件时返回的任务ID", examples=[1]),
+               current_user: User = Depends(get_current_user)
+               ):
+    '''
+    查询上传文件入库任务的状态和进度
+    '''
+    job = get_job_detail(current_user.user_id, job_id)
+    if not job:
+        return JobResponse(code=404, msg=f"未找到任务 {job_id}", data={})
+    return JobResponse(data=job)
 
 
 async def delete_doc(knowledge_base_name: str = Body(..., examples=["samples"]),
@@ -132,6 +440,7 @@ async def delete_doc(knowledge_base_name: str = Body(..., examples=["samples"]),
 async def update_doc(
         knowledge_base_name: str = Body(..., examples=["samples"]),
         file_name: str = Body(..., examples=["file_name"]),
+        category: str = Body(None, description="文件分类，不填保留原分类"),
         current_user: User = Depends(get_current_user)
     ):
     '''
@@ -147,10 +456,14 @@ async def update_doc(
 
     kb_file = KnowledgeFile(user_id=user_id,
                             filename=file_name,
-                            knowledge_base_name=knowledge_base_name)
+                            knowledge_base_name=knowledge_base_name,
+                            category=category)
     if os.path.exists(kb_file.filepath):
-        kb.update_doc(kb_file)
-        return BaseResponse(code=200, msg=f"成功更新文件 {kb_file.filename}")
+        result = kb.update_doc(kb_file)
+        if result["deleted"] is None:
+            return BaseResponse(code=200, msg=f"成功更新文件 {kb_file.filename}")
+        return BaseResponse(code=200, msg=f"成功更新文件 {kb_file.filename}，复用 {result['reused']} 个文本段，"
+                                          f"新增 {result['added']} 个，删除 {result['deleted']} 个")
     else:
         return BaseResponse(code=500, msg=f"{kb_file.filename} 文件更新失败")
 
@@ -191,6 +504,8 @@ async def recreate_vector_store(
         allow_empty_kb: bool = Body(True),
         vs_type: str = Body(DEFAULT_VS_TYPE),
         embed_model: str = Body(EMBEDDING_MODEL),
+        index_type: str = Body(None, description="向量索引类型，仅对 faiss 知识库有效，不填保持原有类型"),
+        vector_codec: str = Body(None, description="向量压缩方式，仅对 faiss 知识库有效，不填保持原有方式"),
         current_user: User = Depends(get_current_user)
     ):
     '''
@@ -200,17 +515,25 @@ async def recreate_vector_store(
     set allow_empty_kb to True make it applied on empty knowledge base which it not in the info.db or having no documents.
     '''
     user_id = current_user.user_id
-    kb = KBServiceFactory.get_service(user_id, knowledge_base_name, vs_type, embed_model)
+    if index_type is not None and index_type not in FAISS_INDEX_TYPES:
+        return BaseResponse(code=400, msg=f"不支持的向量索引类型 {index_type}，可选 {list(FAISS_INDEX_TYPES)}")
+    if vector_codec is not None and vector_codec not in FAISS_VECTOR_CODECS:
+        return BaseResponse(code=400, msg=f"不支持的向量压缩方式 {vector_codec}，可选 {list(FAISS_VECTOR_CODECS)}")
+    old_kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=knowledge_base_name)
+    if old_kb is not None:
+        index_type = index_type or old_kb.index_type
+        vector_codec = vector_codec or old_kb.vector_codec
+    kb = KBServiceFactory.get_service(user_id, knowledge_base_name, vs_type, embed_model, index_type, vector_codec)
     if not kb.exists() and not allow_empty_kb:
         return BaseResponse(code=404, msg=f"未找到知识库 {knowledge_base_name}")
 
     async def output(kb):
         kb.create_kb()
         kb.clear_vs()
-        docs = list_docs_from_folder(knowledge_base_name)
+        docs = list_docs_from_folder(user_id, knowledge_base_name)
         for i, doc in enumerate(docs):
             try:
-                kb_file = KnowledgeFile(doc, knowledge_base_name)
+                kb_file = KnowledgeFile(doc, knowledge_base_name, user_id)
                 yield json.dumps({
                     "total": len(docs),
                     "finished": i,
@@ -219,5 +542,7 @@ async def recreate_vector_store(
                 kb.add_doc(kb_file)
             except Exception as e:
                 print(e)
+        # 全部文件写入后一次性合并增量段，并按索引类型构建或训练索引
+        kb.optimize_vs()
 
     return StreamingResponse(output(kb), media_type="text/event-stream")
@@ -1,6 +1,9 @@
 from abc import ABC, abstractmethod
 
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain.embeddings.base import Embeddings
 from langchain.docstore.document import Document
@@ -9,17 +12,36 @@ from server.db.repository.knowledge_base_repository import (
     load_kb_from_db, get_kb_detail,
 )
 from server.db.repository.knowledge_file_repository import (
-    add_doc_to_db, delete_file_from_db, delete_files_from_db, doc_exists,
-    list_docs_from_db, get_file_detail, 
+    add_doc_to_db, add_docs_to_db, delete_file_from_db, delete_files_from_db, doc_exists,
+    list_docs_from_db, get_file_detail, list_docs_by_filter, count_docs_from_db,
 )
 
 from configs.model_config import (kbs_config, VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD,
-                                  EMBEDDING_DEVICE, EMBEDDING_MODEL)
+                                  EMBEDDING_DEVICE, EMBEDDING_MODEL,
+                                  SEARCH_MODE, HYBRID_CANDIDATE_FACTOR, HYBRID_RRF_K, RETRIEVAL_WORKERS, logger)
+from server.knowledge_base.bm25_index import get_bm25_index, drop_bm25_index, rrf_fuse, BM25Index
 from server.knowledge_base.utils import (
-    get_kb_path, get_doc_path, load_embeddings, KnowledgeFile,
+    get_kb_path, get_doc_path, get_file_path, load_embeddings, KnowledgeFile,
     list_kbs_from_folder, list_docs_from_folder,
 )
-from typing import List, Union, Dict
+from typing import Callable, List, Union, Dict, Optional, Tuple
+
+
+retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+
+async def run_in_retrieval_executor(func: Callable, *args, **kwargs):
+    """
+    在检索线程池中执行同步的检索函数并等待结果，等待期间事件循环继续处理其他请求
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(retrieval_executor, functools.partial(func, *args, **kwargs))
+
+
+class SearchMode:
+    VECTOR = 'vector'
+    BM25 = 'bm25'
+    HYBRID = 'hybrid'
 
 
 class SupportedVSType:
@@ -35,10 +57,14 @@ class KBService(ABC):
                  user_id: int,
                  knowledge_base_name: str,
                  embed_model: str = EMBEDDING_MODEL,
+                 index_type: str = None,
+                 vector_codec: str = None,
                  ):
         self.user_id = user_id
         self.kb_name = knowledge_base_name
         self.embed_model = embed_model
+        self.index_type = index_type
+        self.vector_codec = vector_codec
         self.kb_path = get_kb_path(self.user_id, self.kb_name)
         self.doc_path = get_doc_path(self.user_id, self.kb_name)
         self.do_init()
@@ -46,6 +72,10 @@ class KBService(ABC):
     def _load_embeddings(self, embed_device: str = EMBEDDING_DEVICE) -> Embeddings:
         return load_embeddings(self.embed_model, embed_device)
 
+    @property
+    def bm25_index(self) -> BM25Index:
+        return get_bm25_index(self.kb_path)
+
     def create_kb(self):
         """
         创建知识库
@@ -53,7 +83,8 @@ class KBService(ABC):
         if not os.path.exists(self.doc_path):
             os.makedirs(self.doc_path)
         self.do_create_kb()
-        status = add_kb_to_db(self.user_id, self.kb_name, self.vs_type(), self.embed_model)
+        status = add_kb_to_db(self.user_id, self.kb_name, self.vs_type(), self.embed_model,
+                              self.index_type, self.vector_codec)
         return status
 
     def clear_vs(self):
@@ -61,6 +92,7 @@ class KBService(ABC):
         删除向量库中所有内容
         """
         self.do_clear_vs()
+        self.bm25_index.clear()
         status = delete_files_from_db(self.user_id, self.kb_name)
         return status
 
@@ -70,40 +102,79 @@ class KBService(ABC):
         删除知识库
         """
         self.do_drop_kb()
+        drop_bm25_index(self.kb_path)
         status = delete_kb_from_db(self.user_id, self.kb_name)
         return status
 
-    def add_doc(self, kb_file: KnowledgeFile):
+    def add_doc(self, kb_file: KnowledgeFile, docs: List[Document] = None, embeddings: Embeddings = None):
         """
-        向知识库添加文件
+        向知识库添加文件，docs 为已切分好的文本段，embeddings 为已算好部分向量的嵌入模型，为空时自行读取、加载
         """
-        docs = kb_file.file2text()
+        if docs is None:
+            docs = kb_file.file2text()
         if docs:
-            embeddings = self._load_embeddings()
+            embeddings = embeddings or self._load_embeddings()
             self.do_add_doc(docs, embeddings)
+            self.bm25_index.add(docs)
             status = add_doc_to_db(kb_file)
         else:
             status = False
         return status
 
+    def add_docs(self, files: List[Tuple[KnowledgeFile, List[Document]]], embeddings: Embeddings = None):
+        """
+        批量添加多个已切分好的文件：所有文本段一次写入向量库（FAISS 只生成一个增量段）和 BM25 索引，
+        文件信息在一个数据库事务中写入
+        """
+        files = [(kb_file, docs) for kb_file, docs in files if docs]
+        if not files:
+            return False
+        docs = [doc for _, file_docs in files for doc in file_docs]
+        embeddings = embeddings or self._load_embeddings()
+        self.do_add_doc(docs, embeddings)
+        self.bm25_index.add(docs)
+        return add_docs_to_db([kb_file for kb_file, _ in files])
+
     def delete_doc(self, kb_file: KnowledgeFile, delete_content: bool = False):
         """
         从知识库删除文件
         """
         self.do_delete_doc(kb_file)
+        self.bm25_index.delete_source(kb_file.filepath)
         status = delete_file_from_db(kb_file)
         if delete_content and os.path.exists(kb_file.filepath):
             os.remove(kb_file.filepath)
         return status
 
-    def update_doc(self, kb_file: KnowledgeFile):
+    def update_doc(self, kb_file: KnowledgeFile, docs: List[Document] = None, embeddings: Embeddings = None):
         """
-        使用content中的文件更新向量库
+        使用content中的文件更新向量库：重新切分后按文本段哈希与已有文本段比较，只删除已不存在的文本段，
+        只向量化、写入新增的文本段，kb_file.category 不为 None 时同时更新文件分类。返回 {"reused": 复用数, "added": 新增数, "deleted": 删除数}，
+        向量库不支持按文本段更新时先删除再全部添加，deleted 为 None
         """
-        if os.path.exists(kb_file.filepath):
+        if not os.path.exists(kb_file.filepath):
+            return None
+        if docs is None:
+            docs = kb_file.file2text()
+        if not docs:
+            self.delete_doc(kb_file)
+            return {"reused": 0, "added": 0, "deleted": None}
+        embeddings = embeddings or self._load_embeddings()
+        result = self.do_update_doc(kb_file, docs, embeddings)
+        if result is None:
+            if kb_file.category is None:
+                # 先删除再添加时保留原分类
+                detail = get_file_detail(self.user_id, self.kb_name, kb_file.filename)
+                kb_file.category = detail.get("category") if detail else None
             self.delete_doc(kb_file)
-            return self.add_doc(kb_file)
-        
+            self.add_doc(kb_file, docs, embeddings)
+            return {"reused": 0, "added": len(docs), "deleted": None}
+        self.bm25_index.update_source(kb_file.filepath, docs)
+        add_doc_to_db(kb_file)
+        logger.info(f"updated {kb_file.filename} in {self.kb_name}: reused {result['reused']}, "
+                    f"added {result['added']}, deleted {result['deleted']} chunks")
+        return result
+
     def exist_doc(self, file_name: str):
         return doc_exists(KnowledgeFile(knowledge_base_name=self.kb_name,
                                         user_id=self.user_id,
@@ -112,15 +183,157 @@ class KBService(ABC):
     def list_docs(self):
         return list_docs_from_db(self.user_id, self.kb_name)
 
+    def count_chunks_by_source(self) -> Optional[Dict[str, int]]:
+        """
+        各文件在向量库中的文本段数量 {文件路径: 数量}，一次统计全部文件，向量库不支持时返回None
+        """
+        return None
+
+    def optimize_vs(self):
+        """
+        整理向量库，如合并增量段、训练向量索引，批量导入文件后调用
+        """
+        pass
+
     def search_docs(self,
                     query: str,
                     top_k: int = VECTOR_SEARCH_TOP_K,
                     score_threshold: float = SCORE_THRESHOLD,
+                    search_params: Dict = None,
+                    filters: Dict = None,
                     ):
+        """
+        search_params 为按请求覆盖的索引检索参数，如 nprobe、ef_search，向量库不支持的参数会被忽略，
+        其中 search_mode 为检索方式，见 search_mode；filters 为文件过滤条件，见 apply_filters
+        """
+        search_params = self.apply_filters(search_params, filters)
+        if search_params is None:
+            return []
+        mode = self.search_mode(search_params.pop("search_mode", None))
+        if mode == SearchMode.BM25:
+            return self.fuse_bm25(query, [], top_k, search_params)
         embeddings = self._load_embeddings()
-        docs = self.do_search(query, top_k, score_threshold, embeddings)
+        docs = self.do_search(query, self._vector_k(top_k, mode), score_threshold, embeddings, search_params)
+        if mode == SearchMode.HYBRID:
+            docs = self.fuse_bm25(query, docs, top_k, search_params)
+        return docs
+
+    async def asearch_docs(self,
+                           query: str,
+                           top_k: int = VECTOR_SEARCH_TOP_K,
+                           score_threshold: float = SCORE_THRESHOLD,
+                           search_params: Dict = None,
+                           filters: Dict = None,
+                           ):
+        """
+        search_docs 的异步版本，在检索线程池中执行
+        """
+        return await run_in_retrieval_executor(self.search_docs, query, top_k, score_threshold,
+                                               search_params, filters)
+
+    def search_docs_by_vector(self,
+                              query: str,
+                              query_vector: List[float],
+                              top_k: int = VECTOR_SEARCH_TOP_K,
+                              score_threshold: float = SCORE_THRESHOLD,
+                              search_params: Dict = None,
+                              filters: Dict = None,
+                              ):
+        """
+        使用已计算好的查询向量搜索，多个知识库使用同一嵌入模型时只需向量化一次；
+        向量库不支持按向量搜索时按 query 文本搜索
+        """
+        search_params = self.apply_filters(search_params, filters)
+        if search_params is None:
+            return []
+        mode = self.search_mode(search_params.pop("search_mode", None))
+        if mode == SearchMode.BM25:
+            return self.fuse_bm25(query, [], top_k, search_params)
+        k = self._vector_k(top_k, mode)
+        docs = self.do_search_by_vector(query_vector, k, score_threshold, search_params)
+        if docs is None:
+            embeddings = self._load_embeddings()
+            docs = self.do_search(query, k, score_threshold, embeddings, search_params)
+        if mode == SearchMode.HYBRID:
+            docs = self.fuse_bm25(query, docs, top_k, search_params)
         return docs
 
+    @staticmethod
+    def search_mode(mode: str = None) -> str:
+        """
+        检索方式：vector 仅向量检索；bm25 仅关键词检索；hybrid 向量检索与 BM25 检索结果按 RRF 融合。
+        后两种方式返回的分数为按排名计算的 0-1 之间的值，见 rrf_fuse
+        """
+        mode = mode or SEARCH_MODE
+        if mode not in (SearchMode.VECTOR, SearchMode.BM25, SearchMode.HYBRID):
+            raise ValueError(f"不支持的检索方式 {mode}")
+        return mode
+
+    @staticmethod
+    def _vector_k(top_k: int, mode: str) -> int:
+        return top_k * HYBRID_CANDIDATE_FACTOR if mode == SearchMode.HYBRID else top_k
+
+    def fuse_bm25(self,
+                  query: str,
+                  docs: List,
+                  top_k: int,
+                  search_params: Dict = None,
+                  ) -> List:
+        """
+        从 BM25 倒排索引召回候选，与向量检索结果 docs 按 RRF 融合，返回 top_k 个 (文档, 分数)。
+        向量检索结果已按 score_threshold 过滤，关键词结果不受其限制
+        """
+        search_params = search_params or {}
+        bm25_docs = self.bm25_index.search(query, top_k * HYBRID_CANDIDATE_FACTOR, search_params.get("sources"))
+        return rrf_fuse([docs, bm25_docs], top_k, HYBRID_RRF_K)
+
+    def normalize_score(self, score: float) -> float:
+        """
+        将向量库返回的距离统一换算为 (1 - 余弦相似度) / 2，取值在 0-1 之间（越小越相关），
+        用于合并多个知识库的检索结果时排序和按 score_threshold 过滤
+        """
+        return max(0.0, min(1.0, float(score)))
+
+    def search_docs_batch(self,
+                          queries: List[str],
+                          top_k: int = VECTOR_SEARCH_TOP_K,
+                          score_threshold: float = SCORE_THRESHOLD,
+                          search_params: Dict = None,
+                          filters: Dict = None,
+                          ) -> List[List]:
+        """
+        批量搜索，按 queries 的顺序返回每个查询的结果
+        """
+        search_params = self.apply_filters(search_params, filters)
+        if search_params is None:
+            return [[] for _ in queries]
+        mode = self.search_mode(search_params.pop("search_mode", None))
+        if mode == SearchMode.BM25:
+            return [self.fuse_bm25(query, [], top_k, search_params) for query in queries]
+        embeddings = self._load_embeddings()
+        results = self.do_search_batch(queries, self._vector_k(top_k, mode), score_threshold, embeddings,
+                                       search_params)
+        if mode == SearchMode.HYBRID:
+            results = [self.fuse_bm25(query, docs, top_k, search_params) for query, docs in zip(queries, results)]
+        return results
+
+    def apply_filters(self, search_params: Dict = None, filters: Dict = None) -> Optional[Dict]:
+        """
+        将文件过滤条件(file_names, file_exts, categories, create_time_start, create_time_end)
+        在数据库中解析为来源文件列表，放入 search_params["sources"]，由向量库在检索过程中过滤。
+        没有文件满足条件时返回None，所有文件都满足条件时不过滤
+        """
+        search_params = dict(search_params or {})
+        if not filters or not any(v for v in filters.values()):
+            return search_params
+        file_names = list_docs_by_filter(self.user_id, self.kb_name, **filters)
+        if not file_names:
+            return None
+        if len(file_names) >= count_docs_from_db(self.user_id, self.kb_name):
+            return search_params
+        search_params["sources"] = [get_file_path(self.user_id, self.kb_name, f) for f in file_names]
+        return search_params
+
     @abstractmethod
     def do_create_kb(self):
         """
@@ -160,13 +373,38 @@ class KBService(ABC):
     def do_search(self,
                   query: str,
                   top_k: int,
+                  score_threshold: float,
                   embeddings: Embeddings,
+                  search_params: Dict = None,
                   ) -> List[Document]:
         """
         搜索知识库子类实自己逻辑
         """
         pass
 
+    def do_search_by_vector(self,
+                            query_vector: List[float],
+                            top_k: int,
+                            score_threshold: float,
+                            search_params: Dict = None,
+                            ) -> Optional[List[Document]]:
+        """
+        按查询向量搜索，子类不支持时返回None
+        """
+        return None
+
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float,
+                        embeddings: Embeddings,
+                        search_params: Dict = None,
+                        ) -> List[List[Document]]:
+        """
+        批量搜索，默认逐条调用 do_search，支持矩阵检索的子类可覆盖
+        """
+        return [self.do_search(query, top_k, score_threshold, embeddings, search_params) for query in queries]
+
     @abstractmethod
     def do_add_doc(self,
                    docs: List[Document],
@@ -185,6 +423,16 @@ class KBService(ABC):
         """
         pass
 
+    def do_update_doc(self,
+                      kb_file: KnowledgeFile,
+                      docs: List[Document],
+                      embeddings: Embeddings,
+                      ) -> Optional[Dict]:
+        """
+        按文本段更新文件的向量，返回复用、新增、删除的文本段数量，不支持时返回 None，由 update_doc 先删除再添加
+        """
+        return None
+
     @abstractmethod
     def do_clear_vs(self):
         """
@@ -200,12 +448,15 @@ class KBServiceFactory:
                     kb_name: str,
                     vector_store_type: Union[str, SupportedVSType],
                     embed_model: str = EMBEDDING_MODEL,
+                    index_type: str = None,
+                    vector_codec: str = None,
                     ) -> KBService:
         if isinstance(vector_store_type, str):
             vector_store_type = getattr(SupportedVSType, vector_store_type.upper())
         if SupportedVSType.FAISS == vector_store_type:
             from server.knowledge_base.kb_service.faiss_kb_service import FaissKBService
-            return FaissKBService(user_id, kb_name, embed_model=embed_model)
+            return FaissKBService(user_id, kb_name, embed_model=embed_model,
+                                  index_type=index_type, vector_codec=vector_codec)
         if SupportedVSType.PG == vector_store_type:
             from server.knowledge_base.kb_service.pg_kb_service import PGKBService
             return PGKBService(user_id, kb_name, embed_model=embed_model)
@@ -220,10 +471,10 @@ class KBServiceFactory:
     def get_service_by_name(kb_name: str,
                             user_id: int,
                             ) -> KBService:
-        _, vs_type, embed_model = load_kb_from_db(user_id=user_id, kb_name=kb_name)
+        _, vs_type, embed_model, index_type, vector_codec = load_kb_from_db(user_id=user_id, kb_name=kb_name)
         if vs_type is None and os.path.isdir(get_kb_path(user_id, kb_name)): # faiss knowledge base not in db
             vs_type = "faiss"
-        return KBServiceFactory.get_service(user_id, kb_name, vs_type, embed_model)
+        return KBServiceFactory.get_service(user_id, kb_name, vs_type, embed_model, index_type, vector_codec)
 
     @staticmethod
     def get_default(user_id: int):
@@ -241,6 +492,8 @@ def get_kb_details(user_id: int) -> List[Dict]:
             "kb_name": kb,
             "vs_type": "",
             "embed_model": "",
+            "index_type": "",
+            "vector_codec": "",
             "file_count": 0,
             "create_time": None,
             "in_folder": True,
@@ -269,6 +522,7 @@ def get_kb_doc_details(user_id: int, kb_name: str) -> List[Dict]:
     kb = KBServiceFactory.get_service_by_name(user_id=user_id, kb_name=kb_name)
     docs_in_folder = list_docs_from_folder(user_id=user_id, kb_name=kb_name)
     docs_in_db = kb.list_docs()
+    chunk_counts = kb.count_chunks_by_source() if docs_in_db else None
     result = {}
 
     for doc in docs_in_folder:
@@ -277,10 +531,12 @@ def get_kb_doc_details(user_id: int, kb_name: str) -> List[Dict]:
             "kb_name": kb_name,
             "file_name": doc,
             "file_ext": os.path.splitext(doc)[-1],
+            "category": "",
             "file_version": 0,
             "document_loader": "",
             "text_splitter": "",
             "create_time": None,
+            "chunk_count": None,
             "in_folder": True,
             "in_db": False,
         }
@@ -288,6 +544,8 @@ def get_kb_doc_details(user_id: int, kb_name: str) -> List[Dict]:
         doc_detail = get_file_detail(user_id=user_id, kb_name=kb_name, filename=doc)
         if doc_detail:
             doc_detail["in_db"] = True
+            doc_detail["chunk_count"] = (None if chunk_counts is None
+                                         else chunk_counts.get(get_file_path(user_id, kb_name, doc), 0))
             if doc in result:
                 result[doc].update(doc_detail)
             else:
@@ -3,60 +3,73 @@ import shutil
 
 from configs.model_config import (
     KB_ROOT_PATH,
-    CACHED_VS_NUM,
+    CACHED_VS_MEMORY,
     EMBEDDING_MODEL,
     EMBEDDING_DEVICE,
-    SCORE_THRESHOLD
+    SCORE_THRESHOLD,
+    FAISS_INDEX_TYPE,
+    FAISS_VECTOR_CODEC,
 )
 from server.knowledge_base.kb_service.base import KBService, SupportedVSType
-from functools import lru_cache
-from server.knowledge_base.utils import get_vs_path, load_embeddings, KnowledgeFile
-from langchain.vectorstores import FAISS
+from server.knowledge_base.kb_cache import CachePool
+from server.knowledge_base.chunk_store import ChunkStore
+from server.knowledge_base.faiss_store import FaissSegmentStore, CHUNK_DB_FILE
+from server.knowledge_base.utils import get_vs_path, load_embeddings, diff_chunks, KnowledgeFile
 from langchain.embeddings.base import Embeddings
-from langchain.embeddings.huggingface import HuggingFaceEmbeddings
-from typing import List
+from typing import Dict, List
 from langchain.docstore.document import Document
 from server.utils import torch_gc
 
 
-# make HuggingFaceEmbeddings hashable
-def _embeddings_hash(self):
-    return hash(self.model_name)
+# 进程内向量库缓存，key 为 (user_id, kb_name, embed_model, index_type, vector_codec)，按占用内存淘汰
+kb_vs_pool = CachePool(max_bytes=CACHED_VS_MEMORY * 1024 ** 2, name="vector_store")
 
 
-HuggingFaceEmbeddings.__hash__ = _embeddings_hash
-
-_VECTOR_STORE_TICKS = {}
-
-
-@lru_cache(CACHED_VS_NUM)
 def load_vector_store(
         user_id: int,
         knowledge_base_name: str,
         embed_model: str = EMBEDDING_MODEL,
         embed_device: str = EMBEDDING_DEVICE,
-        embeddings: Embeddings = None,
-        tick: int = 0,  # tick will be changed by upload_doc etc. and make cache refreshed.
-):
-    print(f"loading user:'{user_id}' vector store in '{knowledge_base_name}'.")
+        index_type: str = FAISS_INDEX_TYPE,
+        vector_codec: str = FAISS_VECTOR_CODEC,
+) -> FaissSegmentStore:
+    """
+    缓存的向量库总是使用知识库自身的嵌入模型（不持有模型本身，见 CachedEmbeddings），
+    调用方为某次写入准备的嵌入模型（如带预先算好向量的 PrecomputedEmbeddings）只传给 add_documents
+    """
     vs_path = get_vs_path(user_id, knowledge_base_name)
-    if embeddings is None:
-        embeddings = load_embeddings(embed_model, embed_device)
-    search_index = FAISS.load_local(vs_path, embeddings, normalize_L2=True)
-    return search_index
+
+    def _load():
+        print(f"loading user:'{user_id}' vector store in '{knowledge_base_name}'.")
+        return FaissSegmentStore.load(vs_path, load_embeddings(embed_model, embed_device), index_type, vector_codec)
+
+    return kb_vs_pool.get((user_id, knowledge_base_name, embed_model, index_type, vector_codec),
+                          loader=_load,
+                          sizeof=lambda store: store.nbytes(),
+                          validate=lambda store: not store.is_stale())
 
 
 def refresh_vs_cache(user_id: int, kb_name: str):
     """
-    make vector store cache refreshed when next loading
+    使缓存中该知识库的向量库失效，下次使用时从磁盘重新加载
     """
-    _VECTOR_STORE_TICKS[str(user_id)+kb_name] = _VECTOR_STORE_TICKS.get(str(user_id)+kb_name, 0) + 1
+    kb_vs_pool.invalidate(user_id, kb_name)
 
 
 class FaissKBService(KBService):
     vs_path: str
     kb_path: str
 
+    def __init__(self,
+                 user_id: int,
+                 knowledge_base_name: str,
+                 embed_model: str = EMBEDDING_MODEL,
+                 index_type: str = None,
+                 vector_codec: str = None,
+                 ):
+        super().__init__(user_id, knowledge_base_name, embed_model,
+                         index_type or FAISS_INDEX_TYPE, vector_codec or FAISS_VECTOR_CODEC)
+
     def vs_type(self) -> str:
         return SupportedVSType.FAISS
 
@@ -78,55 +91,109 @@ class FaissKBService(KBService):
 
     def do_drop_kb(self):
         shutil.rmtree(self.kb_path)
+        refresh_vs_cache(self.user_id, self.kb_name)
+
+    def load_vector_store(self) -> FaissSegmentStore:
+        return load_vector_store(self.user_id,
+                                 self.kb_name,
+                                 embed_model=self.embed_model,
+                                 index_type=self.index_type,
+                                 vector_codec=self.vector_codec)
 
     def do_search(self,
                   query: str,
                   top_k: int,
                   score_threshold: float = SCORE_THRESHOLD,
                   embeddings: Embeddings = None,
+                  search_params: Dict = None,
                   ) -> List[Document]:
-        search_index = load_vector_store(self.user_id,
-                                         self.kb_name,
-                                         embeddings=embeddings,
-                                         tick=_VECTOR_STORE_TICKS.get(str(self.user_id)+self.kb_name))
-        docs = search_index.similarity_search_with_score(query, k=top_k, score_threshold=score_threshold)
+        vector_store = self.load_vector_store()
+        docs = vector_store.similarity_search_with_score(query,
+                                                         k=top_k,
+                                                         score_threshold=score_threshold,
+                                                         search_params=search_params)
         return docs
 
+    def do_search_by_vector(self,
+                            query_vector: List[float],
+                            top_k: int,
+                            score_threshold: float = SCORE_THRESHOLD,
+                            search_params: Dict = None,
+                            ) -> List[Document]:
+        vector_store = self.load_vector_store()
+        return vector_store.similarity_search_with_score_by_vector(query_vector,
+                                                                   k=top_k,
+                                                                   score_threshold=score_threshold,
+                                                                   search_params=search_params)
+
+    def normalize_score(self, score: float) -> float:
+        # 归一化向量的 L2 距离平方在 0-4 之间
+        return max(0.0, min(1.0, float(score) / 4))
+
+    def do_search_batch(self,
+                        queries: List[str],
+                        top_k: int,
+                        score_threshold: float = SCORE_THRESHOLD,
+                        embeddings: Embeddings = None,
+                        search_params: Dict = None,
+                        ) -> List[List[Document]]:
+        vector_store = self.load_vector_store()
+        return vector_store.similarity_search_with_score_batch(queries,
+                                                               k=top_k,
+                                                               score_threshold=score_threshold,
+                                                               search_params=search_params)
+
     def do_add_doc(self,
                    docs: List[Document],
                    embeddings: Embeddings,
                    ):
-        if os.path.exists(self.vs_path) and "index.faiss" in os.listdir(self.vs_path):
-            vector_store = FAISS.load_local(self.vs_path, embeddings, normalize_L2=True)
-            vector_store.add_documents(docs)
-            torch_gc()
-        else:
-            if not os.path.exists(self.vs_path):
-                os.makedirs(self.vs_path)
-            vector_store = FAISS.from_documents(
-                docs, embeddings, normalize_L2=True)  # docs 为Document列表
-            torch_gc()
-        vector_store.save_local(self.vs_path)
-        refresh_vs_cache(self.user_id, self.kb_name)
+        # 只写入新的增量段，不再整体加载、保存索引
+        vector_store = self.load_vector_store()
+        vector_store.add_documents(docs, embeddings)
+        torch_gc()
+        kb_vs_pool.put((self.user_id, self.kb_name, self.embed_model, self.index_type, self.vector_codec),
+                       vector_store, vector_store.nbytes())
 
     def do_delete_doc(self,
                       kb_file: KnowledgeFile):
-        embeddings = self._load_embeddings()
-        if os.path.exists(self.vs_path) and "index.faiss" in os.listdir(self.vs_path):
-            vector_store = FAISS.load_local(self.vs_path, embeddings, normalize_L2=True)
-            ids = [k for k, v in vector_store.docstore._dict.items() if v.metadata["source"] == kb_file.filepath]
-            if len(ids) == 0:
-                return None
-            vector_store.delete(ids)
-            vector_store.save_local(self.vs_path)
-            refresh_vs_cache(self.user_id, self.kb_name)
-            return True
-        else:
+        vector_store = self.load_vector_store()
+        if vector_store.delete_source(kb_file.filepath) == 0:
             return None
+        return True
+
+    def do_update_doc(self,
+                      kb_file: KnowledgeFile,
+                      docs: List[Document],
+                      embeddings: Embeddings,
+                      ) -> Dict:
+        vector_store = self.load_vector_store()
+        added, removed, reused = diff_chunks(vector_store.chunks.docs_of_source(kb_file.filepath), docs)
+        vector_store.delete_chunks(removed)
+        if added:
+            vector_store.add_documents(added, embeddings)
+            torch_gc()
+        kb_vs_pool.put((self.user_id, self.kb_name, self.embed_model, self.index_type, self.vector_codec),
+                       vector_store, vector_store.nbytes())
+        return {"reused": reused, "added": len(added), "deleted": len(removed)}
+
+    def count_chunks_by_source(self) -> Dict[str, int]:
+        # 只读取 chunks.db，列出文件时不加载向量库和嵌入模型
+        chunks = ChunkStore(os.path.join(self.vs_path, CHUNK_DB_FILE))
+        if not chunks.exists:
+            return {}
+        try:
+            return chunks.count_by_source()
+        finally:
+            chunks.close()
+
+    def optimize_vs(self):
+        # 同步合并全部增量段，按知识库的索引类型构建或训练基础段
+        self.load_vector_store().merge()
 
     def do_clear_vs(self):
         shutil.rmtree(self.vs_path)
         os.makedirs(self.vs_path)
+        refresh_vs_cache(self.user_id, self.kb_name)
 
     def exist_doc(self, file_name: str):
         if super().exist_doc(file_name):
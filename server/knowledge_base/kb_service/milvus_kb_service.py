@@ -1,5 +1,6 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
 from langchain.embeddings.base import Embeddings
 from langchain.schema import Document
 from langchain.vectorstores import Milvus
@@ -10,6 +11,27 @@ from server.knowledge_base.kb_service.base import KBService, SupportedVSType
 from server.knowledge_base.utils import KnowledgeFile
 
 
+def _unit(vectors) -> List[List[float]]:
+    vectors = np.array(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).tolist()
+
+
+class UnitEmbeddings(Embeddings):
+    """
+    将向量归一化为单位长度后写入和检索，使 L2 距离与余弦距离一一对应
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return _unit(self.embeddings.embed_documents(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return _unit([self.embeddings.embed_query(text)])[0]
+
+
 class MilvusKBService(KBService):
     milvus: Milvus
 
@@ -36,7 +58,7 @@ class MilvusKBService(KBService):
     def _load_milvus(self, embeddings: Embeddings = None):
         if embeddings is None:
             embeddings = self._load_embeddings()
-        self.milvus = Milvus(embedding_function=embeddings,
+        self.milvus = Milvus(embedding_function=UnitEmbeddings(embeddings),
                              collection_name=self.kb_name, connection_args=kbs_config.get("milvus"))
 
     def do_init(self):
@@ -45,21 +67,67 @@ class MilvusKBService(KBService):
     def do_drop_kb(self):
         self.milvus.col.drop()
 
-    def do_search(self, query: str, top_k: int, score_threshold: float, embeddings: Embeddings) -> List[Document]:
-        # todo: support score threshold
+    def do_search(self, query: str, top_k: int, score_threshold: float, embeddings: Embeddings,
+                  search_params: Dict = None) -> List[Document]:
+        # 单个知识库检索时不按分数过滤，联合检索时在 search_multi_kbs 中按归一化后的分数过滤
         self._load_milvus(embeddings=embeddings)
-        return self.milvus.similarity_search(query, top_k, score_threshold=SCORE_THRESHOLD)
+        return self.milvus.similarity_search_with_score(query, top_k,
+                                                        param=self._search_param(search_params),
+                                                        expr=self._expr(search_params))
+
+    def do_search_by_vector(self, query_vector: List[float], top_k: int, score_threshold: float,
+                            search_params: Dict = None) -> List[Document]:
+        return self.milvus.similarity_search_with_score_by_vector(_unit([query_vector])[0], top_k,
+                                                                  param=self._search_param(search_params),
+                                                                  expr=self._expr(search_params))
 
-    def add_doc(self, kb_file: KnowledgeFile):
+    @staticmethod
+    def _search_param(search_params: Dict = None) -> Optional[Dict]:
+        search_params = search_params or {}
+        # milvus 的 IVF 类索引使用 nprobe，HNSW 索引使用 ef
+        params = {"nprobe": search_params.get("nprobe"), "ef": search_params.get("ef_search")}
+        params = {k: v for k, v in params.items() if v}
+        if not params:
+            return None
+        return {"metric_type": "L2", "params": params}
+
+    @staticmethod
+    def _expr(search_params: Dict = None) -> Optional[str]:
+        # 转换为布尔表达式，由 milvus 在向量检索时过滤
+        if not search_params or search_params.get("sources") is None:
+            return None
+        sources = [s.replace('\\', '\\\\').replace('"', '\\"') for s in search_params["sources"]]
+        return "source in [" + ", ".join(f'"{s}"' for s in sources) + "]"
+
+    def normalize_score(self, score: float) -> float:
+        # 单位向量的 L2 距离平方为 2 * (1 - 余弦相似度)，与 faiss 相同
+        return max(0.0, min(1.0, float(score) / 4))
+
+    def add_doc(self, kb_file: KnowledgeFile, docs: List[Document] = None, embeddings: Embeddings = None):
         """
-        向知识库添加文件
+        向知识库添加文件，向量由向量库的嵌入模型计算（已算过的文本段命中向量缓存）
         """
-        docs = kb_file.file2text()
+        if docs is None:
+            docs = kb_file.file2text()
         self.milvus.add_documents(docs)
+        self.bm25_index.add(docs)
         from server.db.repository.knowledge_file_repository import add_doc_to_db
         status = add_doc_to_db(kb_file)
         return status
 
+    def add_docs(self, files: List[Tuple[KnowledgeFile, List[Document]]], embeddings: Embeddings = None):
+        """
+        批量添加多个已切分好的文件，文本段一次写入向量库，文件信息在一个数据库事务中写入
+        """
+        files = [(kb_file, docs) for kb_file, docs in files if docs]
+        if not files:
+            return False
+        docs = [doc for _, file_docs in files for doc in file_docs]
+        self.milvus.add_documents(docs)
+        self.bm25_index.add(docs)
+        from server.db.repository.knowledge_file_repository import add_docs_to_db
+        return add_docs_to_db([kb_file for kb_file, _ in files])
+
     def do_add_doc(self, docs: List[Document], embeddings: Embeddings):
         pass
 
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 from langchain.embeddings.base import Embeddings
 from langchain.schema import Document
@@ -43,21 +43,53 @@ class PGKBService(KBService):
             '''))
             connect.commit()
 
-    def do_search(self, query: str, top_k: int, score_threshold: float, embeddings: Embeddings) -> List[Document]:
-        # todo: support score threshold
+    def do_search(self, query: str, top_k: int, score_threshold: float, embeddings: Embeddings,
+                  search_params: Dict = None) -> List[Document]:
+        # 单个知识库检索时不按分数过滤，联合检索时在 search_multi_kbs 中按归一化后的分数过滤
         self._load_pg_vector(embeddings=embeddings)
-        return self.pg_vector.similarity_search(query, top_k)
+        return self.pg_vector.similarity_search_with_score(query, top_k, filter=self._filter(search_params))
 
-    def add_doc(self, kb_file: KnowledgeFile):
+    def do_search_by_vector(self, query_vector: List[float], top_k: int, score_threshold: float,
+                            search_params: Dict = None) -> List[Document]:
+        return self.pg_vector.similarity_search_with_score_by_vector(query_vector, top_k,
+                                                                     filter=self._filter(search_params))
+
+    @staticmethod
+    def _filter(search_params: Dict = None) -> Optional[Dict]:
+        # 转换为 cmetadata->>'source' IN (...) 条件，与向量距离排序在同一条 SQL 中执行
+        if search_params and search_params.get("sources") is not None:
+            return {"source": {"in": search_params["sources"]}}
+        return None
+
+    def normalize_score(self, score: float) -> float:
+        # PGVector 默认使用余弦距离 1 - 余弦相似度，取值在 0-2 之间
+        return max(0.0, min(1.0, float(score) / 2))
+
+    def add_doc(self, kb_file: KnowledgeFile, docs: List[Document] = None, embeddings: Embeddings = None):
         """
-        向知识库添加文件
+        向知识库添加文件，向量由向量库的嵌入模型计算（已算过的文本段命中向量缓存）
         """
-        docs = kb_file.file2text()
+        if docs is None:
+            docs = kb_file.file2text()
         self.pg_vector.add_documents(docs)
+        self.bm25_index.add(docs)
         from server.db.repository.knowledge_file_repository import add_doc_to_db
         status = add_doc_to_db(kb_file)
         return status
 
+    def add_docs(self, files: List[Tuple[KnowledgeFile, List[Document]]], embeddings: Embeddings = None):
+        """
+        批量添加多个已切分好的文件，文本段一次写入向量库，文件信息在一个数据库事务中写入
+        """
+        files = [(kb_file, docs) for kb_file, docs in files if docs]
+        if not files:
+            return False
+        docs = [doc for _, file_docs in files for doc in file_docs]
+        self.pg_vector.add_documents(docs)
+        self.bm25_index.add(docs)
+        from server.db.repository.knowledge_file_repository import add_docs_to_db
+        return add_docs_to_db([kb_file for kb_file, _ in files])
+
     def do_add_doc(self, docs: List[Document], embeddings: Embeddings):
         pass
 
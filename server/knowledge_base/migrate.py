@@ -1,14 +1,35 @@
-from configs.model_config import EMBEDDING_MODEL, DEFAULT_VS_TYPE, KB_ROOT_PATH
+from configs.model_config import EMBEDDING_MODEL, DEFAULT_VS_TYPE, KB_ROOT_PATH, logger
 from server.knowledge_base.utils import get_file_path, list_kbs_from_folder, list_docs_from_folder, KnowledgeFile
 from server.knowledge_base.kb_service.base import KBServiceFactory
+from server.knowledge_base.ingest import ingest_files, notify
 from server.db.repository.knowledge_file_repository import add_doc_to_db
+from server.db.repository.knowledge_base_repository import load_kb_from_db
+from server.db.models.knowledge_job_model import KnowledgeJobModel
 from server.db.base import Base, engine
+from sqlalchemy import inspect, text
 import os
 from typing import Literal, Callable, Any
 
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
+    upgrade_tables()
+
+
+def upgrade_tables():
+    '''
+    add columns introduced by newer versions to existing tables, because create_all never alters existing tables.
+    '''
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
 
 
 def reset_tables():
@@ -24,6 +45,9 @@ def folder2db(
     embed_model: str = EMBEDDING_MODEL,
     callback_before: Callable = None,
     callback_after: Callable = None,
+    index_type: str = None,
+    vector_codec: str = None,
+    callback_error: Callable = None,
 ):
     '''
     use existed files in local folder to populate database and/or vector store.
@@ -32,65 +56,67 @@ def folder2db(
         fill_info_only: do not create vector store, fill info to db using existed files only
         update_in_db: update vector store and database info using local files that existed in database only
         increament: create vector store and database info for local files that not existed in database only
+    set `index_type` / `vector_codec` to change the vector index / vector compression of faiss knowledge base,
+    keep the current one if not specified.
+    files are loaded, embedded and written in parallel stages (see `ingest_files`), except for fill_info_only.
+    callback_before / callback_after are called with (kb_file, i, docs, stats) for every file, where stats are the
+    per-stage throughput stats so far (None in fill_info_only); callbacks taking only (kb_file, i, docs) still work.
+    files that fail are skipped and reported to callback_error(kb_file, i, docs, exception).
+    returns the final stats of `ingest_files` with the failed file names in stats["failed"], or None for fill_info_only.
     '''
-    kb = KBServiceFactory.get_service(user_id, kb_name, vs_type, embed_model)
+    _, _, _, old_index_type, old_vector_codec = load_kb_from_db(user_id, kb_name)
+    index_type = index_type or old_index_type
+    vector_codec = vector_codec or old_vector_codec
+    kb = KBServiceFactory.get_service(user_id, kb_name, vs_type, embed_model, index_type, vector_codec)
     kb.create_kb()
 
     if mode == "recreate_vs":
         kb.clear_vs()
         docs = list_docs_from_folder(user_id, kb_name)
-        for i, doc in enumerate(docs):
-            try:
-                kb_file = KnowledgeFile(filename=doc, knowledge_base_name=kb_name, user_id=user_id)
-                if callable(callback_before):
-                    callback_before(kb_file, i, docs)
-                kb.add_doc(kb_file)
-                if callable(callback_after):
-                    callback_after(kb_file, i, docs)
-            except Exception as e:
-                print(e)
+        stats = ingest_files(kb, docs, callback_before=callback_before, callback_after=callback_after,
+                             callback_error=callback_error)
+        kb.optimize_vs()
+        return stats
     elif mode == "fill_info_only":
         docs = list_docs_from_folder(user_id, kb_name)
         for i, doc in enumerate(docs):
+            kb_file = None
             try:
                 kb_file = KnowledgeFile(doc, kb_name, user_id)
-                if callable(callback_before):
-                    callback_before(kb_file, i, docs)
+                notify(callback_before, kb_file, i, docs, None)
                 add_doc_to_db(kb_file)
-                if callable(callback_after):
-                    callback_after(kb_file, i, docs)
+                notify(callback_after, kb_file, i, docs, None)
             except Exception as e:
-                print(e)
+                logger.error(f"fill info of {kb_name}/{doc} failed: {e}")
+                notify(callback_error, kb_file, i, docs, e)
     elif mode == "update_in_db":
         docs = kb.list_docs()
-        for i, doc in enumerate(docs):
-            try:
-                kb_file = KnowledgeFile(doc, kb_name, user_id)
-                if callable(callback_before):
-                    callback_before(kb_file, i, docs)
-                kb.update_doc(kb_file)
-                if callable(callback_after):
-                    callback_after(kb_file, i, docs)
-            except Exception as e:
-                print(e)
+        stats = ingest_files(kb, docs, replace=True, callback_before=callback_before, callback_after=callback_after,
+                             callback_error=callback_error)
+        kb.optimize_vs()
+        return stats
     elif mode == "increament":
         db_docs = kb.list_docs()
         folder_docs = list_docs_from_folder(user_id, kb_name)
         docs = list(set(folder_docs) - set(db_docs))
-        for i, doc in enumerate(docs):
-            try:
-                kb_file = KnowledgeFile(doc, kb_name, user_id)
-                if callable(callback_before):
-                    callback_before(kb_file, i, docs)
-                kb.add_doc(kb_file)
-                if callable(callback_after):
-                    callback_after(kb_file, i, docs)
-            except Exception as e:
-                print(e)
+        stats = ingest_files(kb, docs, callback_before=callback_before, callback_after=callback_after,
+                             callback_error=callback_error)
+        kb.optimize_vs()
+        return stats
     else:
         raise ValueError(f"unspported migrate mode: {mode}")
 
 
+def _iter_kbs():
+    for f in os.listdir(KB_ROOT_PATH):
+        # skip non user folders such as info.db
+        if not f.isdigit() or not os.path.isdir(os.path.join(KB_ROOT_PATH, f)):
+            continue
+        user_id = int(f)
+        for kb_name in list_kbs_from_folder(user_id):
+            yield user_id, kb_name
+
+
 def recreate_all_vs(
     vs_type: Literal["faiss", "milvus", "pg", "chromadb"] = DEFAULT_VS_TYPE,
     embed_mode: str = EMBEDDING_MODEL,
@@ -99,10 +125,52 @@ def recreate_all_vs(
     '''
     used to recreate a vector store or change current vector store to another type or embed_model
     '''
-    for f in os.listdir(KB_ROOT_PATH):
-        user_id = int(f)
-        for kb_name in list_kbs_from_folder(user_id):
-            folder2db(user_id, kb_name, "recreate_vs", vs_type, embed_mode, **kwargs)
+    for user_id, kb_name in _iter_kbs():
+        folder2db(user_id, kb_name, "recreate_vs", vs_type, embed_mode, **kwargs)
+
+
+def build_bm25_index(
+    user_id: int,
+    kb_name: str,
+    rebuild: bool = False,
+    callback: Callable = None,
+) -> int:
+    '''
+    backfill the BM25 inverted index (used by search mode bm25 / hybrid) of a knowledge base created before it existed,
+    by splitting the files recorded in database again. the vector store and embeddings are not touched.
+    knowledge bases whose index already has chunks are skipped unless `rebuild` is True.
+    callback is called with (kb_file, i, docs). returns the number of indexed chunks.
+    '''
+    kb = KBServiceFactory.get_service_by_name(kb_name, user_id)
+    if kb is None:
+        raise ValueError(f"knowledge base {kb_name} of user {user_id} not found")
+    index = kb.bm25_index
+    if index.count() and not rebuild:
+        return 0
+    index.clear()
+    docs = kb.list_docs()
+    count = 0
+    for i, doc in enumerate(docs):
+        kb_file = KnowledgeFile(doc, kb_name, user_id)
+        try:
+            chunks = kb_file.file2text()
+            index.add(chunks)
+            count += len(chunks)
+        except Exception as e:
+            logger.error(f"build bm25 index for {kb_name}/{doc} failed: {e}")
+        if callable(callback):
+            callback(kb_file, i, docs)
+    logger.info(f"built bm25 index of {kb_name} with {count} chunks from {len(docs)} files")
+    return count
+
+
+def build_all_bm25_indexes(rebuild: bool = False):
+    '''
+    backfill the BM25 inverted indexes of all knowledge bases, see `build_bm25_index`
+    '''
+    for user_id, kb_name in _iter_kbs():
+        if KBServiceFactory.get_service_by_name(kb_name, user_id) is not None:
+            build_bm25_index(user_id, kb_name, rebuild)
 
 
 # def prune_db_docs(kb_name: str):
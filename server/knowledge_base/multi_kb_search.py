@@ -0,0 +1,70 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from langchain.docstore.document import Document
+
+from configs.model_config import (EMBEDDING_DEVICE, VECTOR_SEARCH_TOP_K, SCORE_THRESHOLD,
+                                  MULTI_KB_SEARCH_WORKERS, logger)
+from server.db.repository.knowledge_base_repository import list_kbs_from_db
+from server.knowledge_base.kb_service.base import KBService, KBServiceFactory, SupportedVSType, SearchMode
+from server.knowledge_base.utils import load_embeddings
+
+
+_search_executor = ThreadPoolExecutor(max_workers=MULTI_KB_SEARCH_WORKERS, thread_name_prefix="multi_kb_search")
+
+
+def search_multi_kbs(user_id: int,
+                     query: str,
+                     knowledge_base_names: List[str] = None,
+                     top_k: int = VECTOR_SEARCH_TOP_K,
+                     score_threshold: float = SCORE_THRESHOLD,
+                     search_params: Dict = None,
+                     filters: Dict = None,
+                     ) -> List[Tuple[Document, float]]:
+    """
+    并发检索多个知识库，knowledge_base_names 为空时检索用户的全部知识库。
+    每个嵌入模型只向量化一次查询，各知识库的分数归一化到 0-1 后合并为全局 top_k，
+    返回文档的 metadata 中 kb_name 为其所在知识库，filters 为文件过滤条件，在各知识库中分别生效。
+    向量检索时 score_threshold 作用于归一化后的分数，各向量库的阈值含义一致（包括不支持按分数过滤的 pg、milvus），
+    混合检索与关键词检索时与单个知识库的 search_docs 相同
+    """
+    search_params = dict(search_params or {})
+    # 混合检索与关键词检索的分数已按排名换算到 0-1 之间，无需再归一化
+    search_params["search_mode"] = KBService.search_mode(search_params.get("search_mode"))
+    normalize = search_params["search_mode"] == SearchMode.VECTOR
+    kb_names = knowledge_base_names or list_kbs_from_db(user_id)
+    kbs = []
+    for kb_name in kb_names:
+        kb = KBServiceFactory.get_service_by_name(kb_name, user_id)
+        if kb is None or kb.vs_type() == SupportedVSType.DEFAULT:
+            logger.warning(f"knowledge base {kb_name} of user {user_id} not found, skip it")
+            continue
+        kbs.append(kb)
+
+    query_vectors = {}
+    for kb in kbs:
+        if kb.embed_model not in query_vectors and search_params["search_mode"] != SearchMode.BM25:
+            query_vectors[kb.embed_model] = load_embeddings(kb.embed_model, EMBEDDING_DEVICE).embed_query(query)
+
+    # 向量检索时各知识库不按原始分数过滤，归一化后再统一按阈值过滤
+    kb_threshold = None if normalize else score_threshold
+    futures = [(kb, _search_executor.submit(kb.search_docs_by_vector, query, query_vectors.get(kb.embed_model),
+                                            top_k, kb_threshold, search_params, filters))
+               for kb in kbs]
+    results = []
+    for kb, future in futures:
+        try:
+            docs = future.result()
+        except Exception as e:
+            logger.error(f"search knowledge base {kb.kb_name} failed: {e}")
+            continue
+        for doc, score in docs:
+            if normalize:
+                score = kb.normalize_score(score)
+                if score > score_threshold:
+                    continue
+            doc = Document(page_content=doc.page_content, metadata={**doc.metadata, "kb_name": kb.kb_name})
+            results.append((doc, score))
+
+    results.sort(key=lambda x: x[1])
+    return results[:top_k]
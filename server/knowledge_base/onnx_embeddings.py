@@ -0,0 +1,151 @@
+import inspect
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from configs.model_config import EMBEDDING_CACHE_PATH, logger
+
+
+# 导出后与原 PyTorch 模型向量的最小余弦相似度，低于该值时不使用导出的模型
+ONNX_TOLERANCE = {"fp32": 0.9999, "int8": 0.99}
+
+_CHECK_SENTENCES = [
+    "营业执照的办理流程是什么？",
+    "根据《中华人民共和国行政许可法》第十二条，下列事项可以设定行政许可。",
+    "The quick brown fox jumps over the lazy dog.",
+    "申请人应当如实提交有关材料和反映真实情况，并对其申请材料实质内容的真实性负责。",
+]
+
+
+def export_dir(model_name: str) -> str:
+    return os.path.join(EMBEDDING_CACHE_PATH, "onnx", model_name)
+
+
+def export_onnx(model_name: str, model_path: str, quantize: bool = False) -> Dict:
+    """
+    将 sentence_transformers 模型导出为 ONNX（可选 int8 动态量化），与分词器、池化方式一起保存到 export_dir，
+    并在样例句子上检查与原模型向量的余弦相似度，返回导出信息
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    path = export_dir(model_name)
+    os.makedirs(path, exist_ok=True)
+    st_model = SentenceTransformer(model_path, device="cpu")
+    transformer, pooling = st_model[0], st_model[1]
+    pooling_config = pooling.get_config_dict()
+    if pooling_config.get("pooling_mode_cls_token"):
+        pooling_mode = "cls"
+    elif pooling_config.get("pooling_mode_max_tokens"):
+        pooling_mode = "max"
+    else:
+        pooling_mode = "mean"
+    normalize = any(type(module).__name__ == "Normalize" for module in st_model)
+
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(path)
+    sample = tokenizer(_CHECK_SENTENCES[:2], padding=True, return_tensors="pt")
+    # 图的输入顺序与模型 forward 的参数顺序一致
+    input_names = [name for name in inspect.signature(transformer.auto_model.forward).parameters if name in sample]
+    fp32_file = os.path.join(path, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(transformer.auto_model,
+                          ({name: sample[name] for name in input_names},),
+                          fp32_file,
+                          input_names=input_names,
+                          output_names=["last_hidden_state"],
+                          dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names},
+                                        "last_hidden_state": {0: "batch", 1: "sequence"}},
+                          opset_version=14)
+    model_file = fp32_file
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        model_file = os.path.join(path, "model.int8.onnx")
+        quantize_dynamic(fp32_file, model_file, weight_type=QuantType.QInt8)
+
+    info = {
+        "model_path": model_path,
+        "model_file": os.path.basename(model_file),
+        "precision": "int8" if quantize else "fp32",
+        "pooling_mode": pooling_mode,
+        "normalize": normalize,
+        "max_length": transformer.max_seq_length,
+        "input_names": input_names,
+    }
+    expected = st_model.encode(_CHECK_SENTENCES, convert_to_numpy=True)
+    actual = np.asarray(OnnxEmbeddings(model_name, info=info).embed_documents(_CHECK_SENTENCES))
+    cosine = np.sum(expected * actual, axis=1) / (np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+    info["min_cosine"] = float(cosine.min())
+    with open(os.path.join(path, "export.json"), "w") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    logger.info(f"exported {model_name} to onnx ({info['precision']}), min cosine {info['min_cosine']:.5f}")
+    return info
+
+
+def load_export_info(model_name: str, model_path: str, quantize: bool = False) -> Optional[Dict]:
+    """
+    读取导出信息，尚未导出或导出参数不同时返回 None。导出耗时较长，只在预加载或 init_database.py --export-onnx 时进行
+    """
+    info_file = os.path.join(export_dir(model_name), "export.json")
+    if os.path.isfile(info_file):
+        with open(info_file) as f:
+            info = json.load(f)
+        if info["model_path"] == model_path and info["precision"] == ("int8" if quantize else "fp32"):
+            return info
+    return None
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    使用 ONNX Runtime 在 CPU 上计算向量，池化与归一化方式与原 sentence_transformers 模型一致，
+    向量与 PyTorch 模型建立的索引兼容（误差见 ONNX_TOLERANCE）
+    """
+
+    def __init__(self, model_name: str, info: Dict, num_threads: int = 0, batch_size: int = 32):
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.info = info
+        self.batch_size = batch_size
+        path = export_dir(model_name)
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        model_file = os.path.join(path, info["model_file"])
+        self.session = onnxruntime.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.nbytes = os.path.getsize(model_file)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=self.info["max_length"],
+                                return_tensors="np")
+        feed = {name: inputs[name].astype(np.int64) for name in self.info["input_names"]}
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        mask = inputs["attention_mask"][..., None].astype(hidden.dtype)
+        mode = self.info["pooling_mode"]
+        if mode == "cls":
+            vectors = hidden[:, 0]
+        elif mode == "max":
+            vectors = np.where(mask > 0, hidden, -1e9).max(axis=1)
+        else:
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.info["normalize"]:
+            vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [self._encode(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # 查询与文本段的计算方式相同
+        return self.embed_documents(texts)
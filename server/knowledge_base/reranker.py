@@ -0,0 +1,169 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from configs.model_config import (reranker_model_dict, RERANKER_MODEL, RERANKER_DEVICE, RERANK_MAX_LENGTH,
+                                  RERANK_LATENCY_BUDGET, RERANK_PROBE_INTERVAL, RERANK_CACHE_SIZE, logger)
+from server.knowledge_base.utils import embeddings_pool
+
+
+class Reranker:
+    """
+    交叉编码器重排，对 (问题, 文本段) 打分，所有未缓存的文本对在一次批量前向计算中完成。
+    分数按 (问题, 文本段内容哈希) 缓存；前向计算串行执行，按平均每对耗时和排队中的文本对数估算等待时间，
+    超过 latency_budget 秒时跳过重排，避免高负载下拖慢问答。
+    跳过后每隔 probe_interval 秒放行一次空闲时的请求重新测量，耗时估计不会因一次慢批次而一直偏高
+    """
+
+    def __init__(self,
+                 model_name: str,
+                 device: str = "cpu",
+                 max_length: int = RERANK_MAX_LENGTH,
+                 cache_size: int = RERANK_CACHE_SIZE,
+                 latency_budget: float = RERANK_LATENCY_BUDGET,
+                 probe_interval: float = RERANK_PROBE_INTERVAL,
+                 ):
+        self.model_name = model_name
+        self.device = device
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self.latency_budget = latency_budget
+        self.probe_interval = probe_interval
+        self._model = None
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._predict_lock = threading.Lock()
+        self._pending_pairs = 0
+        self._pair_seconds = None
+        self._measured_at = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._skipped = 0
+
+    def _load_model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(reranker_model_dict.get(self.model_name, self.model_name),
+                                       max_length=self.max_length,
+                                       device=self.device)
+        return self._model
+
+    @property
+    def nbytes(self) -> int:
+        if self._model is None:
+            return 0
+        return sum(p.numel() * p.element_size() for p in self._model.model.parameters())
+
+    def close(self):
+        """
+        从缓存池中淘汰时释放模型，等待正在进行的前向计算结束
+        """
+        with self._predict_lock:
+            self._model = None
+
+    def _stale(self) -> bool:
+        return time.perf_counter() - self._measured_at >= self.probe_interval
+
+    def _within_budget(self, n: int) -> bool:
+        if self.latency_budget is None or self._pair_seconds is None:
+            return True
+        if self._pair_seconds * (self._pending_pairs + n) <= self.latency_budget:
+            return True
+        # 估计值很久没有更新（一直在跳过）且当前空闲时，放行这一批作为探测
+        return self._pending_pairs == 0 and self._stale()
+
+    def _predict(self, query: str, texts: List[str]) -> List[float]:
+        with self._predict_lock:
+            model = self._load_model()
+            start = time.perf_counter()
+            scores = model.predict([(query, text) for text in texts], batch_size=len(texts),
+                                   show_progress_bar=False, convert_to_numpy=True)
+            pair_seconds = (time.perf_counter() - start) / len(texts)
+        with self._lock:
+            # 指数滑动平均，适应负载与文本长度的变化；上次测量已过时（如探测批次）时直接使用本次的值
+            self._pair_seconds = (pair_seconds if self._pair_seconds is None or self._stale()
+                                  else 0.8 * self._pair_seconds + 0.2 * pair_seconds)
+            self._measured_at = time.perf_counter()
+        return [float(s) for s in scores]
+
+    def rerank(self, query: str, docs: List[Document], top_k: int) -> Optional[List[Tuple[Document, float]]]:
+        """
+        返回按相关性从高到低排列的前 top_k 个 (文档, 分数)，分数越大越相关。
+        超出延迟预算时不重排，返回 None
+        """
+        keys = [(query, hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()) for doc in docs]
+        scores: Dict[Tuple[str, str], float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+            missing = {key: doc.page_content for key, doc in zip(keys, docs) if key not in scores}
+            self._hits += len(keys) - len(missing)
+            if missing:
+                if not self._within_budget(len(missing)):
+                    self._skipped += 1
+                    logger.warning(f"rerank skipped, {self._pending_pairs} pairs pending")
+                    return None
+                self._misses += len(missing)
+                self._pending_pairs += len(missing)
+
+        if missing:
+            try:
+                new_scores = self._predict(query, list(missing.values()))
+            finally:
+                with self._lock:
+                    self._pending_pairs -= len(missing)
+            with self._lock:
+                for key, score in zip(missing, new_scores):
+                    self._cache[key] = score
+                    scores[key] = score
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        ranked = sorted(zip(docs, keys), key=lambda x: scores[x[1]], reverse=True)
+        return [(doc, scores[key]) for doc, key in ranked[:top_k]]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "cache_entries": len(self._cache),
+                "cache_hits": self._hits,
+                "cache_misses": self._misses,
+                "skipped": self._skipped,
+                "pending_pairs": self._pending_pairs,
+                "avg_pair_seconds": self._pair_seconds,
+            }
+
+
+def load_reranker(model: str = RERANKER_MODEL, device: str = RERANKER_DEVICE) -> Reranker:
+    """
+    重排模型与嵌入模型放在同一个缓存池中，共用 CACHED_EMBEDDING_MEMORY 的内存预算
+    """
+    def _load():
+        reranker = Reranker(model, device)
+        reranker._load_model()
+        return reranker
+
+    return embeddings_pool.get(("reranker", model, device), _load, sizeof=lambda reranker: reranker.nbytes)
+
+
+def rerank_docs(query: str, docs: List[Document], top_k: int) -> List[Document]:
+    """
+    对检索结果重排并取前 top_k 个，跳过重排或重排失败时按原顺序取前 top_k 个
+    """
+    if len(docs) <= 1:
+        return docs[:top_k]
+    try:
+        ranked = load_reranker().rerank(query, docs, top_k)
+    except Exception as e:
+        logger.error(f"rerank failed: {e}")
+        ranked = None
+    if ranked is None:
+        return docs[:top_k]
+    return [doc for doc, _ in ranked]
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+from typing import Dict, Iterator, Tuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+from configs.model_config import (UPLOAD_CHUNK_SIZE, UPLOAD_SESSION_EXPIRE, UPLOAD_ARCHIVE_MAX_FILES,
+                                  UPLOAD_ARCHIVE_MAX_SIZE, logger)
+from server.knowledge_base.utils import get_kb_path
+
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+ARCHIVE_EXTS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+
+def get_upload_path(user_id: int, knowledge_base_name: str) -> str:
+    """
+    上传中的临时文件目录，与 content 目录在同一文件系统上，完成后可原子地移动过去
+    """
+    return os.path.join(get_kb_path(user_id, knowledge_base_name), "uploads")
+
+
+def _write_chunk(f, sha256, chunk: bytes):
+    f.write(chunk)
+    if sha256 is not None:
+        sha256.update(chunk)
+
+
+async def receive_upload(file: UploadFile, user_id: int, knowledge_base_name: str) -> Tuple[str, int, str]:
+    """
+    按 UPLOAD_CHUNK_SIZE 分块将上传的文件写入临时文件，边写边计算 sha256，内存中最多只有一个分块。
+    返回 (临时文件路径, 文件大小, sha256)，由调用方移动到 content 目录或删除
+    """
+    upload_path = get_upload_path(user_id, knowledge_base_name)
+    os.makedirs(upload_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=upload_path, prefix="upload-")
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await run_in_threadpool(_write_chunk, f, sha256, chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, size, sha256.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def commit_upload(tmp_path: str, filepath: str):
+    """
+    将临时文件原子地替换为知识库中的文件，读取方不会看到写了一半的文件
+    """
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    os.replace(tmp_path, filepath)
+
+
+def _session_path(user_id: int, knowledge_base_name: str, upload_id: str) -> str:
+    if not _UPLOAD_ID.match(upload_id or ""):
+        raise ValueError(f"无效的上传ID {upload_id}")
+    return os.path.join(get_upload_path(user_id, knowledge_base_name), upload_id)
+
+
+def _save_session(session: Dict):
+    path = _session_path(session["user_id"], session["kb_name"], session["upload_id"])
+    tmp_file = os.path.join(path, "session.json.tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(session, f, ensure_ascii=False)
+    os.replace(tmp_file, os.path.join(path, "session.json"))
+
+
+def _cleanup_sessions(user_id: int, knowledge_base_name: str):
+    """
+    删除超过 UPLOAD_SESSION_EXPIRE 秒未更新的分块上传
+    """
+    upload_path = get_upload_path(user_id, knowledge_base_name)
+    if not os.path.isdir(upload_path):
+        return
+    deadline = time.time() - UPLOAD_SESSION_EXPIRE
+    for name in os.listdir(upload_path):
+        path = os.path.join(upload_path, name)
+        try:
+            if os.path.getmtime(path) < deadline:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+                logger.info(f"removed expired upload {path}")
+        except OSError as e:
+            logger.error(f"remove expired upload {path} failed: {e}")
+
+
+def create_upload_session(user_id: int,
+                          knowledge_base_name: str,
+                          file_name: str,
+                          file_size: int,
+                          sha256: str = None,
+                          category: str = None,
+                          override: bool = False,
+                          ) -> Dict:
+    """
+    开始一个可断点续传的分块上传，文件各分块依次追加到上传目录下的 data 文件中
+    """
+    _cleanup_sessions(user_id, knowledge_base_name)
+    upload_id = uuid.uuid4().hex
+    os.makedirs(_session_path(user_id, knowledge_base_name, upload_id))
+    open(os.path.join(_session_path(user_id, knowledge_base_name, upload_id), "data"), "wb").close()
+    session = {
+        "upload_id": upload_id,
+        "user_id": user_id,
+        "kb_name": knowledge_base_name,
+        "file_name": file_name,
+        "file_size": file_size,
+        "sha256": sha256.lower() if sha256 else None,
+        "category": category,
+        "override": override,
+        "received": 0,
+    }
+    _save_session(session)
+    return session
+
+
+def load_upload_session(user_id: int, knowledge_base_name: str, upload_id: str) -> Dict:
+    """
+    读取分块上传的状态，received 以 data 文件的实际大小为准；不存在时返回空字典
+    """
+    path = _session_path(user_id, knowledge_base_name, upload_id)
+    session_file = os.path.join(path, "session.json")
+    if not os.path.isfile(session_file):
+        return {}
+    with open(session_file, encoding="utf-8") as f:
+        session = json.load(f)
+    session["received"] = os.path.getsize(os.path.join(path, "data"))
+    return session
+
+
+async def append_upload_part(session: Dict, offset: int, file: UploadFile) -> Dict:
+    """
+    从 offset 处写入一个分块。offset 小于已接收的字节数时（如上次的分块未确认就断开）从 offset 处覆盖，
+    大于已接收的字节数时报错，客户端应先查询 received 再续传
+    """
+    if offset > session["received"]:
+        raise ValueError(f"分块起始位置 {offset} 超过已接收的 {session['received']} 字节")
+    data_file = os.path.join(_session_path(session["user_id"], session["kb_name"], session["upload_id"]), "data")
+    size = offset
+    with open(data_file, "r+b") as f:
+        f.seek(offset)
+        f.truncate()
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if size + len(chunk) > session["file_size"]:
+                raise ValueError(f"上传的数据超过文件大小 {session['file_size']} 字节")
+            await run_in_threadpool(_write_chunk, f, None, chunk)
+            size += len(chunk)
+    session["received"] = size
+    _save_session(session)
+    return session
+
+
+def finish_upload_session(session: Dict) -> Tuple[str, str]:
+    """
+    检查文件大小与 sha256，返回 (data 文件路径, sha256)，由调用方移动到 content 目录
+    """
+    path = _session_path(session["user_id"], session["kb_name"], session["upload_id"])
+    data_file = os.path.join(path, "data")
+    if session["received"] != session["file_size"]:
+        raise ValueError(f"文件未上传完整，已接收 {session['received']}/{session['file_size']} 字节")
+    sha256 = file_sha256(data_file)
+    if session["sha256"] and sha256 != session["sha256"]:
+        raise ValueError(f"文件校验失败，sha256 为 {sha256}，与声明的 {session['sha256']} 不一致")
+    return data_file, sha256
+
+
+def drop_upload_session(session: Dict):
+    shutil.rmtree(_session_path(session["user_id"], session["kb_name"], session["upload_id"]),
+                  ignore_errors=True)
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTS)
+
+
+def _zip_member_name(info: zipfile.ZipInfo) -> str:
+    # 未设置 UTF-8 标志的文件名按 cp437 解码，Windows 中文系统打包的压缩包实际为 GBK 编码
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("gbk")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _check_archive_limits(count: int, size: int):
+    if count > UPLOAD_ARCHIVE_MAX_FILES:
+        raise ValueError(f"压缩包中的条目超过 {UPLOAD_ARCHIVE_MAX_FILES} 个")
+    if size > UPLOAD_ARCHIVE_MAX_SIZE:
+        raise ValueError(f"压缩包解压后超过 {UPLOAD_ARCHIVE_MAX_SIZE} 字节")
+
+
+def extract_archive(archive_path: str, filename: str, target_dir: str) -> Iterator[Tuple[str, str]]:
+    """
+    将 zip / tar 压缩包中的文件逐个流式解压到 target_dir 下的临时文件，只取文件名、忽略目录结构，
+    跳过目录和链接等非普通文件，每解压完一个文件产出 (文件名, 临时文件路径)。
+    条目数超过 UPLOAD_ARCHIVE_MAX_FILES 或解压后的总大小超过 UPLOAD_ARCHIVE_MAX_SIZE 时抛出 ValueError：
+    zip 在解压前按目录中记录的大小检查，tar 在解压每个文件前检查，已产出的文件由调用方处理
+    """
+    def save(name: str, src) -> Tuple[str, str]:
+        fd, tmp_path = tempfile.mkstemp(dir=target_dir, prefix="upload-")
+        try:
+            with os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        return os.path.basename(name), tmp_path
+
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf:
+            infos = zf.infolist()
+            # 读取 zip 中的文件时不会超过目录中记录的大小，解压前即可检查
+            _check_archive_limits(len(infos), sum(info.file_size for info in infos if not info.is_dir()))
+            for info in infos:
+                name = _zip_member_name(info)
+                if info.is_dir() or not os.path.basename(name):
+                    continue
+                with zf.open(info) as src:
+                    yield save(name, src)
+    else:
+        count, size = 0, 0
+        with tarfile.open(archive_path) as tf:
+            for info in tf:
+                count += 1
+                size += info.size if info.isfile() else 0
+                _check_archive_limits(count, size)
+                if not info.isfile() or not os.path.basename(info.name):
+                    continue
+                with tf.extractfile(info) as src:
+                    yield save(info.name, src)
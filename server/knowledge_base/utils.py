@@ -1,15 +1,32 @@
+import hashlib
+import json
 import os
+from langchain.embeddings.base import Embeddings
 from langchain.embeddings.huggingface import HuggingFaceEmbeddings
+from langchain.docstore.document import Document
 from configs.model_config import (
     embedding_model_dict,
+    logger,
+    CACHED_EMBEDDING_MEMORY,
+    EMBEDDING_PRELOAD,
+    EMBEDDING_DEVICE,
     KB_ROOT_PATH,
     CHUNK_SIZE,
     OVERLAP_SIZE,
-    ZH_TITLE_ENHANCE
+    ZH_TITLE_ENHANCE,
+    TEXT_SPLITTER_PRELOAD,
+    TEXT_SPLITTER_RETRY_INTERVAL,
 )
 from functools import lru_cache
 import importlib
 from text_splitter import zh_title_enhance
+from server.knowledge_base.embedding_cache import CachedEmbeddings
+from server.knowledge_base.embedding_worker import BatchingEmbeddings
+from server.knowledge_base.kb_cache import CachePool
+from server.utils import torch_gc
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
 
 def validate_kb_name(knowledge_base_id: str) -> bool:
@@ -39,11 +56,225 @@ def list_docs_from_folder(user_id:int, kb_name: str):
     return [file for file in os.listdir(doc_path)
             if os.path.isfile(os.path.join(doc_path, file))]
 
-@lru_cache(1)
-def load_embeddings(model: str, device: str):
-    embeddings = HuggingFaceEmbeddings(model_name=embedding_model_dict[model],
-                                       model_kwargs={'device': device})
-    return embeddings
+def chunk_key(doc: Document) -> str:
+    """
+    文本段内容与元数据的哈希，更新文件时用来判断文本段是否可以复用
+    """
+    metadata = json.dumps(doc.metadata, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(f"{doc.page_content}\0{metadata}".encode("utf-8")).hexdigest()
+
+
+def diff_chunks(old: Dict[int, Document], new: List[Document]) -> Tuple[List[Document], List[int], int]:
+    """
+    按 chunk_key 比较已有文本段 {id: 文本段} 与新切分的文本段，相同的文本段出现多次时按次数匹配。
+    返回 (需要新增的文本段, 需要删除的已有文本段id, 复用的文本段数量)
+    """
+    old_ids: Dict[str, List[int]] = {}
+    for i, doc in old.items():
+        old_ids.setdefault(chunk_key(doc), []).append(i)
+    added, reused = [], 0
+    for doc in new:
+        ids = old_ids.get(chunk_key(doc))
+        if ids:
+            ids.pop()
+            reused += 1
+        else:
+            added.append(doc)
+    removed = [i for ids in old_ids.values() for i in ids]
+    return added, removed, reused
+
+
+def _release_embeddings(embeddings: BatchingEmbeddings):
+    embeddings.close()
+    torch_gc()
+
+
+# 无法统计参数、也找不到模型文件时按 base 规模模型的大小估算，仍会占用缓存池的预算
+DEFAULT_EMBEDDING_NBYTES = 512 * 1024 ** 2
+
+
+def _embeddings_nbytes(embeddings: BatchingEmbeddings, model: str = None) -> int:
+    if hasattr(embeddings.embeddings, "nbytes"):
+        return embeddings.embeddings.nbytes
+    try:
+        return sum(p.numel() * p.element_size() for p in embeddings.embeddings.client.parameters())
+    except AttributeError:
+        pass
+    # 其他后端按模型目录中文件的大小估算
+    model_path = embedding_model_config(model)["model_path"] if model in embedding_model_dict else None
+    if model_path and os.path.isdir(model_path):
+        nbytes = sum(os.path.getsize(os.path.join(root, f))
+                     for root, _, files in os.walk(model_path) for f in files)
+        if nbytes:
+            return nbytes
+    return DEFAULT_EMBEDDING_NBYTES
+
+
+def embedding_model_config(model: str) -> dict:
+    """
+    embedding_model_dict 中的条目可以是模型路径，或包含 model_path、backend 等字段的字典
+    """
+    config = embedding_model_dict[model]
+    if isinstance(config, str):
+        config = {"model_path": config}
+    return {"backend": "torch", **config}
+
+
+def export_onnx_embeddings(model: str) -> Optional[dict]:
+    """
+    将 onnx 后端的嵌入模型导出（已导出时直接返回导出信息），其他后端返回 None
+    """
+    config = embedding_model_config(model)
+    if config["backend"] != "onnx":
+        return None
+    from server.knowledge_base.onnx_embeddings import load_export_info, export_onnx
+    quantize = config.get("quantize", False)
+    return (load_export_info(model, config["model_path"], quantize)
+            or export_onnx(model, config["model_path"], quantize))
+
+
+def _create_embeddings(model: str, device: str) -> Embeddings:
+    config = embedding_model_config(model)
+    if config["backend"] == "onnx":
+        from server.knowledge_base.onnx_embeddings import load_export_info, OnnxEmbeddings, ONNX_TOLERANCE
+        info = load_export_info(model, config["model_path"], config.get("quantize", False))
+        if info is None:
+            # 导出和校验需要几分钟，不在请求中进行
+            raise RuntimeError(f"embedding model {model} has not been exported to onnx, add it to EMBEDDING_PRELOAD "
+                               f"or run: python init_database.py --export-onnx {model}")
+        if info["min_cosine"] >= ONNX_TOLERANCE[info["precision"]]:
+            return OnnxEmbeddings(model, info, num_threads=config.get("num_threads", 0))
+        logger.error(f"onnx export of {model} differs from the original model "
+                     f"(min cosine {info['min_cosine']:.5f}), fall back to torch")
+    return HuggingFaceEmbeddings(model_name=config["model_path"], model_kwargs={'device': device})
+
+
+# 进程内嵌入模型缓存，key 为 (model, device)，重排模型的 key 为 ("reranker", model, device)，按模型参数占用的内存淘汰
+embeddings_pool = CachePool(max_bytes=CACHED_EMBEDDING_MEMORY * 1024 ** 2,
+                            name="embeddings",
+                            on_evict=_release_embeddings)
+_embedding_usage = {}
+_embedding_usage_lock = threading.Lock()
+
+
+def get_embedding_model(model: str, device: str) -> BatchingEmbeddings:
+    """
+    从缓存池中取得嵌入模型，不存在时加载，并记录各模型的使用次数、加载次数和加载耗时
+    """
+    def _load():
+        start = time.perf_counter()
+        embeddings = _create_embeddings(model, device)
+        with _embedding_usage_lock:
+            usage["loads"] += 1
+            usage["load_time"] += time.perf_counter() - start
+        return BatchingEmbeddings(embeddings)
+
+    with _embedding_usage_lock:
+        usage = _embedding_usage.setdefault((model, device), {"requests": 0, "loads": 0, "load_time": 0.0})
+        usage["requests"] += 1
+        usage["last_used"] = time.time()
+    return embeddings_pool.get((model, device), _load, sizeof=lambda embeddings: _embeddings_nbytes(embeddings, model))
+
+
+@lru_cache()
+def load_embeddings(model: str, device: str) -> CachedEmbeddings:
+    """
+    返回带查询/文本段向量缓存的嵌入模型，模型本身在首次计算时从 embeddings_pool 中加载，
+    多个嵌入模型按 CACHED_EMBEDDING_MEMORY 共存，超出时淘汰最近最少使用的模型
+    """
+    return CachedEmbeddings(lambda: get_embedding_model(model, device), model)
+
+
+def preload_embeddings():
+    """
+    服务启动时加载 EMBEDDING_PRELOAD 中的嵌入模型，onnx 后端的模型尚未导出时先导出
+    """
+    for model in EMBEDDING_PRELOAD:
+        export_onnx_embeddings(model)
+        get_embedding_model(model, EMBEDDING_DEVICE)
+
+
+def embedding_stats() -> dict:
+    resident = dict(embeddings_pool.items())
+    with _embedding_usage_lock:
+        usage = {k: dict(v) for k, v in _embedding_usage.items()}
+    models = {}
+    for key, stats in usage.items():
+        stats["resident"] = key in resident
+        if stats["resident"]:
+            stats.update(resident[key].stats())
+        models["@".join(key)] = stats
+    return {"pool": embeddings_pool.stats(), "models": models}
+
+
+# 进程内文本分词器缓存，key 为 (分词器类名, chunk_size, chunk_overlap, spaCy pipeline)
+_text_splitters = {}
+_text_splitter_usage = {}
+_text_splitter_lock = threading.Lock()
+
+
+def _create_text_splitter(splitter_name: str, chunk_size: int, chunk_overlap: int, pipeline: str = None):
+    try:
+        TextSplitter = getattr(importlib.import_module('langchain.text_splitter'), splitter_name)
+    except AttributeError:
+        # 项目自带的分词器，如 ChineseTextSplitter
+        TextSplitter = getattr(importlib.import_module('text_splitter'), splitter_name)
+    if pipeline is not None:
+        return TextSplitter(pipeline=pipeline, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return TextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def get_text_splitter(splitter_name: str = "SpacyTextSplitter",
+                      chunk_size: int = CHUNK_SIZE,
+                      chunk_overlap: int = OVERLAP_SIZE,
+                      pipeline: str = "zh_core_web_sm",
+                      ):
+    """
+    返回缓存的文本分词器，每种 (分词器, chunk_size, chunk_overlap, pipeline) 在每个进程中只构建一次，
+    SpacyTextSplitter 不再为每个文件重新加载 spaCy 模型。pipeline 只对 SpacyTextSplitter 有效。
+    构建失败时在 TEXT_SPLITTER_RETRY_INTERVAL 秒内直接抛出上次的异常，不会每个文件重试一次，之后再重新构建
+    """
+    key = (splitter_name, chunk_size, chunk_overlap, pipeline if splitter_name == "SpacyTextSplitter" else None)
+    with _text_splitter_lock:
+        usage = _text_splitter_usage.setdefault(key, {"uses": 0, "loads": 0, "load_time": 0.0, "error": None})
+        usage["uses"] += 1
+        cached = _text_splitters.get(key)
+        if cached is None or (isinstance(cached, tuple)
+                              and time.monotonic() - cached[1] >= TEXT_SPLITTER_RETRY_INTERVAL):
+            start = time.perf_counter()
+            try:
+                _text_splitters[key] = _create_text_splitter(*key)
+                usage["error"] = None
+            except Exception as e:
+                # 失败时缓存 (异常, 失败时间)
+                _text_splitters[key] = (e, time.monotonic())
+                usage["error"] = str(e)
+            elapsed = time.perf_counter() - start
+            usage["loads"] += 1
+            usage["load_time"] += elapsed
+            if usage["error"] is None:
+                logger.info(f"text splitter {key} loaded in {elapsed:.2f}s")
+        text_splitter = _text_splitters[key]
+    if isinstance(text_splitter, tuple):
+        raise text_splitter[0]
+    return text_splitter
+
+
+def preload_text_splitters():
+    """
+    服务启动、入库子进程启动时构建 TEXT_SPLITTER_PRELOAD 中的文本分词器
+    """
+    for splitter_name in TEXT_SPLITTER_PRELOAD:
+        try:
+            get_text_splitter(splitter_name)
+        except Exception as e:
+            logger.error(f"preload text splitter {splitter_name} failed: {e}")
+
+
+def text_splitter_stats() -> dict:
+    with _text_splitter_lock:
+        return {"@".join(str(part) for part in key if part is not None): dict(usage)
+                for key, usage in _text_splitter_usage.items()}
 
 
 LOADER_DICT = {"UnstructuredFileLoader": ['.eml', '.html', '.json', '.md', '.msg', '.rst',
@@ -67,10 +298,12 @@ class KnowledgeFile:
             filename: str,
             knowledge_base_name: str,
             user_id: int,
+            category: str = None,
     ):
         self.kb_name = knowledge_base_name
         self.user_id = user_id
         self.filename = filename
+        self.category = category
         self.ext = os.path.splitext(filename)[-1].lower()
         if self.ext not in SUPPORTED_EXTS:
             raise ValueError(f"暂未支持的文件格式 {self.ext}")
@@ -95,33 +328,18 @@ class KnowledgeFile:
         else:
             loader = DocumentLoader(self.filepath)
 
+        splitter_name = self.text_splitter_name or "SpacyTextSplitter"
         try:
-            if self.text_splitter_name is None:
-                text_splitter_module = importlib.import_module('langchain.text_splitter')
-                TextSplitter = getattr(text_splitter_module, "SpacyTextSplitter")
-                text_splitter = TextSplitter(
-                    pipeline="zh_core_web_sm",
-                    chunk_size=CHUNK_SIZE,
-                    chunk_overlap=OVERLAP_SIZE,
-                )
-                self.text_splitter_name = "SpacyTextSplitter"
-            else:
-                text_splitter_module = importlib.import_module('langchain.text_splitter')
-                TextSplitter = getattr(text_splitter_module, self.text_splitter_name)
-                text_splitter = TextSplitter(
-                    chunk_size=CHUNK_SIZE,
-                    chunk_overlap=OVERLAP_SIZE)
+            text_splitter = get_text_splitter(splitter_name)
         except Exception as e:
             print(e)
-            text_splitter_module = importlib.import_module('langchain.text_splitter')
-            TextSplitter = getattr(text_splitter_module, "RecursiveCharacterTextSplitter")
-            text_splitter = TextSplitter(
-                chunk_size=CHUNK_SIZE,
-                chunk_overlap=OVERLAP_SIZE,
-            )
+            splitter_name = "RecursiveCharacterTextSplitter"
+            text_splitter = get_text_splitter(splitter_name)
+        self.text_splitter_name = splitter_name
 
         docs = loader.load_and_split(text_splitter)
-        print(docs[0])
+        if docs:
+            logger.debug(f"first chunk of {self.filename}: {docs[0]}")
         if using_zh_title_enhance:
             docs = zh_title_enhance(docs)
         return docs
@@ -88,6 +88,45 @@ class MessageResponse(BaseResponse):
             }
         }
 
+class JobResponse(BaseResponse):
+    data: dict = pydantic.Field({}, description="Job detail")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "code": 200,
+                "msg": "success",
+                "data": {
+                    "job_id": 1,
+                    "kb_name": "samples",
+                    "file_name": "test.txt",
+                    "status": "running",
+                    "progress": 0.5,
+                    "message": "向量化 32/64 个文本段",
+                },
+            }
+        }
+
+
+class StatsResponse(BaseResponse):
+    data: dict = pydantic.Field(..., description="Cache statistics")
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "code": 200,
+                "msg": "success",
+                "data": {
+                    "query_embedding": {
+                        "entries": 1024,
+                        "hits": 3000,
+                        "misses": 1024,
+                        "hit_rate": 0.745,
+                    },
+                },
+            }
+        }
+
 class ChatMessage(BaseModel):
     question: str = pydantic.Field(..., description="Question text")
     response: str = pydantic.Field(..., description="Response text")
@@ -0,0 +1,38 @@
+import hashlib
+import os
+import sys
+from typing import List
+
+import numpy as np
+import pytest
+from langchain.embeddings.base import Embeddings
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    按文本哈希生成固定的随机向量，相同文本得到相同向量，不需要加载模型；记录向量化过的文本和查询
+    """
+
+    def __init__(self, dim: int = 32):
+        self.dim = dim
+        self.embedded: List[str] = []
+        self.queried: List[str] = []
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.RandomState(seed).standard_normal(self.dim).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.embedded.extend(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queried.append(text)
+        return self._vector(text)
+
+
+@pytest.fixture
+def embeddings() -> FakeEmbeddings:
+    return FakeEmbeddings()
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import pytest
+from langchain.docstore.document import Document
+
+from server.knowledge_base import bm25_index
+from server.knowledge_base.bm25_index import BM25Index, rrf_fuse
+
+
+def doc(content: str, source: str = "a.txt") -> Document:
+    return Document(page_content=content, metadata={"source": source})
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # 语料很小，不按文档频率删减查询词
+    monkeypatch.setattr(bm25_index, "BM25_MAX_DF_RATIO", 1.0)
+    index = BM25Index(str(tmp_path / "bm25.db"))
+    index.add([doc("行政许可的申请人应当如实提交有关材料", "xk.txt"),
+               doc("行政机关应当在二十日内作出决定", "xk.txt"),
+               doc("劳动合同应当以书面形式订立", "ld.txt"),
+               doc("用人单位应当向劳动者支付劳动报酬", "ld.txt")])
+    yield index
+    index.close()
+
+
+def contents(results):
+    return [d.page_content for d, _ in results]
+
+
+def test_rrf_ranks_documents_found_by_both_retrievers_first():
+    a, b, c = doc("甲"), doc("乙"), doc("丙")
+    vector = [(a, 0.1), (b, 0.2)]
+    keyword = [(c, -3.0), (Document(page_content="乙", metadata={"source": "a.txt"}), -2.0)]
+
+    fused = rrf_fuse([vector, keyword], top_k=3, rrf_k=60)
+
+    assert contents(fused) == ["乙", "甲", "丙"]
+    assert all(0 <= score < 1 for _, score in fused)
+    assert fused[1][1] == pytest.approx(fused[2][1])
+
+
+def test_rrf_keeps_same_content_from_different_sources():
+    fused = rrf_fuse([[(doc("甲", "1.txt"), 0.1)], [(doc("甲", "2.txt"), -1.0)]], top_k=5)
+    assert [d.metadata["source"] for d, _ in fused] == ["1.txt", "2.txt"]
+
+
+def test_rrf_ignores_empty_result_lists_and_limits_top_k():
+    results = [(doc(str(i)), float(i)) for i in range(5)]
+    fused = rrf_fuse([results, []], top_k=3)
+
+    assert contents(fused) == ["0", "1", "2"]
+    # 只有一路结果时，排名第一的文本段得到满分
+    assert fused[0][1] == pytest.approx(0.0)
+    assert rrf_fuse([[], []], top_k=3) == []
+
+
+def test_search_ranks_keyword_matches(index):
+    results = index.search("劳动报酬", top_k=2)
+    assert contents(results)[0] == "用人单位应当向劳动者支付劳动报酬"
+    assert results[0][0].metadata == {"source": "ld.txt"}
+    assert index.search("不存在的词语", top_k=2) == []
+
+
+def test_search_filters_by_source(index):
+    assert set(contents(index.search("应当", top_k=10, sources=["xk.txt"]))) == {
+        "行政许可的申请人应当如实提交有关材料", "行政机关应当在二十日内作出决定"}
+
+
+def test_search_with_empty_sources_is_empty(index):
+    assert index.search("应当", top_k=10, sources=[]) == []
+    assert len(index.search("应当", top_k=10, sources=iter(["ld.txt"]))) == 2
+
+
+def test_delete_source(index):
+    assert index.count() == 4
+    assert index.delete_source("xk.txt") == 2
+    assert index.count() == 2
+    assert index.search("行政许可", top_k=5) == []
+    assert index.delete_source("xk.txt") == 0
+
+
+def test_update_source_only_changes_modified_chunks(index):
+    added, removed = index.update_source("ld.txt", [doc("劳动合同应当以书面形式订立", "ld.txt"),
+                                                    doc("试用期包含在劳动合同期限内", "ld.txt")])
+    assert (added, removed) == (1, 1)
+    assert index.count() == 4
+    assert contents(index.search("试用期", top_k=5)) == ["试用期包含在劳动合同期限内"]
+    assert "用人单位应当向劳动者支付劳动报酬" not in contents(index.search("劳动报酬", top_k=5))
+    assert index.update_source("ld.txt", [doc("劳动合同应当以书面形式订立", "ld.txt"),
+                                          doc("试用期包含在劳动合同期限内", "ld.txt")]) == (0, 0)
+
+
+def test_concurrent_updates_of_a_source_apply_once(index, monkeypatch):
+    diff_chunks = bm25_index.diff_chunks
+
+    def slow_diff(*args):
+        # 拉长读取与写入之间的间隔，读取和写入不在同一把锁内时各线程都会按旧内容写入
+        time.sleep(0.02)
+        return diff_chunks(*args)
+
+    monkeypatch.setattr(bm25_index, "diff_chunks", slow_diff)
+    new_docs = [doc("劳动合同应当以书面形式订立", "ld.txt"), doc("试用期包含在劳动合同期限内", "ld.txt")]
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(index.update_source("ld.txt", new_docs)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert sorted(results) == [(0, 0), (0, 0), (0, 0), (1, 1)]
+    assert index.count() == 4
+    assert contents(index.search("试用期", top_k=5)) == ["试用期包含在劳动合同期限内"]
+
+
+def test_missing_index_is_empty(tmp_path):
+    index = BM25Index(str(tmp_path / "missing" / "bm25.db"))
+    assert index.search("劳动", top_k=3) == []
+    assert index.count() == 0
+    assert index.delete_source("a.txt") == 0
+    assert not index.exists
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+from langchain.docstore.document import Document
+from langchain.vectorstores import FAISS
+
+from server.knowledge_base.chunk_store import ChunkStore
+from server.knowledge_base.faiss_store import FaissSegmentStore, TOMBSTONE_FILE
+from server.knowledge_base.kb_service import faiss_kb_service
+from server.knowledge_base.kb_service.faiss_kb_service import FaissKBService
+
+
+def make_docs(source: str, n: int):
+    return [Document(page_content=f"{source} 第{i}段", metadata={"source": source, "n": i}) for i in range(n)]
+
+
+@pytest.fixture
+def chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.db"))
+    yield store
+    store.close()
+
+
+def test_count_by_source_follows_adds_and_deletes(chunks):
+    assert not chunks.exists
+    chunks.add(make_docs("a.txt", 3))
+    b_ids = chunks.add(make_docs("b.txt", 2))
+    assert chunks.exists
+    assert chunks.count_by_source() == {"a.txt": 3, "b.txt": 2}
+    assert sorted(chunks.ids_of_source("b.txt")) == b_ids
+
+    chunks.delete_source("b.txt")
+    assert chunks.count_by_source() == {"a.txt": 3}
+    assert chunks.ids_of_source("b.txt") == []
+
+
+def test_delete_removes_single_chunks(chunks):
+    ids = chunks.add(make_docs("a.txt", 3) + make_docs("b.txt", 1))
+    chunks.delete(ids[1:2])
+
+    assert chunks.count_by_source() == {"a.txt": 2, "b.txt": 1}
+    assert sorted(chunks.docs_of_source("a.txt")) == [ids[0], ids[2]]
+    assert chunks.docs_of_source("a.txt")[ids[2]].page_content == "a.txt 第2段"
+
+
+def test_chunks_round_trip_with_metadata(chunks):
+    docs = make_docs("a.txt", 2)
+    ids = chunks.add(docs)
+
+    stored = chunks.get(ids)
+    assert [stored[i].page_content for i in ids] == [d.page_content for d in docs]
+    assert stored[ids[1]].metadata == {"source": "a.txt", "n": 1}
+
+
+def test_store_keeps_chunks_in_step(tmp_path, embeddings):
+    store = FaissSegmentStore(str(tmp_path), embeddings)
+    a_ids = store.add_documents(make_docs("a.txt", 4))
+    store.add_documents(make_docs("b.txt", 2))
+
+    assert sorted(store.chunks.ids_of_source("a.txt")) == sorted(a_ids)
+    store.delete_source("b.txt")
+    assert store.chunks.count_by_source() == {"a.txt": 4}
+
+
+def test_pickled_store_is_converted_once(tmp_path, embeddings):
+    docs = make_docs("a.txt", 3) + make_docs("b.txt", 2)
+    legacy = FAISS.from_documents(docs, embeddings, normalize_L2=True)
+    legacy.save_local(str(tmp_path))
+    removed = [_id for _id, doc in legacy.docstore._dict.items() if doc.page_content == "b.txt 第0段"]
+    (tmp_path / TOMBSTONE_FILE).write_text("".join(f"{i}\n" for i in removed), encoding="utf-8")
+
+    store = FaissSegmentStore.load(str(tmp_path), embeddings)
+
+    assert not os.path.exists(tmp_path / "index.pkl")
+    assert store.tombstones == set()
+    assert store.chunks.count_by_source() == {"a.txt": 3, "b.txt": 1}
+    results = store.similarity_search_with_score("a.txt 第1段", k=5)
+    assert len(results) == 4
+    assert results[0][0].page_content == "a.txt 第1段"
+    assert results[0][0].metadata == {"source": "a.txt", "n": 1}
+
+    reloaded = FaissSegmentStore.load(str(tmp_path), embeddings)
+    assert reloaded.chunks.count_by_source() == {"a.txt": 3, "b.txt": 1}
+
+
+def test_get_reads_more_ids_than_one_statement_allows(chunks):
+    ids = chunks.add([Document(page_content=str(i), metadata={"source": "a.txt"}) for i in range(2000)])
+    stored = chunks.get(reversed(ids))
+    assert len(stored) == 2000
+    assert stored[ids[1500]].page_content == "1500"
+
+
+def test_service_counts_chunks_without_loading_vector_store(tmp_path, embeddings, monkeypatch):
+    monkeypatch.setattr(faiss_kb_service, "KB_ROOT_PATH", str(tmp_path))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("counting chunks must not load the embedding model")
+
+    monkeypatch.setattr(faiss_kb_service, "load_embeddings", fail)
+    kb = FaissKBService(1, "samples")
+    assert kb.count_chunks_by_source() == {}
+
+    os.makedirs(kb.vs_path)
+    store = FaissSegmentStore(kb.vs_path, embeddings)
+    store.add_documents(make_docs("a.txt", 4) + make_docs("b.txt", 1))
+    store.delete_source("b.txt")
+    store.add_documents(make_docs("c.txt", 2))
+    store.chunks.close()
+
+    assert kb.count_chunks_by_source() == {"a.txt": 4, "c.txt": 2}
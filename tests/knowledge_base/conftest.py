@@ -0,0 +1,48 @@
+import pytest
+from sqlalchemy import create_engine
+
+from server.db import base as db_base
+from server.db.base import Base, SessionLocal
+from server.db.models import knowledge_base_model, knowledge_file_model, knowledge_job_model  # noqa: F401
+from server.db.repository.knowledge_base_repository import add_kb_to_db
+from server.knowledge_base import utils
+from server.knowledge_base.kb_service import base, faiss_kb_service
+from server.knowledge_base.kb_service.faiss_kb_service import FaissKBService, refresh_vs_cache
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    将数据库会话绑定到临时的 sqlite 文件，不读写 knowledge_base/info.db
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'info.db'}")
+    Base.metadata.create_all(bind=engine)
+    SessionLocal.configure(bind=engine)
+    yield engine
+    SessionLocal.configure(bind=db_base.engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def kb_root(tmp_path, embeddings, monkeypatch):
+    """
+    知识库目录指向临时目录，嵌入模型换成 FakeEmbeddings
+    """
+    root = tmp_path / "knowledge_base"
+    monkeypatch.setattr(utils, "KB_ROOT_PATH", str(root))
+    monkeypatch.setattr(faiss_kb_service, "KB_ROOT_PATH", str(root))
+    monkeypatch.setattr(faiss_kb_service, "load_embeddings", lambda *args, **kwargs: embeddings)
+    monkeypatch.setattr(base, "load_embeddings", lambda *args, **kwargs: embeddings)
+    return root
+
+
+@pytest.fixture
+def kb(db, kb_root):
+    """
+    临时目录中的 FAISS 知识库，已在数据库中登记
+    """
+    kb = FaissKBService(1, "samples")
+    add_kb_to_db(kb.user_id, kb.kb_name, kb.vs_type(), kb.embed_model, kb.index_type, kb.vector_codec)
+    kb.create_kb()
+    yield kb
+    refresh_vs_cache(kb.user_id, kb.kb_name)
@@ -0,0 +1,71 @@
+import pytest
+from langchain.docstore.document import Document
+
+from server.db.repository.knowledge_file_repository import get_file_detail
+from server.knowledge_base.faiss_store import FaissSegmentStore
+from server.knowledge_base.utils import KnowledgeFile
+
+
+def add_file(kb, embeddings, filename: str, category: str, contents):
+    kb_file = KnowledgeFile(filename, kb.kb_name, kb.user_id, category=category)
+    with open(kb_file.filepath, "w", encoding="utf-8") as f:
+        f.write("\n".join(contents))
+    kb.add_doc(kb_file, [Document(page_content=c, metadata={"source": kb_file.filepath}) for c in contents],
+               embeddings)
+    return kb_file
+
+
+@pytest.fixture
+def files(kb, embeddings):
+    return (add_file(kb, embeddings, "a.txt", "law", ["劳动合同应当以书面形式订立", "用人单位应当支付劳动报酬"]),
+            add_file(kb, embeddings, "b.md", "faq", ["如何申请年假", "试用期多久"]))
+
+
+@pytest.fixture
+def searched(monkeypatch):
+    calls = []
+    search_by_vectors = FaissSegmentStore.search_by_vectors
+
+    def spy(self, vectors, k, score_threshold=None, search_params=None):
+        calls.append(search_params)
+        return search_by_vectors(self, vectors, k, score_threshold, search_params)
+
+    monkeypatch.setattr(FaissSegmentStore, "search_by_vectors", spy)
+    return calls
+
+
+def test_filters_are_pushed_down_as_sources(kb, files, searched):
+    a, _ = files
+    docs = kb.search_docs("年假", top_k=4, score_threshold=4, filters={"categories": ["law"]})
+
+    assert searched[-1]["sources"] == [a.filepath]
+    assert {d.metadata["source"] for d, _ in docs} == {a.filepath}
+
+
+def test_filter_matching_every_file_is_dropped(kb, files, searched):
+    docs = kb.search_docs("年假", top_k=4, score_threshold=4, filters={"file_exts": ["txt", "md"]})
+
+    assert "sources" not in searched[-1]
+    assert len(docs) == 4
+
+
+def test_filter_matching_no_file_skips_the_search(kb, files, searched):
+    assert kb.search_docs("年假", filters={"categories": ["none"]}) == []
+    assert searched == []
+
+
+def test_update_doc_changes_or_keeps_category(kb, files, embeddings, monkeypatch):
+    a, _ = files
+    docs = [Document(page_content="劳动合同应当以书面形式订立", metadata={"source": a.filepath})]
+
+    kb.update_doc(KnowledgeFile("a.txt", kb.kb_name, kb.user_id, category="contract"), docs, embeddings)
+    assert get_file_detail(kb.user_id, kb.kb_name, "a.txt")["category"] == "contract"
+
+    kb.update_doc(KnowledgeFile("a.txt", kb.kb_name, kb.user_id), docs, embeddings)
+    assert get_file_detail(kb.user_id, kb.kb_name, "a.txt")["category"] == "contract"
+
+    # 向量库不支持按文本段更新时先删除再添加，同样保留原分类
+    monkeypatch.setattr(kb, "do_update_doc", lambda *args: None)
+    kb.update_doc(KnowledgeFile("a.txt", kb.kb_name, kb.user_id), docs, embeddings)
+    assert get_file_detail(kb.user_id, kb.kb_name, "a.txt")["category"] == "contract"
+    assert kb.search_docs("劳动合同", top_k=4, score_threshold=4, filters={"categories": ["contract"]})
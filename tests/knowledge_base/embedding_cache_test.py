@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+
+from server.knowledge_base import embedding_cache
+from server.knowledge_base.embedding_cache import CachedEmbeddings, QueryEmbeddingStore, normalize_query
+from server.knowledge_base.kb_cache import CachePool
+
+
+@pytest.fixture(autouse=True)
+def query_pool(tmp_path, monkeypatch):
+    pool = CachePool(max_bytes=1024 ** 2, name="query_embedding", verbose=False)
+    monkeypatch.setattr(embedding_cache, "query_embedding_pool", pool)
+    monkeypatch.setattr(embedding_cache, "query_embedding_store", None)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache"))
+    monkeypatch.setattr(embedding_cache, "_chunk_stores", {})
+    return pool
+
+
+def test_normalize_query():
+    assert normalize_query("  什么是\t行政许可？ \n") == "什么是 行政许可?"
+    assert normalize_query("ＡＢＣ　１２３") == "ABC 123"
+
+
+def test_repeated_queries_are_embedded_once(embeddings, query_pool):
+    cached = CachedEmbeddings(lambda: embeddings, "m3e-base")
+
+    first = cached.embed_query("什么是行政许可？")
+    assert cached.embed_query(" 什么是行政许可？ ") == first
+    assert cached.embed_query("什么是行政许可?") == first
+
+    assert embeddings.queried == ["什么是行政许可?"]
+    stats = query_pool.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_cache_is_keyed_by_embedding_model(embeddings):
+    CachedEmbeddings(lambda: embeddings, "m3e-base").embed_query("你好")
+    CachedEmbeddings(lambda: embeddings, "bge-large-zh").embed_query("你好")
+    assert embeddings.queried == ["你好", "你好"]
+
+
+def test_only_uncached_chunks_are_embedded(embeddings):
+    cached = CachedEmbeddings(lambda: embeddings, "m3e-base")
+    first = cached.embed_documents(["甲", "乙", "甲"])
+    assert embeddings.embedded == ["甲", "乙"]
+
+    embeddings.embedded.clear()
+    second = cached.embed_documents(["乙", "丙", "甲"])
+    assert embeddings.embedded == ["丙"]
+    assert second[0] == pytest.approx(first[1])
+    assert second[2] == pytest.approx(first[0])
+    assert second[1] == pytest.approx(embeddings.embed_documents(["丙"])[0])
+
+
+def test_rebuilding_an_unchanged_corpus_runs_no_forward_pass(embeddings):
+    texts = [f"第{i}段" for i in range(50)]
+    vectors = CachedEmbeddings(lambda: embeddings, "m3e-base").embed_documents(texts)
+    embeddings.embedded.clear()
+
+    np.testing.assert_allclose(CachedEmbeddings(lambda: embeddings, "m3e-base").embed_documents(texts), vectors, rtol=1e-6)
+    assert embeddings.embedded == []
+    # 不同嵌入模型的向量不能共用
+    CachedEmbeddings(lambda: embeddings, "bge-large-zh").embed_documents(texts[:2])
+    assert embeddings.embedded == texts[:2]
+
+
+def test_chunk_cache_can_be_disabled(embeddings, monkeypatch):
+    monkeypatch.setattr(embedding_cache, "CHUNK_EMBEDDING_CACHE", False)
+    cached = CachedEmbeddings(lambda: embeddings, "m3e-base")
+    cached.embed_documents(["甲"])
+    cached.embed_documents(["甲"])
+    assert embeddings.embedded == ["甲", "甲"]
+
+
+def test_batched_queries_use_the_query_cache(embeddings, query_pool):
+    cached = CachedEmbeddings(lambda: embeddings, "m3e-base")
+    single = cached.embed_query("你好")
+
+    vectors = cached.embed_queries([" 你好 ", "什么是行政许可", "什么是行政许可"])
+    assert vectors[0] == pytest.approx(single)
+    assert vectors[1] == vectors[2]
+    assert cached.embed_queries(["什么是行政许可"]) == [vectors[1]]
+    # 查询不写入文本段向量缓存
+    assert embedding_cache.get_chunk_embedding_store("m3e-base").count() == 0
+
+
+def test_persisted_queries_survive_a_restart(tmp_path, embeddings, monkeypatch):
+    store = QueryEmbeddingStore(str(tmp_path / "query_embeddings.db"))
+    monkeypatch.setattr(embedding_cache, "query_embedding_store", store)
+    vector = CachedEmbeddings(lambda: embeddings, "m3e-base").embed_query("你好")
+
+    # 模拟重启：内存缓存清空，向量从磁盘读取，不再调用模型
+    monkeypatch.setattr(embedding_cache, "query_embedding_pool", CachePool(max_bytes=1024 ** 2, verbose=False))
+    assert CachedEmbeddings(lambda: embeddings, "m3e-base").embed_query("你好") == pytest.approx(vector)
+    assert embeddings.queried == ["你好"]
+    assert store.get("bge-large-zh", "你好") is None
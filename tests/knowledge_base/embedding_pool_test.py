@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from server.knowledge_base import onnx_embeddings, utils
+from server.knowledge_base.kb_cache import CachePool
+
+
+def model_dir(path, nbytes: int) -> str:
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "model.bin"), "wb") as f:
+        f.write(b"\0" * nbytes)
+    return str(path)
+
+
+@pytest.fixture
+def pool(tmp_path, embeddings, monkeypatch):
+    pool = CachePool(max_bytes=1500, name="embeddings", on_evict=utils._release_embeddings)
+    monkeypatch.setattr(utils, "embeddings_pool", pool)
+    monkeypatch.setattr(utils, "_create_embeddings", lambda model, device: embeddings)
+    monkeypatch.setitem(utils.embedding_model_dict, "model-a", model_dir(tmp_path / "a", 1000))
+    monkeypatch.setitem(utils.embedding_model_dict, "model-b", model_dir(tmp_path / "b", 1000))
+    monkeypatch.setitem(utils.embedding_model_dict, "model-remote", "org/model-remote")
+    return pool
+
+
+@pytest.fixture
+def onnx_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(onnx_embeddings, "EMBEDDING_CACHE_PATH", str(tmp_path / "embedding_cache"))
+    monkeypatch.setitem(utils.embedding_model_dict, "model-onnx",
+                        {"model_path": str(tmp_path / "model-onnx"), "backend": "onnx"})
+    return "model-onnx"
+
+
+def test_models_without_parameters_are_sized_by_their_files(pool):
+    utils.get_embedding_model("model-a", "cpu")
+    assert pool.stats()["resident_bytes"] == 1000
+
+    pool.clear()
+    utils.get_embedding_model("model-remote", "cpu")
+    assert pool.stats()["resident_bytes"] == utils.DEFAULT_EMBEDDING_NBYTES
+
+
+def test_pool_evicts_and_closes_the_least_recently_used_model(pool):
+    a = utils.get_embedding_model("model-a", "cpu")
+    a.embed_query("预热")  # 启动后台线程
+    b = utils.get_embedding_model("model-b", "cpu")
+
+    assert [key for key, _ in pool.items()] == [("model-b", "cpu")]
+    assert a._closed and not b._closed
+    assert pool.stats()["evictions"] == 1
+    assert utils.get_embedding_model("model-a", "cpu") is not a
+
+
+def test_onnx_model_that_is_not_exported_fails_fast(onnx_model, monkeypatch):
+    def export_onnx(*args):
+        raise AssertionError("export must not run at request time")
+
+    monkeypatch.setattr(onnx_embeddings, "export_onnx", export_onnx)
+    with pytest.raises(RuntimeError, match="--export-onnx"):
+        utils._create_embeddings(onnx_model, "cpu")
+
+
+def test_preload_exports_onnx_models(onnx_model, monkeypatch):
+    exported, loaded = [], []
+    monkeypatch.setattr(onnx_embeddings, "export_onnx", lambda model, *args: exported.append(model))
+    monkeypatch.setattr(utils, "get_embedding_model", lambda model, device: loaded.append(model))
+    monkeypatch.setattr(utils, "EMBEDDING_PRELOAD", [onnx_model, "m3e-base"])
+
+    utils.preload_embeddings()
+    assert exported == [onnx_model]
+    assert loaded == [onnx_model, "m3e-base"]
+
+
+def test_onnx_export_matches_the_torch_model(tmp_path, onnx_model, monkeypatch):
+    pytest.importorskip("onnxruntime")
+    pytest.importorskip("onnx")
+    torch = pytest.importorskip("torch")
+    st = pytest.importorskip("sentence_transformers")
+    from transformers import BertConfig, BertModel, BertTokenizer
+
+    # 随机初始化的小模型，不需要下载
+    bert_path = tmp_path / "bert"
+    bert_path.mkdir()
+    chars = sorted(set("".join(onnx_embeddings._CHECK_SENTENCES).lower()))
+    with open(bert_path / "vocab.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + chars))
+    BertTokenizer(str(bert_path / "vocab.txt")).save_pretrained(str(bert_path))
+    torch.manual_seed(0)
+    BertModel(BertConfig(vocab_size=5 + len(chars), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                         intermediate_size=64)).save_pretrained(str(bert_path))
+    transformer = st.models.Transformer(str(bert_path), max_seq_length=64)
+    model_path = tmp_path / "model-onnx"
+    st.SentenceTransformer(modules=[transformer, st.models.Pooling(32), st.models.Normalize()]).save(str(model_path))
+
+    info = utils.export_onnx_embeddings(onnx_model)
+    assert info["min_cosine"] >= onnx_embeddings.ONNX_TOLERANCE["fp32"]
+    assert (info["pooling_mode"], info["normalize"]) == ("mean", True)
+    assert isinstance(utils._create_embeddings(onnx_model, "cpu"), onnx_embeddings.OnnxEmbeddings)
+    # 已导出时不再重新导出
+    monkeypatch.setattr(onnx_embeddings, "export_onnx", lambda *args: pytest.fail("exported twice"))
+    assert utils.export_onnx_embeddings(onnx_model) == info
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+from server.knowledge_base.embedding_worker import BatchingEmbeddings
+
+
+class RecordingEmbeddings:
+    """
+    文本段向量为 [长度, 0]，查询向量为 [长度, 1]；记录每次调用，gate 未打开时第一次调用阻塞，
+    用来在后台线程忙碌时向队列中堆积请求
+    """
+
+    def __init__(self, fail_on: str = None):
+        self.calls = []
+        self.fail_on = fail_on
+        self.gate = threading.Event()
+        self.gate.set()
+        self.entered = threading.Event()
+
+    def _wait(self):
+        self.entered.set()
+        self.gate.wait(5)
+
+    def embed_documents(self, texts):
+        self._wait()
+        self.calls.append(("documents", list(texts)))
+        if self.fail_on in texts:
+            raise ValueError(f"cannot embed {self.fail_on}")
+        return [[float(len(t)), 0.0] for t in texts]
+
+    def embed_query(self, text):
+        self._wait()
+        self.calls.append(("query", [text]))
+        return [float(len(text)), 1.0]
+
+
+def hold(model: RecordingEmbeddings, worker: BatchingEmbeddings):
+    """
+    提交一个请求并让后台线程阻塞在这次计算中
+    """
+    model.gate.clear()
+    future = worker.submit(["占位", "占位"])
+    assert model.entered.wait(5)
+    return future
+
+
+def test_full_batch_is_computed_without_waiting():
+    worker = BatchingEmbeddings(RecordingEmbeddings(), max_batch_size=4, max_wait=10)
+    start = time.perf_counter()
+    assert worker.embed_documents(["a", "bb", "ccc", "dddd"]) == [[1, 0], [2, 0], [3, 0], [4, 0]]
+    assert time.perf_counter() - start < 5
+    worker.close()
+
+
+def test_partial_batch_is_computed_at_the_deadline():
+    worker = BatchingEmbeddings(RecordingEmbeddings(), max_batch_size=100, max_wait=0.05)
+    start = time.perf_counter()
+    assert worker.embed_documents(["a"]) == [[1, 0]]
+    assert 0.05 <= time.perf_counter() - start < 5
+    worker.close()
+
+
+def test_queries_go_first_through_the_query_interface():
+    model = RecordingEmbeddings()
+    worker = BatchingEmbeddings(model, max_batch_size=2, max_wait=0.01)
+    held = hold(model, worker)
+    documents = worker.submit(["甲", "乙乙", "丙丙丙", "丁"])
+    query = worker.submit(["问题"], is_query=True)
+    model.gate.set()
+
+    assert query.result(5) == [[2.0, 1.0]]
+    assert documents.result(5) == [[1, 0], [2, 0], [3, 0], [1, 0]]
+    held.result(5)
+    # 查询单独成批，文本段较多的请求拆分为多个批次
+    assert model.calls == [("documents", ["占位", "占位"]),
+                           ("query", ["问题"]),
+                           ("documents", ["甲", "乙乙"]),
+                           ("documents", ["丙丙丙", "丁"])]
+    assert worker.stats()["batches"] == 4
+    worker.close()
+
+
+def test_query_batches_use_embed_queries():
+    model = RecordingEmbeddings()
+    model.embed_queries = lambda texts: [[float(len(t)), 2.0] for t in texts]
+    worker = BatchingEmbeddings(model, max_batch_size=2, max_wait=0.01)
+    assert worker.embed_queries(["a", "bb"]) == [[1, 2], [2, 2]]
+    assert worker.embed_query("ccc") == [3, 2]
+    assert model.calls == []
+    worker.close()
+
+
+def test_failed_batch_only_fails_its_requests():
+    model = RecordingEmbeddings(fail_on="坏")
+    worker = BatchingEmbeddings(model, max_batch_size=2, max_wait=0.01)
+    held = hold(model, worker)
+    bad = worker.submit(["坏", "好"])
+    good = worker.submit(["好", "好"])
+    model.gate.set()
+
+    with pytest.raises(ValueError):
+        bad.result(5)
+    assert good.result(5) == [[1, 0], [1, 0]]
+    held.result(5)
+    # 后台线程继续处理之后的请求
+    assert worker.embed_documents(["好"]) == [[1, 0]]
+    worker.close()
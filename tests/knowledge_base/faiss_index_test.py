@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+from server.knowledge_base import faiss_store
+from server.knowledge_base.faiss_store import FaissSegmentStore, _normalize, index_layout
+from server.knowledge_base.kb_api import create_kb
+
+
+def make_docs(source: str, n: int):
+    return [Document(page_content=f"{source} 第{i}段", metadata={"source": source}) for i in range(n)]
+
+
+def base_index(store: FaissSegmentStore):
+    assert store.segments[0][0] == store.base_name
+    return store.segments[0][1]
+
+
+@pytest.fixture
+def small_ivf(monkeypatch):
+    # 测试语料很小，降低训练门槛
+    monkeypatch.setitem(faiss_store.FAISS_INDEX_TYPES["ivf_flat"], "min_train_size", 200)
+
+
+def test_ivf_stays_flat_until_it_can_be_trained(tmp_path, embeddings, small_ivf):
+    store = FaissSegmentStore(str(tmp_path), embeddings, "ivf_flat")
+    store.add_documents(make_docs("a.txt", 100))
+    store.merge()
+    assert index_layout(base_index(store)) == ("flat", "none")
+
+    store.add_documents(make_docs("b.txt", 100))
+    store.merge()
+    assert index_layout(base_index(store)) == ("ivf_flat", "none")
+    results = store.similarity_search_with_score("b.txt 第7段", k=3, search_params={"nprobe": 5})
+    assert results[0][0].page_content == "b.txt 第7段"
+
+
+def test_ivf_is_retrained_when_the_corpus_quadruples(tmp_path, embeddings, small_ivf):
+    import faiss
+    store = FaissSegmentStore(str(tmp_path), embeddings, "ivf_flat")
+    store.add_documents(make_docs("a.txt", 200))
+    store.merge()
+    first = faiss.downcast_index(base_index(store).index)
+    assert first.nlist == 5
+
+    # 300 个向量时自动选择的 nlist 为 7，不到原来的两倍，直接追加
+    store.add_documents(make_docs("b.txt", 100))
+    store.merge()
+    assert faiss.downcast_index(base_index(store).index).nlist == 5
+
+    store.add_documents(make_docs("c.txt", 100))
+    store.merge()
+    retrained = faiss.downcast_index(base_index(store).index)
+    assert retrained.nlist == 10
+    assert base_index(store).ntotal == 400
+
+
+def test_hnsw_is_rebuilt_without_deleted_vectors(tmp_path, embeddings):
+    store = FaissSegmentStore(str(tmp_path), embeddings, "hnsw")
+    store.add_documents(make_docs("a.txt", 20))
+    store.add_documents(make_docs("b.txt", 20))
+    store.merge()
+    assert index_layout(base_index(store)) == ("hnsw", "none")
+
+    store.delete_source("a.txt")
+    store.merge()
+
+    assert index_layout(base_index(store)) == ("hnsw", "none")
+    assert base_index(store).ntotal == 20
+    assert store.tombstones == set()
+    results = store.similarity_search_with_score("a.txt 第3段", k=40)
+    assert {doc.metadata["source"] for doc, _ in results} == {"b.txt"}
+
+
+def test_pq_falls_back_to_sq8_until_it_can_be_trained(tmp_path, embeddings, monkeypatch):
+    monkeypatch.setitem(faiss_store.FAISS_VECTOR_CODECS["pq"], "min_train_size", 300)
+    monkeypatch.setitem(faiss_store.FAISS_VECTOR_CODECS["pq"], "m", 8)
+    monkeypatch.setitem(faiss_store.FAISS_VECTOR_CODECS["pq"], "nbits", 4)
+    store = FaissSegmentStore(str(tmp_path), embeddings, "flat", "pq")
+    store.add_documents(make_docs("a.txt", 100))
+    store.merge()
+    assert index_layout(base_index(store)) == ("flat", "sq8")
+
+    store.add_documents(make_docs("b.txt", 200))
+    store.merge()
+    assert index_layout(base_index(store)) == ("flat", "pq")
+    assert store.similarity_search_with_score("b.txt 第5段", k=1)[0][0].page_content == "b.txt 第5段"
+
+
+def test_lossy_results_are_reranked_with_raw_vectors(tmp_path, embeddings, monkeypatch):
+    docs = make_docs("a.txt", 50)
+    store = FaissSegmentStore(str(tmp_path), embeddings, "flat", "sq8")
+    ids = store.add_documents(docs)
+    store.merge()
+    assert index_layout(base_index(store)) == ("flat", "sq8")
+
+    raw = _normalize(embeddings.embed_documents([d.page_content for d in docs]))
+    stored = store.chunks.get_vectors(ids)
+    np.testing.assert_allclose(stored[ids[7]], raw[7], rtol=1e-6)
+
+    query = _normalize([embeddings.embed_query("a.txt 第7段")])[0]
+    exact = np.sum((raw - query) ** 2, axis=1)
+    expected = np.argsort(exact)[:5]
+
+    results = store.similarity_search_with_score("a.txt 第7段", k=5)
+    assert [d.page_content for d, _ in results] == [docs[i].page_content for i in expected]
+    assert [s for _, s in results] == pytest.approx(exact[expected].tolist(), abs=1e-5)
+
+    # 不重排时返回的是压缩向量的近似距离
+    monkeypatch.setattr(faiss_store, "FAISS_RERANK_FACTOR", 0)
+    approx = store.similarity_search_with_score("a.txt 第7段", k=5)
+    assert [s for _, s in approx] != pytest.approx(exact[expected].tolist(), abs=1e-5)
+
+
+@pytest.mark.parametrize("index_type, vector_codec", [("annoy", "none"), ("flat", "int4")])
+def test_create_kb_rejects_unknown_index_options(index_type, vector_codec):
+    response = asyncio.run(create_kb("samples", "faiss", "m3e-base", index_type, vector_codec,
+                                     current_user=SimpleNamespace(user_id=1)))
+    assert response.code == 400
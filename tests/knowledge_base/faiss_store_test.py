@@ -0,0 +1,221 @@
+import os
+import time
+
+import pytest
+from langchain.docstore.document import Document
+
+from server.knowledge_base import faiss_store
+from server.knowledge_base.faiss_store import FaissSegmentStore, read_manifest, read_tombstones
+
+
+def make_docs(source: str, n: int):
+    return [Document(page_content=f"{source} 第{i}段", metadata={"source": source}) for i in range(n)]
+
+
+def sources_of(results):
+    return {doc.metadata["source"] for doc, _ in results}
+
+
+@pytest.fixture
+def store(tmp_path, embeddings):
+    return FaissSegmentStore(str(tmp_path), embeddings)
+
+
+def test_each_add_writes_one_delta_segment(store, tmp_path):
+    store.add_documents(make_docs("a.txt", 3))
+    store.add_documents(make_docs("b.txt", 2))
+
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["base"] is None
+    assert len(manifest["deltas"]) == 2
+    assert all(os.path.isfile(tmp_path / f"{name}.faiss") for name in manifest["deltas"])
+
+    doc, score = store.similarity_search_with_score("b.txt 第1段", k=1)[0]
+    assert doc.page_content == "b.txt 第1段"
+    assert score == pytest.approx(0, abs=1e-5)
+
+
+def test_deleted_source_is_hidden_by_tombstones(store, tmp_path, embeddings):
+    ids = store.add_documents(make_docs("a.txt", 3))
+    store.add_documents(make_docs("b.txt", 3))
+
+    assert store.delete_source("a.txt") == 3
+    # 删除只追加墓碑，不改写已有的段
+    assert len(read_manifest(str(tmp_path))["deltas"]) == 2
+    assert read_tombstones(str(tmp_path)) == {str(i) for i in ids}
+    assert sources_of(store.similarity_search_with_score("a.txt 第0段", k=6)) == {"b.txt"}
+
+    reloaded = FaissSegmentStore.load(str(tmp_path), embeddings)
+    assert sources_of(reloaded.similarity_search_with_score("a.txt 第0段", k=6)) == {"b.txt"}
+    assert store.delete_source("a.txt") == 0
+
+
+def test_delete_chunks_removes_vectors_and_text(store, tmp_path, embeddings):
+    ids = store.add_documents(make_docs("a.txt", 4))
+    store.delete_chunks(ids[:2])
+
+    assert store.chunks.count_by_source() == {"a.txt": 2}
+    results = FaissSegmentStore.load(str(tmp_path), embeddings).similarity_search_with_score("a.txt 第0段", k=4)
+    assert sorted(d.page_content for d, _ in results) == ["a.txt 第2段", "a.txt 第3段"]
+
+
+def test_tombstones_only_widen_the_search_of_their_segment(store, monkeypatch):
+    ids = store.add_documents(make_docs("a.txt", 10))
+    store.add_documents(make_docs("b.txt", 10))
+    store.delete(ids[:6])
+    fetched = []
+    search_segment = store._search_segment
+
+    def spy(seg, vectors, k, *args):
+        fetched.append((seg.ntotal, k))
+        return search_segment(seg, vectors, k, *args)
+
+    monkeypatch.setattr(store, "_search_segment", spy)
+    results = store.similarity_search_with_score("a.txt 第8段", k=3)
+
+    assert fetched == [(10, 9), (10, 3)]
+    assert results[0][0].page_content == "a.txt 第8段"
+
+    fetched.clear()
+    store.similarity_search_with_score("a.txt 第8段", k=8)
+    assert fetched == [(10, 10), (10, 8)]
+
+
+def test_merge_starts_in_background_after_enough_tombstones(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_store, "FAISS_MERGE_TOMBSTONES", 4)
+    store.add_documents(make_docs("a.txt", 3))
+    store.add_documents(make_docs("b.txt", 3))
+    store.delete_source("a.txt")
+    assert read_manifest(str(tmp_path))["base"] is None
+
+    store.delete_source("b.txt")
+    deadline = time.time() + 10
+    while read_tombstones(str(tmp_path)) and time.time() < deadline:
+        time.sleep(0.05)
+    assert read_tombstones(str(tmp_path)) == set()
+    assert store.tombstones == set()
+    assert read_manifest(str(tmp_path))["deltas"] == []
+
+
+def test_merge_folds_deltas_into_base_and_drops_tombstones(store, tmp_path, embeddings):
+    for source in ("a.txt", "b.txt", "c.txt"):
+        store.add_documents(make_docs(source, 4))
+    store.delete_source("b.txt")
+    old_deltas = read_manifest(str(tmp_path))["deltas"]
+
+    store.merge()
+
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["base"] is not None
+    assert manifest["deltas"] == []
+    assert read_tombstones(str(tmp_path)) == set()
+    assert not any(os.path.isfile(tmp_path / f"{name}.faiss") for name in old_deltas)
+    assert store.segments[0][1].ntotal == 8
+    assert store.tombstones == set()
+
+    reloaded = FaissSegmentStore.load(str(tmp_path), embeddings)
+    results = reloaded.similarity_search_with_score("c.txt 第2段", k=12)
+    assert len(results) == 8
+    assert sources_of(results) == {"a.txt", "c.txt"}
+    assert results[0][0].page_content == "c.txt 第2段"
+
+
+def test_adds_after_merge_go_to_new_deltas(store, tmp_path):
+    store.add_documents(make_docs("a.txt", 2))
+    store.add_documents(make_docs("d.txt", 1))
+    store.merge()
+    base = read_manifest(str(tmp_path))["base"]
+
+    store.add_documents(make_docs("b.txt", 2))
+    ids = store.add_documents(make_docs("c.txt", 2))
+    store.delete(ids[:1])
+
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["base"] == base
+    assert len(manifest["deltas"]) == 2
+    results = store.similarity_search_with_score("c.txt 第0段", k=7)
+    assert len(results) == 6
+    assert "c.txt 第0段" not in {doc.page_content for doc, _ in results}
+
+
+def test_merge_starts_in_background_after_enough_deltas(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_store, "FAISS_MERGE_DELTAS", 3)
+    for source in ("a.txt", "b.txt", "c.txt"):
+        store.add_documents(make_docs(source, 2))
+
+    deadline = time.time() + 10
+    while read_manifest(str(tmp_path))["deltas"] and time.time() < deadline:
+        time.sleep(0.05)
+    manifest = read_manifest(str(tmp_path))
+    assert manifest["base"] is not None
+    assert manifest["deltas"] == []
+    assert len(store.similarity_search_with_score("a.txt 第0段", k=10)) == 6
+
+
+def test_memory_mapped_segments_are_searchable_and_not_counted(tmp_path, embeddings, monkeypatch):
+    monkeypatch.setattr(faiss_store, "FAISS_MMAP_LOAD", True)
+    writer = FaissSegmentStore(str(tmp_path), embeddings)
+    writer.add_documents(make_docs("a.txt", 3))
+    writer.add_documents(make_docs("b.txt", 3))
+
+    store = FaissSegmentStore.load(str(tmp_path), embeddings)
+    assert store.mmap
+    assert store.similarity_search_with_score("b.txt 第2段", k=1)[0][0].page_content == "b.txt 第2段"
+    # 内存映射的索引文件不计入常驻内存
+    index_bytes = sum(os.path.getsize(tmp_path / f"{name}.faiss") for name, _ in store.segments)
+    monkeypatch.setattr(faiss_store, "FAISS_MMAP_LOAD", False)
+    assert store.nbytes() == FaissSegmentStore.load(str(tmp_path), embeddings).nbytes() - index_bytes
+
+    store.delete_source("a.txt")
+    store.merge()
+    results = FaissSegmentStore.load(str(tmp_path), embeddings).similarity_search_with_score("a.txt 第0段", k=6)
+    assert sources_of(results) == {"b.txt"}
+
+
+def test_store_notices_writes_from_other_instances(tmp_path, embeddings):
+    writer = FaissSegmentStore(str(tmp_path), embeddings)
+    writer.add_documents(make_docs("a.txt", 2))
+    reader = FaissSegmentStore.load(str(tmp_path), embeddings)
+    assert not reader.is_stale()
+
+    time.sleep(0.01)
+    writer.add_documents(make_docs("b.txt", 2))
+    assert reader.is_stale()
+    assert not writer.is_stale()
+    assert not FaissSegmentStore.load(str(tmp_path), embeddings).is_stale()
+
+
+def test_store_size_does_not_depend_on_chunk_text(tmp_path, embeddings):
+    short = FaissSegmentStore(str(tmp_path / "short"), embeddings)
+    long = FaissSegmentStore(str(tmp_path / "long"), embeddings)
+    short.add_documents([Document(page_content=f"第{i}段", metadata={"source": "a.txt"}) for i in range(20)])
+    long.add_documents([Document(page_content=f"第{i}段" + "内容" * 2000, metadata={"source": "a.txt"})
+                        for i in range(20)])
+
+    # 文本段保存在 chunks.db 中，缓存池只按向量索引的大小计算
+    assert short.nbytes() > 0
+    assert short.nbytes() == long.nbytes()
+
+
+def test_batch_search_matches_single_queries(store):
+    for source in ("a.txt", "b.txt", "c.txt"):
+        store.add_documents(make_docs(source, 5))
+    store.delete_source("b.txt")
+    queries = ["c.txt 第3段", "a.txt 第0段", "b.txt 第1段"]
+
+    batch = store.similarity_search_with_score_batch(queries, k=3)
+
+    assert len(batch) == len(queries)
+    for query, results in zip(queries, batch):
+        single = store.similarity_search_with_score(query, k=3)
+        assert [d.page_content for d, _ in results] == [d.page_content for d, _ in single]
+        assert [s for _, s in results] == pytest.approx([s for _, s in single], abs=1e-5)
+    assert batch[0][0][0].page_content == "c.txt 第3段"
+    assert "b.txt" not in sources_of(batch[2])
+    assert store.similarity_search_with_score_batch([], k=3) == []
+
+
+def test_batch_search_applies_score_threshold_per_query(store):
+    store.add_documents(make_docs("a.txt", 5))
+    results = store.similarity_search_with_score_batch(["a.txt 第1段", "a.txt 第2段"], k=5, score_threshold=1e-3)
+    assert [[d.page_content for d, _ in row] for row in results] == [["a.txt 第1段"], ["a.txt 第2段"]]
@@ -0,0 +1,159 @@
+import os
+
+import pytest
+from langchain.docstore.document import Document
+
+from server.knowledge_base import ingest
+from server.knowledge_base.faiss_store import read_manifest
+from server.knowledge_base.ingest import PrecomputedEmbeddings, ingest_files, ingest_files_batch
+from server.knowledge_base.migrate import folder2db
+from server.knowledge_base.utils import KnowledgeFile, get_doc_path
+
+
+def load_lines(filename, kb_name, user_id):
+    """
+    按行切分文件，不依赖文档加载器和分词模型；文件名含 broken 时读取失败。
+    定义在模块级以便在入库子进程中使用，文件目录由环境变量传入
+    """
+    if "broken" in filename:
+        raise ValueError("无法读取文件")
+    path = os.path.join(os.environ["INGEST_TEST_DOC_PATH"], filename)
+    with open(path, encoding="utf-8") as f:
+        lines = [line for line in f.read().splitlines() if line]
+    return [Document(page_content=line, metadata={"source": path, "pid": os.getpid()}) for line in lines], "lines", 0.0
+
+
+@pytest.fixture(autouse=True)
+def fake_loader(kb, monkeypatch):
+    monkeypatch.setenv("INGEST_TEST_DOC_PATH", get_doc_path(kb.user_id, kb.kb_name))
+    monkeypatch.setattr(ingest, "_load_file", load_lines)
+
+
+def write_file(kb, filename: str, lines):
+    path = KnowledgeFile(filename, kb.kb_name, kb.user_id).filepath
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return filename
+
+
+def test_batch_is_written_as_one_segment(kb):
+    files = [write_file(kb, f"{i}.txt", [f"文件{i} 第{j}段" for j in range(3)]) for i in range(4)]
+    files.append(write_file(kb, "broken.txt", ["无法读取"]))
+
+    statuses = list(ingest_files_batch(kb, files, category="法规", workers=1))
+
+    assert [s["doc"] for s in statuses[:-1]] == files
+    assert [s["status"] for s in statuses[:-1]] == ["embedded"] * 4 + ["failed"]
+    result = statuses[-1]
+    assert (result["status"], result["files"], result["chunks"]) == ("committed", 4, 12)
+    assert result["stats"]["write"]["files"] == 4
+    # 所有文件的文本段写入同一个增量段，文件信息一次写入数据库
+    assert len(read_manifest(kb.vs_path)["deltas"]) == 1
+    assert sorted(kb.list_docs()) == files[:4]
+    assert kb.count_chunks_by_source()[KnowledgeFile("2.txt", kb.kb_name, kb.user_id).filepath] == 3
+
+
+def test_batch_replace_drops_old_chunks(kb):
+    files = [write_file(kb, "a.txt", ["甲", "乙"]), write_file(kb, "b.txt", ["丙"])]
+    list(ingest_files_batch(kb, files, workers=1))
+
+    write_file(kb, "a.txt", ["甲", "乙", "丁"])
+    result = list(ingest_files_batch(kb, ["a.txt"], replace=True, workers=1))[-1]
+
+    assert result["status"] == "committed"
+    counts = kb.count_chunks_by_source()
+    assert counts[KnowledgeFile("a.txt", kb.kb_name, kb.user_id).filepath] == 3
+    assert counts[KnowledgeFile("b.txt", kb.kb_name, kb.user_id).filepath] == 1
+    assert sorted(kb.list_docs()) == ["a.txt", "b.txt"]
+
+
+def test_callbacks_receive_the_stats_so_far(kb):
+    files = [write_file(kb, f"{i}.txt", [f"文件{i} 第{j}段" for j in range(2)]) for i in range(3)]
+    before, after = [], []
+
+    result = ingest_files(kb, files, workers=1,
+                          callback_before=lambda kb_file, i, filenames: before.append(kb_file.filename),
+                          callback_after=lambda kb_file, i, filenames, stats: after.append(stats))
+
+    assert before == files
+    assert [stats["write"]["files"] for stats in after] == [1, 2, 3]
+    assert [stats["write"]["chunks"] for stats in after] == [2, 4, 6]
+    assert after[-1]["load"]["files"] == 3
+    assert result["write"]["files"] == 3 and result["failed"] == []
+
+
+def test_failed_files_are_skipped_and_reported(kb, monkeypatch):
+    files = [write_file(kb, "a.txt", ["甲"]), write_file(kb, "broken.txt", ["乙"]),
+             write_file(kb, "bad.txt", ["丙"]), write_file(kb, "c.txt", ["丁"])]
+    add_doc = kb.add_doc
+
+    def failing_add_doc(kb_file, *args):
+        if kb_file.filename == "bad.txt":
+            raise IOError("磁盘已满")
+        return add_doc(kb_file, *args)
+
+    monkeypatch.setattr(kb, "add_doc", failing_add_doc)
+    errors, after = [], []
+    result = ingest_files(kb, files, workers=1,
+                          callback_after=lambda kb_file, i, filenames: after.append(kb_file.filename),
+                          callback_error=lambda kb_file, i, filenames, e: errors.append((kb_file.filename, str(e))))
+
+    assert result["failed"] == ["broken.txt", "bad.txt"]
+    assert errors == [("broken.txt", "无法读取文件"), ("bad.txt", "磁盘已满")]
+    assert after == ["a.txt", "c.txt"]
+    assert sorted(kb.list_docs()) == ["a.txt", "c.txt"]
+
+
+def test_folder2db_reports_failed_files(kb):
+    write_file(kb, "a.txt", ["甲"])
+    write_file(kb, "broken.txt", ["乙"])
+    errors = []
+
+    stats = folder2db(kb.user_id, kb.kb_name, "increament",
+                      callback_error=lambda kb_file, i, docs, e: errors.append(kb_file.filename))
+
+    assert stats["failed"] == ["broken.txt"] and errors == ["broken.txt"]
+    assert kb.list_docs() == ["a.txt"]
+
+
+def test_files_are_loaded_in_worker_processes(kb):
+    files = [write_file(kb, f"{i}.txt", [f"文件{i} 第{j}段" for j in range(2)]) for i in range(3)]
+
+    result = ingest_files(kb, files, workers=2)
+
+    assert result["write"]["files"] == 3 and result["failed"] == []
+    chunks = kb.load_vector_store().chunks
+    pids = {doc.metadata["pid"] for f in files
+            for doc in chunks.docs_of_source(KnowledgeFile(f, kb.kb_name, kb.user_id).filepath).values()}
+    assert pids and os.getpid() not in pids
+
+
+def test_loading_runs_at_most_two_queues_ahead_of_writing(kb, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_QUEUE_SIZE", 2)
+    loaded = []
+
+    def counting_load(*args):
+        loaded.append(args[0])
+        return load_lines(*args)
+
+    monkeypatch.setattr(ingest, "_load_file", counting_load)
+    files = [write_file(kb, f"{i}.txt", [f"文件{i}"]) for i in range(10)]
+    loaded_at_write = []
+
+    ingest_files(kb, files, workers=1, callback_before=lambda *args: loaded_at_write.append(len(loaded)))
+
+    # 写入第 k 个文件时，最多再有向量化与读取两个队列各 2 个文件已提交
+    assert all(n <= k + 5 for k, n in enumerate(loaded_at_write))
+    assert loaded_at_write[0] < 10
+    assert len(loaded) == 10 and len(loaded_at_write) == 10
+
+
+def test_precomputed_embeddings_fall_back_to_the_model(embeddings):
+    precomputed = PrecomputedEmbeddings(["甲", "乙"], [[1.0], [2.0]], embeddings)
+
+    assert precomputed.embed_documents(["乙", "甲"]) == [[2.0], [1.0]]
+    assert embeddings.embedded == []
+    # 有未计算过的文本时整批交给原模型
+    assert precomputed.embed_documents(["甲", "丙"]) == embeddings.embed_documents(["甲", "丙"])
+    assert embeddings.embedded[:2] == ["甲", "丙"]
+    assert precomputed.embed_query("丁") == embeddings.embed_query("丁")
@@ -0,0 +1,199 @@
+import threading
+import time
+
+import pytest
+from langchain.docstore.document import Document
+
+from server.db.repository.knowledge_job_repository import (add_job_to_db, claim_job, finish_job, get_job_detail,
+                                                           heartbeat_job, requeue_stale_jobs, update_job_progress)
+from server.knowledge_base import job_queue
+from server.knowledge_base.utils import KnowledgeFile
+
+
+pytestmark = pytest.mark.usefixtures("db")
+
+
+def test_jobs_are_claimed_in_order():
+    first = add_job_to_db(1, "kb_a", "a.txt")
+    second = add_job_to_db(1, "kb_b", "b.txt")
+
+    job = claim_job("w1")
+    assert (job["job_id"], job["status"]) == (first, "running")
+    assert claim_job("w2")["job_id"] == second
+    assert claim_job("w3") is None
+
+
+def test_one_running_job_per_knowledge_base():
+    first = add_job_to_db(1, "kb_a", "a.txt")
+    second = add_job_to_db(1, "kb_a", "b.txt")
+    other_user = add_job_to_db(2, "kb_a", "c.txt")
+
+    assert claim_job("w1")["job_id"] == first
+    # kb_a 已有任务在处理，跳过同一知识库的后续任务
+    assert claim_job("w2")["job_id"] == other_user
+    assert claim_job("w3") is None
+
+    finish_job(first, True, "done")
+    assert claim_job("w3")["job_id"] == second
+
+
+def test_progress_and_finish_are_reported():
+    job_id = add_job_to_db(1, "kb_a", "a.txt", "法规")
+    claim_job("w1")
+    update_job_progress(job_id, 0.5, "向量化 5/10 个文本段")
+    assert (get_job_detail(1, job_id)["progress"], get_job_detail(1, job_id)["message"]) == \
+           (0.5, "向量化 5/10 个文本段")
+    assert get_job_detail(2, job_id) == {}
+
+    finish_job(job_id, False, "ValueError: bad file")
+    job = get_job_detail(1, job_id)
+    assert (job["status"], job["progress"], job["category"]) == ("failed", 0.5, "法规")
+    assert job["end_time"] is not None
+
+
+def test_only_jobs_without_heartbeat_are_requeued():
+    stale = add_job_to_db(1, "kb_a", "a.txt")
+    alive = add_job_to_db(1, "kb_b", "b.txt")
+    stale_worker = claim_job("w1")["worker"]
+    alive_worker = claim_job("w2")["worker"]
+    update_job_progress(stale, 0.5, "向量化", worker=stale_worker)
+
+    time.sleep(0.2)
+    assert heartbeat_job(alive, alive_worker)
+    assert requeue_stale_jobs(0.1) == 1
+
+    assert (get_job_detail(1, stale)["status"], get_job_detail(1, stale)["progress"]) == ("pending", 0.0)
+    assert get_job_detail(1, alive)["status"] == "running"
+    assert claim_job("w3")["job_id"] == stale
+
+
+def test_requeued_job_no_longer_belongs_to_its_old_worker():
+    job_id = add_job_to_db(1, "kb_a", "a.txt")
+    old_worker = claim_job("w1")["worker"]
+    requeue_stale_jobs(-1)
+    new_worker = claim_job("w2")["worker"]
+
+    # 原工作进程不能再更新进度、心跳或结束任务
+    assert not update_job_progress(job_id, 0.9, "写入向量库", worker=old_worker)
+    assert not heartbeat_job(job_id, old_worker)
+    assert not finish_job(job_id, False, "failed", worker=old_worker)
+    assert get_job_detail(1, job_id)["status"] == "running"
+
+    assert finish_job(job_id, True, "done", worker=new_worker)
+    assert (get_job_detail(1, job_id)["status"], get_job_detail(1, job_id)["progress"]) == ("success", 1.0)
+
+
+@pytest.fixture
+def worker_env(kb, monkeypatch):
+    """
+    工作进程在测试进程的线程中运行，按行切分文件；split_delay 为切分每个文件的耗时，running 记录同时处理中的文件
+    """
+    env = {"split_delay": 0.0, "running": [], "max_running": 0}
+    lock = threading.Lock()
+
+    def file2text(self, *args, **kwargs):
+        with lock:
+            env["running"].append(self.filename)
+            env["max_running"] = max(env["max_running"], len(env["running"]))
+        time.sleep(env["split_delay"])
+        with lock:
+            env["running"].remove(self.filename)
+        with open(self.filepath, encoding="utf-8") as f:
+            return [Document(page_content=line, metadata={"source": self.filepath}) for line in f.read().splitlines()]
+
+    monkeypatch.setattr(KnowledgeFile, "file2text", file2text)
+    monkeypatch.setattr(job_queue, "preload_text_splitters", lambda: None)
+    monkeypatch.setattr(job_queue, "JOB_POLL_INTERVAL", 0.02)
+    return env
+
+
+def add_file_job(kb, filename: str, lines) -> int:
+    with open(KnowledgeFile(filename, kb.kb_name, kb.user_id).filepath, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return add_job_to_db(kb.user_id, kb.kb_name, filename)
+
+
+def wait_for_jobs(user_id: int, job_ids, timeout: float = 10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = [get_job_detail(user_id, job_id) for job_id in job_ids]
+        if all(job["status"] in ("success", "failed") for job in jobs):
+            return jobs
+        time.sleep(0.02)
+    raise AssertionError(f"jobs not finished: {jobs}")
+
+
+def run_workers(*names):
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=job_queue.run_job_worker, args=(name, stop_event), daemon=True)
+               for name in names]
+    for thread in threads:
+        thread.start()
+    return stop_event, threads
+
+
+def test_workers_process_one_job_per_knowledge_base_at_a_time(kb, worker_env):
+    worker_env["split_delay"] = 0.1
+    job_ids = [add_file_job(kb, f"{i}.txt", [f"文件{i} 第{j}段" for j in range(2)]) for i in range(3)]
+
+    stop_event, threads = run_workers("w1", "w2")
+    try:
+        jobs = wait_for_jobs(kb.user_id, job_ids)
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    assert [job["status"] for job in jobs] == ["success"] * 3
+    # 两个工作进程同时运行，但同一知识库的任务依次处理
+    assert worker_env["max_running"] == 1
+    assert sorted(kb.list_docs()) == ["0.txt", "1.txt", "2.txt"]
+    assert [job["start_time"] >= prev["end_time"] for prev, job in zip(jobs, jobs[1:])] == [True, True]
+
+
+def test_long_running_job_keeps_its_heartbeat(kb, worker_env, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_HEARTBEAT_INTERVAL", 0.05)
+    worker_env["split_delay"] = 0.6
+    job_id = add_file_job(kb, "a.txt", ["甲", "乙"])
+
+    stop_event, threads = run_workers("w1")
+    try:
+        time.sleep(0.3)
+        # 切分阶段没有进度更新，由心跳线程保持任务不被判定为超时
+        assert requeue_stale_jobs(0.2) == 0
+        job = wait_for_jobs(kb.user_id, [job_id])[0]
+    finally:
+        stop_event.set()
+        threads[0].join()
+
+    assert job["status"] == "success"
+
+
+def test_job_of_a_dead_worker_is_requeued_and_processed(kb, worker_env, monkeypatch):
+    monkeypatch.setattr(job_queue, "JOB_HEARTBEAT_EXPIRE", 0.1)
+    job_id = add_file_job(kb, "a.txt", ["甲", "乙"])
+    dead_worker = claim_job("dead")["worker"]
+
+    stop_event, threads = run_workers("w1")
+    try:
+        job = wait_for_jobs(kb.user_id, [job_id])[0]
+    finally:
+        stop_event.set()
+        threads[0].join()
+
+    assert job["status"] == "success" and job["worker"] != dead_worker
+    assert kb.list_docs() == ["a.txt"]
+    # 原工作进程恢复后不能覆盖结果
+    assert not finish_job(job_id, False, "failed", worker=dead_worker)
+
+
+def test_zero_workers_only_requeue_stale_jobs(db, monkeypatch):
+    stale = add_job_to_db(1, "kb_a", "a.txt")
+    claim_job("dead")
+    monkeypatch.setattr(job_queue, "JOB_HEARTBEAT_EXPIRE", -1)
+
+    job_queue.start_job_workers(0)
+
+    assert job_queue._workers == []
+    # 仍将上次中断的任务放回队列，由单独运行的工作进程处理
+    assert get_job_detail(1, stale)["status"] == "pending"
@@ -0,0 +1,154 @@
+import threading
+import time
+
+from server.knowledge_base.kb_cache import CachePool
+
+
+def cached_keys(pool: CachePool):
+    return list(pool._items)
+
+
+def test_evicts_least_recently_used_by_bytes():
+    pool = CachePool(max_bytes=100)
+    pool.put("a", "A", 40)
+    pool.put("b", "B", 40)
+    assert pool.get("a", loader=lambda: "reloaded", sizeof=lambda obj: 40) == "A"  # a 成为最近使用的
+
+    pool.put("c", "C", 40)
+
+    assert cached_keys(pool) == ["a", "c"]
+    stats = pool.stats()
+    assert stats["resident_bytes"] == 80
+    assert stats["evictions"] == 1
+
+
+def test_keeps_newest_item_even_if_over_budget():
+    pool = CachePool(max_bytes=100)
+    pool.put("a", "A", 40)
+    pool.put("big", "BIG", 500)
+
+    assert cached_keys(pool) == ["big"]
+    assert pool.stats()["resident_bytes"] == 500
+
+
+def test_replacing_an_item_updates_resident_bytes():
+    pool = CachePool(max_bytes=100)
+    pool.put("a", "A", 40)
+    pool.put("a", "A", 60)
+    assert pool.stats()["resident_bytes"] == 60
+    assert pool.stats()["entries"] == 1
+
+
+def test_get_counts_hits_and_misses():
+    pool = CachePool(max_bytes=100)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return {"version": len(loads)}
+
+    first = pool.get("a", loader, sizeof=lambda obj: 10)
+    assert pool.get("a", loader, sizeof=lambda obj: 10) is first
+    pool.get("b", loader, sizeof=lambda obj: 10)
+
+    stats = pool.stats()
+    assert len(loads) == 2
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 2, 2)
+    assert stats["hit_rate"] == 1 / 3
+
+
+def test_concurrent_gets_load_once():
+    pool = CachePool(max_bytes=100)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.1)
+        return object()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(pool.get("a", loader, sizeof=lambda obj: 1)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(loads) == 1
+    assert len({id(r) for r in results}) == 1
+
+
+def test_invalidate_removes_keys_with_prefix():
+    pool = CachePool(max_bytes=100)
+    pool.put((1, "kb", "m3e-base"), "kb-m3e", 10)
+    pool.put((1, "kb", "bge"), "kb-bge", 10)
+    pool.put((1, "other", "m3e-base"), "other", 10)
+    pool.put((2, "kb", "m3e-base"), "user2", 10)
+
+    assert pool.invalidate(1, "kb") == 2
+    assert cached_keys(pool) == [(1, "other", "m3e-base"), (2, "kb", "m3e-base")]
+    assert pool.stats()["resident_bytes"] == 20
+
+    pool.clear()
+    assert cached_keys(pool) == []
+    assert pool.stats()["resident_bytes"] == 0
+
+
+def test_get_reloads_items_that_fail_validation():
+    pool = CachePool(max_bytes=100)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return {"version": len(loads)}
+
+    first = pool.get("a", loader, sizeof=lambda obj: 10, validate=lambda obj: True)
+    assert pool.get("a", loader, sizeof=lambda obj: 10, validate=lambda obj: True) is first
+    reloaded = pool.get("a", loader, sizeof=lambda obj: 10, validate=lambda obj: obj["version"] > 1)
+
+    assert reloaded["version"] == 2
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["resident_bytes"]) == (1, 2, 1, 10)
+
+
+def test_on_evict_is_called_for_evicted_items():
+    evicted = []
+    pool = CachePool(max_bytes=100, on_evict=evicted.append)
+    pool.put("a", "A", 60)
+    pool.put("b", "B", 60)
+
+    assert evicted == ["A"]
+    assert pool.peek("a") is None
+    assert pool.peek("b") == "B"
+    assert pool.items() == [("b", "B")]
+
+
+def test_replacing_with_the_same_object_does_not_evict_it():
+    evicted = []
+    pool = CachePool(max_bytes=100, on_evict=evicted.append)
+    obj = object()
+    pool.put("a", obj, 10)
+    pool.put("a", obj, 20)
+
+    assert evicted == []
+    assert pool.stats()["resident_bytes"] == 20
+
+
+def test_replacing_with_a_new_object_evicts_the_old_one():
+    evicted = []
+    pool = CachePool(max_bytes=100, on_evict=evicted.append)
+    pool.put("a", "old", 10)
+    pool.put("a", "new", 10)
+
+    assert evicted == ["old"]
+    assert pool.peek("a") == "new"
+
+
+def test_invalidate_calls_on_evict():
+    evicted = []
+    pool = CachePool(max_bytes=100, on_evict=evicted.append)
+    pool.put((1, "kb"), "kb", 10)
+    pool.put((1, "other"), "other", 10)
+
+    pool.invalidate(1, "kb")
+    assert evicted == ["kb"]
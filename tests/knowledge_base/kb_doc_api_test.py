@@ -0,0 +1,115 @@
+import asyncio
+import io
+import json
+import os
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+from fastapi import UploadFile
+from langchain.docstore.document import Document
+
+from server.db.repository.knowledge_job_repository import get_job_detail
+from server.knowledge_base import kb_doc_api, upload
+from server.knowledge_base.utils import KnowledgeFile
+from server.utils import BaseResponse, JobResponse
+
+USER = SimpleNamespace(user_id=1)
+
+
+@pytest.fixture(autouse=True)
+def split_lines(monkeypatch):
+    def file2text(self, *args, **kwargs):
+        with open(self.filepath, encoding="utf-8") as f:
+            return [Document(page_content=line, metadata={"source": self.filepath}) for line in f.read().splitlines()]
+
+    monkeypatch.setattr(KnowledgeFile, "file2text", file2text)
+
+
+def upload_file(filename: str, data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename=filename)
+
+
+def upload_doc(kb, filename: str, text: str, **kwargs):
+    return asyncio.run(kb_doc_api.upload_doc(file=upload_file(filename, text.encode("utf-8")),
+                                             knowledge_base_name=kb.kb_name, override=kwargs.get("override", False),
+                                             category=None, background=kwargs.get("background", False),
+                                             current_user=USER))
+
+
+def test_upload_doc_ingests_in_the_request_by_default(kb):
+    response = upload_doc(kb, "a.txt", "甲\n乙")
+
+    assert type(response) is BaseResponse and response.code == 200
+    assert kb.list_docs() == ["a.txt"]
+    assert kb.count_chunks_by_source()[KnowledgeFile("a.txt", kb.kb_name, kb.user_id).filepath] == 2
+
+    # 覆盖上传已入库的文件时按文本段更新
+    response = upload_doc(kb, "a.txt", "甲\n丙\n丁", override=True)
+    assert response.code == 200
+    assert kb.count_chunks_by_source()[KnowledgeFile("a.txt", kb.kb_name, kb.user_id).filepath] == 3
+
+
+def test_upload_doc_in_background_returns_a_job(kb):
+    response = upload_doc(kb, "a.txt", "甲\n乙", background=True)
+
+    assert isinstance(response, JobResponse) and response.code == 200
+    assert get_job_detail(kb.user_id, response.data["job_id"])["status"] == "pending"
+    # 文件已保存，由工作进程入库
+    assert kb.list_docs() == []
+
+
+class RecordingUploadFile(UploadFile):
+    """
+    记录是否已被读取的上传文件
+    """
+
+    def __init__(self, filename: str, data: bytes):
+        super().__init__(file=io.BytesIO(data), filename=filename)
+        self.read_started = False
+
+    async def read(self, size: int = -1) -> bytes:
+        self.read_started = True
+        return await super().read(size)
+
+
+def upload_docs(kb, files):
+    """
+    返回流式响应的每一行及返回该行时已开始读取的文件
+    """
+    async def collect():
+        response = await kb_doc_api.upload_docs(files=files, knowledge_base_name=kb.kb_name, override=False,
+                                                category="法规", current_user=USER)
+        return [(json.loads(line), [f.filename for f in files if f.read_started]) async for line in response.body_iterator]
+
+    return asyncio.run(collect())
+
+
+def test_upload_docs_streams_each_file_once_saved(kb):
+    files = [RecordingUploadFile("a.txt", "甲\n乙".encode("utf-8")), RecordingUploadFile("b.txt", "丙".encode("utf-8"))]
+
+    lines = upload_docs(kb, files)
+
+    # 第一个文件的状态在读取第二个文件之前返回
+    assert lines[0] == ({"doc": "a.txt", "status": "uploaded"}, ["a.txt"])
+    assert lines[1][0] == {"doc": "b.txt", "status": "uploaded"}
+    assert [status["status"] for status, _ in lines[2:]] == ["embedded", "embedded", "committed"]
+    assert sorted(kb.list_docs()) == ["a.txt", "b.txt"]
+
+
+def test_upload_docs_reports_oversized_archives(kb, monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_ARCHIVE_MAX_FILES", 2)
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zf:
+        for i in range(3):
+            zf.writestr(f"{i}.txt", "甲")
+    files = [RecordingUploadFile("docs.zip", data.getvalue()), RecordingUploadFile("a.txt", "乙".encode("utf-8"))]
+
+    statuses = [status for status, _ in upload_docs(kb, files)]
+
+    assert statuses[0]["doc"] == "docs.zip" and statuses[0]["status"] == "failed"
+    assert "条目超过" in statuses[0]["msg"]
+    assert statuses[1] == {"doc": "a.txt", "status": "uploaded"}
+    assert statuses[-1]["status"] == "committed" and kb.list_docs() == ["a.txt"]
+    # 压缩包的临时文件已删除
+    assert not [name for name in os.listdir(upload.get_upload_path(kb.user_id, kb.kb_name))]
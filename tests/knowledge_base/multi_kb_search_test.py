@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+from server.db.repository.knowledge_base_repository import add_kb_to_db
+from server.knowledge_base import multi_kb_search
+from server.knowledge_base.kb_service.faiss_kb_service import FaissKBService, refresh_vs_cache
+from server.knowledge_base.kb_service.milvus_kb_service import MilvusKBService, UnitEmbeddings
+from server.knowledge_base.kb_service.pg_kb_service import PGKBService
+
+
+def make_docs(source: str, contents):
+    return [Document(page_content=c, metadata={"source": source}) for c in contents]
+
+
+@pytest.fixture
+def other_kb(db, kb_root):
+    kb = FaissKBService(1, "other")
+    add_kb_to_db(kb.user_id, kb.kb_name, kb.vs_type(), kb.embed_model, kb.index_type, kb.vector_codec)
+    kb.create_kb()
+    yield kb
+    refresh_vs_cache(kb.user_id, kb.kb_name)
+
+
+@pytest.fixture
+def two_kbs(kb, other_kb, embeddings, monkeypatch):
+    monkeypatch.setattr(multi_kb_search, "load_embeddings", lambda *args, **kwargs: embeddings)
+    kb.do_add_doc(make_docs("a.txt", ["甲", "乙"]), embeddings)
+    other_kb.do_add_doc(make_docs("b.txt", ["甲", "丙"]), embeddings)
+    return kb, other_kb
+
+
+def test_threshold_applies_to_normalized_scores(two_kbs):
+    docs = multi_kb_search.search_multi_kbs(1, "甲", ["samples", "other"], top_k=10, score_threshold=0.1)
+    assert sorted((d.page_content, d.metadata["kb_name"]) for d, _ in docs) == [("甲", "other"), ("甲", "samples")]
+
+    # 无关文本段的 L2 距离平方约为 2，按原始分数过滤会被阈值 1 排除，归一化后约为 0.5
+    docs = multi_kb_search.search_multi_kbs(1, "甲", ["samples", "other"], top_k=10, score_threshold=1)
+    assert len(docs) == 4
+    assert all(0 <= score <= 1 for _, score in docs)
+    assert [score for _, score in docs] == sorted(score for _, score in docs)
+
+
+def test_threshold_is_applied_to_stores_that_ignore_it(two_kbs, monkeypatch):
+    kb, other_kb = two_kbs
+    # 模拟 pg、milvus 这类检索时不按分数过滤的向量库
+    ignored = [(Document(page_content="远", metadata={"source": "c.txt"}), 1.8)]
+    monkeypatch.setattr(FaissKBService, "do_search_by_vector",
+                        lambda self, vector, top_k, score_threshold, search_params=None: ignored)
+
+    assert multi_kb_search.search_multi_kbs(1, "甲", ["samples", "other"], top_k=10, score_threshold=0.4) == []
+    docs = multi_kb_search.search_multi_kbs(1, "甲", ["samples", "other"], top_k=10, score_threshold=0.5)
+    assert [score for _, score in docs] == pytest.approx([0.45, 0.45])
+
+
+def test_stores_normalize_to_the_same_scale():
+    cos = 0.2
+    faiss_kb, pg_kb, milvus_kb = (object.__new__(cls) for cls in (FaissKBService, PGKBService, MilvusKBService))
+    assert faiss_kb.normalize_score(2 * (1 - cos)) == pytest.approx((1 - cos) / 2)
+    assert pg_kb.normalize_score(1 - cos) == pytest.approx((1 - cos) / 2)
+    assert milvus_kb.normalize_score(2 * (1 - cos)) == pytest.approx((1 - cos) / 2)
+
+
+def test_milvus_vectors_are_unit_length(embeddings):
+    unit = UnitEmbeddings(embeddings)
+    vectors = np.array(unit.embed_documents(["甲", "乙"]) + [unit.embed_query("丙")])
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1, rtol=1e-5)
+
+
+@pytest.mark.parametrize("name, names", [(None, None), ("samples", ["other"])])
+def test_chat_requires_exactly_one_kb_argument(name, names):
+    pytest.importorskip("openai")
+    from server.chat.knowledge_base_chat import knowledge_base_chat
+    response = knowledge_base_chat("你好", name, names, 3, 1, [], False, False, None, None, None,
+                                   current_user=SimpleNamespace(user_id=1))
+    assert response.code == 400
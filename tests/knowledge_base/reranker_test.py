@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from langchain.docstore.document import Document
+
+from server.knowledge_base import reranker as reranker_module
+from server.knowledge_base.reranker import Reranker, load_reranker, rerank_docs
+from server.knowledge_base.utils import embeddings_pool
+
+
+class FakeCrossEncoder:
+    """
+    按文本段中与问题相同的字数打分，记录每次前向计算的文本对
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.error = None
+        self.model = self
+
+    def parameters(self):
+        import torch
+        return [torch.zeros(256)]
+
+    def predict(self, pairs, **kwargs):
+        if self.error:
+            raise self.error
+        self.calls.append(pairs)
+        return np.array([sum(c in text for c in query) for query, text in pairs], dtype=np.float32)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeCrossEncoder()
+
+    def _load_model(self):
+        self._model = self._model or model
+        return self._model
+
+    monkeypatch.setattr(Reranker, "_load_model", _load_model)
+    return model
+
+
+def docs(*contents, source="a.txt"):
+    return [Document(page_content=c, metadata={"source": source}) for c in contents]
+
+
+def test_scores_are_cached_by_query_and_content(model):
+    reranker = Reranker("fake", latency_budget=None)
+    ranked = reranker.rerank("劳动合同", docs("用人单位", "劳动合同期限", "劳动报酬"), top_k=2)
+    assert [d.page_content for d, _ in ranked] == ["劳动合同期限", "劳动报酬"]
+    assert len(model.calls) == 1
+
+    # 来源不同、内容相同的文本段命中缓存，只计算新的文本对
+    reranker.rerank("劳动合同", docs("劳动合同期限", "试用期", source="b.txt"), top_k=2)
+    assert model.calls[-1] == [("劳动合同", "试用期")]
+
+    reranker.rerank("试用期", docs("劳动合同期限"), top_k=1)
+    assert model.calls[-1] == [("试用期", "劳动合同期限")]
+    assert reranker.stats()["cache_hits"] == 1
+    assert reranker.stats()["cache_misses"] == 5
+
+
+def test_rerank_is_skipped_over_the_latency_budget(model):
+    reranker = Reranker("fake", latency_budget=0.1, probe_interval=60)
+    reranker.rerank("劳动合同", docs("用人单位"), top_k=1)
+    reranker._pair_seconds = 1.0
+
+    assert reranker.rerank("劳动合同", docs("劳动合同期限", "劳动报酬"), top_k=2) is None
+    assert reranker.stats()["skipped"] == 1
+    # 全部命中缓存时不需要前向计算，不受预算限制
+    assert reranker.rerank("劳动合同", docs("用人单位"), top_k=1) is not None
+
+
+def test_rerank_docs_keeps_the_input_order_when_skipped_or_failing(model, monkeypatch):
+    reranker = Reranker("fake", latency_budget=None)
+    monkeypatch.setattr(reranker_module, "load_reranker", lambda: reranker)
+    candidates = docs("用人单位", "劳动合同期限", "劳动报酬")
+
+    assert [d.page_content for d in rerank_docs("劳动合同", candidates, 2)] == ["劳动合同期限", "劳动报酬"]
+
+    model.error = RuntimeError("CUDA out of memory")
+    assert rerank_docs("劳动合同", docs("试用期", "工资", "加班"), 2) == docs("试用期", "工资")
+    assert reranker.stats()["pending_pairs"] == 0
+
+    monkeypatch.setattr(reranker, "rerank", lambda *args: None)
+    assert rerank_docs("劳动合同", candidates, 2) == candidates[:2]
+
+
+def test_reranker_lives_in_the_model_pool(model):
+    key = ("reranker", "fake", "cpu")
+    try:
+        reranker = load_reranker("fake", "cpu")
+        assert load_reranker("fake", "cpu") is reranker
+        assert dict(embeddings_pool.items())[key] is reranker
+        assert reranker.nbytes == 256 * 4
+
+        embeddings_pool.invalidate(*key)
+        assert reranker._model is None
+        assert load_reranker("fake", "cpu") is not reranker
+    finally:
+        embeddings_pool.invalidate(*key)
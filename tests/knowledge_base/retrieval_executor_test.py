@@ -0,0 +1,49 @@
+import asyncio
+import threading
+import time
+
+from server.knowledge_base.kb_service.base import run_in_retrieval_executor
+from server.knowledge_base.kb_service.faiss_kb_service import FaissKBService
+
+
+def slow_search(query: str, top_k: int = 3):
+    time.sleep(0.3)
+    return threading.current_thread().name, query, top_k
+
+
+def test_retrieval_does_not_block_the_event_loop():
+    async def main():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        result = await run_in_retrieval_executor(slow_search, "你好", top_k=5)
+        task.cancel()
+        return result, ticks
+
+    (thread_name, query, top_k), ticks = asyncio.run(main())
+    assert thread_name.startswith("retrieval")
+    assert (query, top_k) == ("你好", 5)
+    # 检索期间事件循环仍在调度其他协程
+    assert len(ticks) > 10
+
+
+def test_asearch_docs_runs_search_docs_in_the_executor(monkeypatch):
+    kb = FaissKBService(1, "samples")
+    calls = []
+
+    def search_docs(query, top_k, score_threshold, search_params, filters):
+        calls.append((threading.current_thread().name, query, top_k, score_threshold, search_params, filters))
+        return ["doc"]
+
+    monkeypatch.setattr(kb, "search_docs", search_docs)
+    docs = asyncio.run(kb.asearch_docs("你好", 3, 0.5, {"search_mode": "vector"}, {"category": "法规"}))
+
+    assert docs == ["doc"]
+    thread_name, *args = calls[0]
+    assert thread_name.startswith("retrieval")
+    assert args == ["你好", 3, 0.5, {"search_mode": "vector"}, {"category": "法规"}]
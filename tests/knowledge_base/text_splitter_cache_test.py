@@ -0,0 +1,64 @@
+import pytest
+
+from server.knowledge_base import utils
+from server.knowledge_base.utils import get_text_splitter, text_splitter_stats
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(utils, "_text_splitters", {})
+    monkeypatch.setattr(utils, "_text_splitter_usage", {})
+
+
+def test_splitter_is_built_once_per_key():
+    first = get_text_splitter("RecursiveCharacterTextSplitter", chunk_size=100, chunk_overlap=10)
+    assert get_text_splitter("RecursiveCharacterTextSplitter", chunk_size=100, chunk_overlap=10) is first
+    assert get_text_splitter("RecursiveCharacterTextSplitter", chunk_size=200, chunk_overlap=10) is not first
+
+    stats = text_splitter_stats()
+    assert stats["RecursiveCharacterTextSplitter@100@10"]["uses"] == 2
+    assert stats["RecursiveCharacterTextSplitter@100@10"]["loads"] == 1
+    assert stats["RecursiveCharacterTextSplitter@200@10"]["loads"] == 1
+
+
+def test_project_splitters_are_resolved():
+    splitter = get_text_splitter("ChineseTextSplitter", chunk_size=100, chunk_overlap=0)
+    assert type(splitter).__name__ == "ChineseTextSplitter"
+    # pipeline 只对 SpacyTextSplitter 有效，不影响其他分词器的缓存
+    assert get_text_splitter("ChineseTextSplitter", chunk_size=100, chunk_overlap=0, pipeline="other") is splitter
+
+
+def test_construction_errors_are_raised_and_reported(monkeypatch):
+    def broken(*args):
+        raise ImportError("no spacy")
+
+    monkeypatch.setattr(utils, "_create_text_splitter", broken)
+    with pytest.raises(ImportError):
+        get_text_splitter("SpacyTextSplitter")
+    key = f"SpacyTextSplitter@{utils.CHUNK_SIZE}@{utils.OVERLAP_SIZE}@zh_core_web_sm"
+    assert text_splitter_stats()[key]["error"] == "no spacy"
+
+
+def test_failures_are_retried_after_the_retry_interval(monkeypatch):
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ImportError("no spacy")
+        return "splitter"
+
+    monkeypatch.setattr(utils, "_create_text_splitter", flaky)
+    with pytest.raises(ImportError):
+        get_text_splitter("SpacyTextSplitter")
+    # 重试间隔内不再构建
+    with pytest.raises(ImportError):
+        get_text_splitter("SpacyTextSplitter")
+    assert len(calls) == 1
+
+    monkeypatch.setattr(utils, "TEXT_SPLITTER_RETRY_INTERVAL", 0)
+    assert get_text_splitter("SpacyTextSplitter") == "splitter"
+    assert get_text_splitter("SpacyTextSplitter") == "splitter"
+    assert len(calls) == 2
+    key = f"SpacyTextSplitter@{utils.CHUNK_SIZE}@{utils.OVERLAP_SIZE}@zh_core_web_sm"
+    assert text_splitter_stats()[key]["error"] is None
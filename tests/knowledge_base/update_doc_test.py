@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+from langchain.docstore.document import Document
+
+from server.knowledge_base.utils import KnowledgeFile, diff_chunks
+
+
+def doc(content: str, source: str = "a.txt", **metadata) -> Document:
+    return Document(page_content=content, metadata={"source": source, **metadata})
+
+
+def test_diff_chunks_reuses_unchanged_chunks():
+    old = {1: doc("甲"), 2: doc("乙"), 3: doc("丙")}
+    added, removed, reused = diff_chunks(old, [doc("甲"), doc("丙"), doc("丁")])
+
+    assert [d.page_content for d in added] == ["丁"]
+    assert removed == [2]
+    assert reused == 2
+
+
+def test_diff_chunks_matches_duplicates_by_count():
+    old = {1: doc("甲"), 2: doc("甲"), 3: doc("乙")}
+
+    added, removed, reused = diff_chunks(old, [doc("甲"), doc("乙"), doc("乙")])
+    assert [d.page_content for d in added] == ["乙"]
+    assert len(removed) == 1 and removed[0] in (1, 2)
+    assert reused == 2
+
+    added, removed, reused = diff_chunks(old, [doc("甲"), doc("甲"), doc("甲"), doc("乙")])
+    assert [d.page_content for d in added] == ["甲"]
+    assert removed == []
+    assert reused == 3
+
+
+def test_diff_chunks_compares_metadata():
+    added, removed, reused = diff_chunks({1: doc("甲", page=1)}, [doc("甲", page=2)])
+    assert [d.metadata["page"] for d in added] == [2]
+    assert removed == [1]
+    assert reused == 0
+
+
+def test_update_doc_only_embeds_changed_chunks(kb, embeddings):
+    kb_file = SimpleNamespace(filepath="/docs/a.txt")
+    paragraphs = [f"第{i}条 规定内容" for i in range(6)]
+    kb.do_add_doc([doc(p, kb_file.filepath) for p in paragraphs], embeddings)
+    embeddings.embedded.clear()
+
+    paragraphs[2] = "第2条 修改后的规定内容"
+    paragraphs.append("第6条 新增的规定内容")
+    result = kb.do_update_doc(kb_file, [doc(p, kb_file.filepath) for p in paragraphs], embeddings)
+
+    assert result == {"reused": 5, "added": 2, "deleted": 1}
+    assert sorted(embeddings.embedded) == ["第2条 修改后的规定内容", "第6条 新增的规定内容"]
+    assert kb.load_vector_store().chunks.count_by_source() == {kb_file.filepath: 7}
+
+    results = kb.do_search("第2条 规定内容", top_k=7, score_threshold=4)
+    assert sorted(d.page_content for d, _ in results) == sorted(paragraphs)
+
+    embeddings.embedded.clear()
+    assert kb.do_update_doc(kb_file, [doc(p, kb_file.filepath) for p in paragraphs], embeddings) == {
+        "reused": 7, "added": 0, "deleted": 0}
+    assert embeddings.embedded == []
+
+
+def test_update_doc_keeps_bm25_and_database_in_step(kb, embeddings):
+    kb_file = KnowledgeFile("a.txt", kb.kb_name, kb.user_id)
+    with open(kb_file.filepath, "w", encoding="utf-8") as f:
+        f.write("a")
+    kb.add_doc(kb_file, [doc("劳动合同应当以书面形式订立", kb_file.filepath),
+                         doc("用人单位应当支付劳动报酬", kb_file.filepath)], embeddings)
+
+    result = kb.update_doc(kb_file, [doc("劳动合同应当以书面形式订立", kb_file.filepath),
+                                     doc("试用期包含在劳动合同期限内", kb_file.filepath)], embeddings)
+
+    assert result == {"reused": 1, "added": 1, "deleted": 1}
+    assert kb.bm25_index.count() == 2
+    assert [d.page_content for d, _ in kb.bm25_index.search("试用期", top_k=3)] == ["试用期包含在劳动合同期限内"]
+    assert kb.list_docs() == ["a.txt"]
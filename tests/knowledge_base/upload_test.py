@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from fastapi import UploadFile
+
+from server.knowledge_base import upload, utils
+from server.knowledge_base.upload import (append_upload_part, commit_upload, create_upload_session,
+                                          drop_upload_session, extract_archive, finish_upload_session, is_archive,
+                                          load_upload_session, receive_upload)
+
+DATA = "知识库分块上传测试内容。".encode("utf-8") * 20
+
+
+def upload_file(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename="a.txt")
+
+
+@pytest.fixture(autouse=True)
+def kb_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "KB_ROOT_PATH", str(tmp_path))
+    monkeypatch.setattr(upload, "UPLOAD_CHUNK_SIZE", 64)
+    return tmp_path
+
+
+def test_receive_upload_streams_to_a_temp_file(kb_root):
+    tmp_path, size, sha256 = asyncio.run(receive_upload(upload_file(DATA), 1, "samples"))
+
+    assert os.path.dirname(tmp_path) == str(kb_root / "1" / "samples" / "uploads")
+    assert (size, sha256) == (len(DATA), hashlib.sha256(DATA).hexdigest())
+    target = kb_root / "1" / "samples" / "content" / "a.txt"
+    commit_upload(tmp_path, str(target))
+    assert target.read_bytes() == DATA
+    assert not os.path.exists(tmp_path)
+
+
+def test_chunked_upload_resumes_from_received_bytes():
+    session = create_upload_session(1, "samples", "a.txt", len(DATA), hashlib.sha256(DATA).hexdigest().upper())
+    upload_id = session["upload_id"]
+
+    asyncio.run(append_upload_part(session, 0, upload_file(DATA[:100])))
+    # 模拟断线：第二个分块只写入了一部分
+    session = load_upload_session(1, "samples", upload_id)
+    asyncio.run(append_upload_part(session, 100, upload_file(DATA[100:150])))
+
+    session = load_upload_session(1, "samples", upload_id)
+    assert session["received"] == 150
+    # 重传时从更早的位置覆盖
+    asyncio.run(append_upload_part(session, 120, upload_file(DATA[120:])))
+
+    session = load_upload_session(1, "samples", upload_id)
+    data_file, sha256 = finish_upload_session(session)
+    assert sha256 == hashlib.sha256(DATA).hexdigest()
+    with open(data_file, "rb") as f:
+        assert f.read() == DATA
+
+    drop_upload_session(session)
+    assert load_upload_session(1, "samples", upload_id) == {}
+
+
+def test_chunked_upload_rejects_gaps_oversize_and_bad_checksums():
+    session = create_upload_session(1, "samples", "a.txt", 10, hashlib.sha256(b"0123456789").hexdigest())
+    with pytest.raises(ValueError):
+        asyncio.run(append_upload_part(session, 5, upload_file(b"56789")))
+    with pytest.raises(ValueError):
+        asyncio.run(append_upload_part(session, 0, upload_file(b"0123456789abc")))
+
+    session = load_upload_session(1, "samples", session["upload_id"])
+    asyncio.run(append_upload_part(session, 0, upload_file(b"0123")))
+    with pytest.raises(ValueError):
+        finish_upload_session(session)
+
+    asyncio.run(append_upload_part(session, 4, upload_file(b"xxxxxx")))
+    with pytest.raises(ValueError):
+        finish_upload_session(session)
+
+
+def test_invalid_upload_ids_are_rejected():
+    with pytest.raises(ValueError):
+        load_upload_session(1, "samples", "../../etc")
+
+
+def test_expired_sessions_are_removed(monkeypatch):
+    old = create_upload_session(1, "samples", "a.txt", 10)
+    monkeypatch.setattr(upload, "UPLOAD_SESSION_EXPIRE", -1)
+    create_upload_session(1, "samples", "b.txt", 10)
+    assert load_upload_session(1, "samples", old["upload_id"]) == {}
+
+
+def test_zip_members_are_extracted_flat_with_gbk_names(tmp_path):
+    archive = tmp_path / "docs.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("docs/", "")
+        zf.writestr("docs/utf8说明.txt", "甲")
+        zf.writestr("docs/gbk____.txt", "乙")
+    # Windows 中文系统打包时文件名为 GBK 编码，未设置 UTF-8 标志
+    archive.write_bytes(archive.read_bytes().replace(b"gbk____", "gbk说明".encode("gbk")))
+    target = tmp_path / "out"
+    target.mkdir()
+
+    members = list(extract_archive(str(archive), "docs.zip", str(target)))
+
+    assert [name for name, _ in members] == ["utf8说明.txt", "gbk说明.txt"]
+    assert [open(path, encoding="utf-8").read() for _, path in members] == ["甲", "乙"]
+    assert all(os.path.dirname(path) == str(target) for _, path in members)
+
+
+def test_tar_members_skip_links(tmp_path):
+    source = tmp_path / "a.txt"
+    source.write_text("甲", encoding="utf-8")
+    archive = tmp_path / "docs.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        tf.add(source, arcname="sub/a.txt")
+        link = tarfile.TarInfo("sub/link.txt")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc/passwd"
+        tf.addfile(link)
+    target = tmp_path / "out"
+    target.mkdir()
+
+    assert is_archive("docs.tar.gz") and is_archive("DOCS.ZIP") and not is_archive("a.txt")
+    members = list(extract_archive(str(archive), "docs.tar.gz", str(target)))
+    assert [name for name, _ in members] == ["a.txt"]
+
+
+def test_zip_over_the_limits_is_rejected_before_extracting(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_ARCHIVE_MAX_FILES", 3)
+    monkeypatch.setattr(upload, "UPLOAD_ARCHIVE_MAX_SIZE", 1000)
+    target = tmp_path / "out"
+    target.mkdir()
+
+    many = tmp_path / "many.zip"
+    with zipfile.ZipFile(many, "w") as zf:
+        for i in range(4):
+            zf.writestr(f"{i}.txt", "甲")
+    # 高压缩率的大文件
+    bomb = tmp_path / "bomb.zip"
+    with zipfile.ZipFile(bomb, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("a.txt", "甲")
+        zf.writestr("b.txt", b"\0" * 2000)
+
+    with pytest.raises(ValueError, match="条目超过"):
+        next(extract_archive(str(many), "many.zip", str(target)))
+    with pytest.raises(ValueError, match="解压后超过"):
+        next(extract_archive(str(bomb), "bomb.zip", str(target)))
+    assert os.listdir(target) == []
+
+
+def test_tar_stops_at_the_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload, "UPLOAD_ARCHIVE_MAX_SIZE", 1000)
+    archive = tmp_path / "docs.tar.gz"
+    with tarfile.open(archive, "w:gz") as tf:
+        for name, size in (("a.txt", 600), ("b.txt", 600)):
+            info = tarfile.TarInfo(name)
+            info.size = size
+            tf.addfile(info, io.BytesIO(b"\0" * size))
+    target = tmp_path / "out"
+    target.mkdir()
+
+    members = extract_archive(str(archive), "docs.tar.gz", str(target))
+    assert next(members)[0] == "a.txt"
+    with pytest.raises(ValueError, match="解压后超过"):
+        next(members)
+    # 超限的文件没有写入磁盘
+    assert len(os.listdir(target)) == 1
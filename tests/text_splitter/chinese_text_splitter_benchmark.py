@@ -0,0 +1,39 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+from text_splitter import ChineseTextSplitter
+from legacy_splitter import legacy_split_text, make_corpus
+
+
+def benchmark(splitter: ChineseTextSplitter, text: str, name: str):
+    start = time.perf_counter()
+    expected = legacy_split_text(splitter, text)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = splitter.split_text(text)
+    current = time.perf_counter() - start
+    print(f"{name}: {len(text)} chars, {len(actual)} sentences, "
+          f"legacy {legacy:.3f}s, current {current:.3f}s ({legacy / current:.1f}x), "
+          f"identical: {actual == expected}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对比 ChineseTextSplitter.split_text 改写前后的耗时与结果")
+    parser.add_argument("files", nargs="*", help="语料文件（utf-8），不指定时使用生成的语料")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100_000, 400_000, 1_600_000],
+                        help="生成语料的字符数")
+    parser.add_argument("--sentence-size", type=int, default=100)
+    parser.add_argument("--pdf", action="store_true")
+    args = parser.parse_args()
+
+    splitter = ChineseTextSplitter(pdf=args.pdf, sentence_size=args.sentence_size)
+    if args.files:
+        for file in args.files:
+            with open(file, encoding="utf-8") as f:
+                benchmark(splitter, f.read(), file)
+    else:
+        for size in args.sizes:
+            benchmark(splitter, make_corpus(size), f"corpus-{size}")
@@ -0,0 +1,61 @@
+import pytest
+
+from text_splitter import ChineseTextSplitter
+
+
+def test_splits_sentences_and_keeps_closing_quotes():
+    splitter = ChineseTextSplitter(sentence_size=100)
+    text = "第一条 为了规范行政许可。“申请人应当如实提交材料！”行政机关应当审查？\n\n第二条 本法自公布之日起施行……附则"
+    assert splitter.split_text(text) == ["第一条 为了规范行政许可。",
+                                         "“申请人应当如实提交材料！”",
+                                         "行政机关应当审查？",
+                                         "第二条 本法自公布之日起施行……",
+                                         "附则"]
+
+
+def test_long_sentences_split_by_comma_then_whitespace():
+    splitter = ChineseTextSplitter(sentence_size=12)
+    text = "申请人应当如实提交材料，行政机关应当在二十日内作出决定。alpha beta gamma delta epsilon"
+    assert splitter.split_text(text) == ["申请人应当如实提交材料，",
+                                         "行政机关应当在二十日内作出决定。",
+                                         "alpha ", "beta ", "gamma ", "delta ", "epsilon"]
+
+
+def test_duplicate_long_sentences_are_split_in_place():
+    splitter = ChineseTextSplitter(sentence_size=12)
+    sentence = "申请人应当如实提交有关材料，并对其申请材料实质内容的真实性负责。"
+    pieces = ["申请人应当如实提交有关材料，", "并对其申请材料实质内容的真实性负责。"]
+    short = "行政机关依法审查。"
+
+    assert splitter.split_text(sentence * 3) == pieces * 3
+    assert splitter.split_text(sentence + short + sentence) == pieces + [short] + pieces
+
+    clause = "alpha beta gamma delta"
+    line = f"{clause}  {clause}，{clause}  {clause}。"
+    words = ["alpha ", "beta ", "gamma ", "delta"]
+    expected = words[:3] + ["delta  "] + words[:3] + ["delta，"] + words[:3] + ["delta  "] + words[:3] + ["delta。"]
+    assert splitter.split_text(line * 2) == expected * 2
+
+
+def test_iter_split_text_is_lazy():
+    splitter = ChineseTextSplitter(sentence_size=100)
+    sentences = splitter.iter_split_text("第一句。第二句。第三句。")
+    assert next(sentences) == "第一句。"
+    assert list(sentences) == ["第二句。", "第三句。"]
+
+
+@pytest.mark.parametrize("pdf", [False, True])
+@pytest.mark.parametrize("sentence_size", [20, 100, 250])
+def test_matches_legacy_implementation(pdf, sentence_size, legacy_split_text, make_corpus):
+    splitter = ChineseTextSplitter(pdf=pdf, sentence_size=sentence_size)
+    text = make_corpus(20_000, seed=sentence_size)
+    assert splitter.split_text(text) == legacy_split_text(splitter, text)
+
+
+def test_matches_legacy_implementation_with_repeated_paragraphs(legacy_split_text, make_corpus):
+    splitter = ChineseTextSplitter(sentence_size=30)
+    paragraph = make_corpus(2_000, seed=1)
+    text = paragraph * 3
+    sentences = splitter.split_text(text)
+    assert sentences == legacy_split_text(splitter, text)
+    assert sentences == splitter.split_text(paragraph) * 3
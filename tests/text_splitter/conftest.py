@@ -0,0 +1,13 @@
+import pytest
+
+import legacy_splitter
+
+
+@pytest.fixture
+def legacy_split_text():
+    return legacy_splitter.legacy_split_text
+
+
+@pytest.fixture
+def make_corpus():
+    return legacy_splitter.make_corpus
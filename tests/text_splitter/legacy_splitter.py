@@ -0,0 +1,72 @@
+import random
+import re
+
+from text_splitter import ChineseTextSplitter
+
+
+_CLAUSES = [
+    "申请人应当如实提交有关材料和反映真实情况",
+    "并对其申请材料实质内容的真实性负责",
+    "行政机关应当自受理行政许可申请之日起二十日内作出行政许可决定",
+    "二十日内不能作出决定的，经本行政机关负责人批准，可以延长十日",
+    "The quick brown fox jumps over the lazy dog",
+    "依法应当先经下级行政机关审查后报上级行政机关决定的行政许可",
+    "“公民、法人或者其他组织对行政机关实施行政许可，享有陈述权、申辩权”",
+    "符合法定条件、标准的，申请人有依法取得行政许可的平等权利",
+    "version 2.0 of the  rules  applies  to  all  applicants",
+]
+_ENDINGS = ["。", "！", "？", "；", "……", "......", "”。", "，", ",", "  "]
+
+
+def legacy_split_text(splitter: ChineseTextSplitter, text: str):
+    """
+    改写前的 split_text，作为对照
+    """
+    if splitter.pdf:
+        text = re.sub(r"\n{3,}", r"\n", text)
+        text = re.sub('\s', " ", text)
+        text = re.sub("\n\n", "", text)
+
+    text = re.sub(r'([;；.!?。！？\?])([^”’])', r"\1\n\2", text)
+    text = re.sub(r'(\.{6})([^"’”」』])', r"\1\n\2", text)
+    text = re.sub(r'(\…{2})([^"’”」』])', r"\1\n\2", text)
+    text = re.sub(r'([;；!?。！？\?]["’”」』]{0,2})([^;；!?，。！？\?])', r'\1\n\2', text)
+    text = text.rstrip()
+    ls = [i for i in text.split("\n") if i]
+    for ele in ls:
+        if len(ele) > splitter.sentence_size:
+            ele1 = re.sub(r'([,，.]["’”」』]{0,2})([^,，.])', r'\1\n\2', ele)
+            ele1_ls = ele1.split("\n")
+            for ele_ele1 in ele1_ls:
+                if len(ele_ele1) > splitter.sentence_size:
+                    ele_ele2 = re.sub(r'([\n]{1,}| {2,}["’”」』]{0,2})([^\s])', r'\1\n\2', ele_ele1)
+                    ele2_ls = ele_ele2.split("\n")
+                    for ele_ele2 in ele2_ls:
+                        if len(ele_ele2) > splitter.sentence_size:
+                            ele_ele3 = re.sub('( ["’”」』]{0,2})([^ ])', r'\1\n\2', ele_ele2)
+                            ele2_id = ele2_ls.index(ele_ele2)
+                            ele2_ls = ele2_ls[:ele2_id] + [i for i in ele_ele3.split("\n") if i] + ele2_ls[
+                                                                                                   ele2_id + 1:]
+                    ele_id = ele1_ls.index(ele_ele1)
+                    ele1_ls = ele1_ls[:ele_id] + [i for i in ele2_ls if i] + ele1_ls[ele_id + 1:]
+
+            id = ls.index(ele)
+            ls = ls[:id] + [i for i in ele1_ls if i] + ls[id + 1:]
+    return ls
+
+
+def make_corpus(size: int, seed: int = 0) -> str:
+    """
+    生成约 size 个字符的中文语料，带段落编号以避免重复句子，夹杂英文、省略号、引号和不含句号的超长句子
+    """
+    rnd = random.Random(seed)
+    parts = []
+    length = 0
+    n = 0
+    while length < size:
+        n += 1
+        clauses = [f"第{n}条"] + [rnd.choice(_CLAUSES) + rnd.choice(_ENDINGS) for _ in range(rnd.randint(1, 30))]
+        paragraph = "".join(clauses) + "\n" * rnd.randint(1, 3)
+        parts.append(paragraph)
+        length += len(paragraph)
+    return "".join(parts)
@@ -1,9 +1,26 @@
 from langchain.text_splitter import CharacterTextSplitter
 import re
-from typing import List
+from typing import Iterator, List
 from configs.model_config import CHUNK_SIZE
 
 
+_SENTENCE_RULES = [
+    (re.compile(r'([;；.!?。！？\?])([^”’])'), r"\1\n\2"),  # 单字符断句符
+    (re.compile(r'(\.{6})([^"’”」』])'), r"\1\n\2"),  # 英文省略号
+    (re.compile(r'(\…{2})([^"’”」』])'), r"\1\n\2"),  # 中文省略号
+    # 如果双引号前有终止符，那么双引号才是句子的终点，把分句符\n放到双引号后，注意前面的几句都小心保留了双引号
+    (re.compile(r'([;；!?。！？\?]["’”」』]{0,2})([^;；!?，。！？\?])'), r'\1\n\2'),
+]
+# 很多规则中会考虑分号;，但是这里我把它忽略不计，破折号、英文双引号等同样忽略，需要的再做些简单调整即可。
+# 超过 sentence_size 的句子依次按逗号、连续空白、单个空格继续切分
+_LONG_SENTENCE_RULES = [
+    (re.compile(r'([,，.]["’”」』]{0,2})([^,，.])'), r'\1\n\2'),
+    (re.compile(r'([\n]{1,}| {2,}["’”」』]{0,2})([^\s])'), r'\1\n\2'),
+    (re.compile('( ["’”」』]{0,2})([^ ])'), r'\1\n\2'),
+]
+_LINE = re.compile(r"[^\n]+")
+
+
 class ChineseTextSplitter(CharacterTextSplitter):
     def __init__(self, pdf: bool = False, sentence_size: int = CHUNK_SIZE, **kwargs):
         super().__init__(**kwargs)
@@ -24,37 +41,29 @@ class ChineseTextSplitter(CharacterTextSplitter):
                 sent_list.append(ele)
         return sent_list
 
-    def split_text(self, text: str) -> List[str]:   ##此处需要进一步优化逻辑
+    def iter_split_text(self, text: str) -> Iterator[str]:
+        """
+        按 split_text 的规则断句，依次产出句子。断句规则在全文上各执行一次，
+        超长句子只在其自身范围内按逗号、连续空白、单个空格逐级细分，耗时与文本长度成线性关系
+        """
         if self.pdf:
             text = re.sub(r"\n{3,}", r"\n", text)
             text = re.sub('\s', " ", text)
             text = re.sub("\n\n", "", text)
 
-        text = re.sub(r'([;；.!?。！？\?])([^”’])', r"\1\n\2", text)  # 单字符断句符
-        text = re.sub(r'(\.{6})([^"’”」』])', r"\1\n\2", text)  # 英文省略号
-        text = re.sub(r'(\…{2})([^"’”」』])', r"\1\n\2", text)  # 中文省略号
-        text = re.sub(r'([;；!?。！？\?]["’”」』]{0,2})([^;；!?，。！？\?])', r'\1\n\2', text)
-        # 如果双引号前有终止符，那么双引号才是句子的终点，把分句符\n放到双引号后，注意前面的几句都小心保留了双引号
-        text = text.rstrip()  # 段尾如果有多余的\n就去掉它
-        # 很多规则中会考虑分号;，但是这里我把它忽略不计，破折号、英文双引号等同样忽略，需要的再做些简单调整即可。
-        ls = [i for i in text.split("\n") if i]
-        for ele in ls:
-            if len(ele) > self.sentence_size:
-                ele1 = re.sub(r'([,，.]["’”」』]{0,2})([^,，.])', r'\1\n\2', ele)
-                ele1_ls = ele1.split("\n")
-                for ele_ele1 in ele1_ls:
-                    if len(ele_ele1) > self.sentence_size:
-                        ele_ele2 = re.sub(r'([\n]{1,}| {2,}["’”」』]{0,2})([^\s])', r'\1\n\2', ele_ele1)
-                        ele2_ls = ele_ele2.split("\n")
-                        for ele_ele2 in ele2_ls:
-                            if len(ele_ele2) > self.sentence_size:
-                                ele_ele3 = re.sub('( ["’”」』]{0,2})([^ ])', r'\1\n\2', ele_ele2)
-                                ele2_id = ele2_ls.index(ele_ele2)
-                                ele2_ls = ele2_ls[:ele2_id] + [i for i in ele_ele3.split("\n") if i] + ele2_ls[
-                                                                                                       ele2_id + 1:]
-                        ele_id = ele1_ls.index(ele_ele1)
-                        ele1_ls = ele1_ls[:ele_id] + [i for i in ele2_ls if i] + ele1_ls[ele_id + 1:]
-
-                id = ls.index(ele)
-                ls = ls[:id] + [i for i in ele1_ls if i] + ls[id + 1:]
-        return ls
+        for pattern, repl in _SENTENCE_RULES:
+            text = pattern.sub(repl, text)
+        # 段尾如果有多余的\n就去掉它
+        for match in _LINE.finditer(text.rstrip()):
+            yield from self._split_long_sentence(match.group(), 0)
+
+    def _split_long_sentence(self, sentence: str, level: int) -> Iterator[str]:
+        if level == len(_LONG_SENTENCE_RULES) or len(sentence) <= self.sentence_size:
+            yield sentence
+            return
+        pattern, repl = _LONG_SENTENCE_RULES[level]
+        for match in _LINE.finditer(pattern.sub(repl, sentence)):
+            yield from self._split_long_sentence(match.group(), level + 1)
+
+    def split_text(self, text: str) -> List[str]:
+        return list(self.iter_split_text(text))